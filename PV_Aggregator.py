@@ -0,0 +1,158 @@
+# Laufende Aggregation pro Register zwischen zwei Datenbank-Schreibvorgängen.
+# Statt jede Abfrage als Kopie zu puffern, werden pro Register nur Zähler gehalten
+# (Anzahl, Summe, Min, Max, letzter Wert, erster/letzter Zeitstempel). Der Speicherbedarf
+# ist damit unabhängig von DB_UPDATE_INTERVAL.
+#
+# Die Abfrage liefert nur geänderte Werte (PV_Deadband): ein Wert gilt deshalb vom Zeitpunkt
+# seiner Meldung bis zur nächsten Änderung (Sample & Hold). Der Mittelwert ist das
+# Zeitintegral geteilt durch die abgedeckte Zeit; das Integral (Wert * Sekunden) erlaubt
+# z.B. die Energie (Ws) aus einer Leistung zu berechnen.
+#
+# Gehalten wird nur, solange das Gerät antwortet: eine fehlgeschlagene Abfrage beendet den
+# gehaltenen Wert sofort (expire), und ohne bestätigte Abfrage endet er nach MAX_HOLD Sekunden
+# (z.B. wenn das Gerät im Timeout hängt). Während eines Ausfalls entstehen so keine Zeilen
+# mit eingefrorenen Werten.
+
+import threading
+
+MAX_HOLD = 120   # Sekunden ohne bestätigte Abfrage, nach denen gehaltene Werte nicht mehr gelten
+
+
+class RegisterAccumulator:
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'last', 'first_ts', 'last_ts',
+                 'hold_since', 'integral', 'duration')
+
+    def __init__(self):
+        self.count = 0           # Anzahl gemeldeter Werte im Fenster
+        self.total = 0.0         # Summe der gemeldeten Werte
+        self.minimum = None
+        self.maximum = None
+        self.last = None         # Zuletzt gemeldeter (gehaltener) Wert
+        self.first_ts = None     # Zeitstempel des ersten Werts im Fenster
+        self.last_ts = None      # Zeitstempel des letzten Werts im Fenster
+        self.hold_since = None   # Seit wann der gehaltene Wert gilt
+        self.integral = 0.0      # Zeitintegral des Werts (Wert * Sekunden)
+        self.duration = 0.0      # Zeit, in der ein gültiger Wert vorlag
+
+    def _advance(self, timestamp):
+        """Rechnet den gehaltenen Wert bis 'timestamp' in das Integral ein"""
+        if self.last is not None and self.hold_since is not None and timestamp > self.hold_since:
+            span = timestamp - self.hold_since
+            self.integral += self.last * span
+            self.duration += span
+        self.hold_since = timestamp
+
+    def add(self, value, timestamp):
+        self._advance(timestamp)
+        if not isinstance(value, (int, float)):
+            # Lesefehler (None) oder Text: der gehaltene Wert endet hier
+            self.last = None
+            return
+        self.last = value
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if self.first_ts is None:
+            self.first_ts = timestamp
+        self.last_ts = timestamp
+
+    def end_hold(self, timestamp):
+        """Der gehaltene Wert gilt nur bis 'timestamp' (Gerät nicht mehr erreichbar)"""
+        self._advance(timestamp)
+        self.last = None
+
+    def close_window(self, timestamp):
+        """
+        Schließt das Fenster bei 'timestamp' ab und gibt die Kennzahlen zurück.
+        Der gehaltene Wert wird als Startwert ins nächste Fenster übernommen.
+        """
+        self._advance(timestamp)
+        if self.duration > 0:
+            mean = self.integral / self.duration
+        elif self.count:
+            mean = self.total / self.count
+        else:
+            mean = self.last
+        result = {
+            'mean': mean,
+            'min': self.minimum,
+            'max': self.maximum,
+            'last': self.last,
+            'count': self.count,
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'integral': self.integral,
+            'duration': self.duration,
+        }
+
+        self.count = 0
+        self.total = 0.0
+        self.minimum = self.maximum = self.last
+        self.first_ts = self.last_ts = None
+        self.integral = 0.0
+        self.duration = 0.0
+        return result
+
+
+class StreamingAggregator:
+    """Hält einen RegisterAccumulator pro Register (thread-sicher: Poll-Loop schreibt, DB-Loop liest)"""
+
+    def __init__(self, register_names, max_hold=MAX_HOLD):
+        """
+        :param max_hold: Sekunden ohne bestätigte Abfrage, nach denen gehaltene Werte enden
+        """
+        self.accumulators = {name: RegisterAccumulator() for name in register_names}
+        self.max_hold = max_hold
+        self.samples = 0
+        self.confirmed = None   # Zeitstempel der letzten erfolgreichen Abfrage
+        self._lock = threading.Lock()
+
+    def _end_stale_hold(self, timestamp):
+        """Beendet gehaltene Werte bei der letzten Bestätigung, wenn diese zu lange zurückliegt"""
+        if self.confirmed is not None and timestamp - self.confirmed > self.max_hold:
+            for acc in self.accumulators.values():
+                acc.end_hold(self.confirmed)
+            self.confirmed = None
+
+    def add(self, data, timestamp):
+        """Übernimmt die (geänderten) Rohwerte einer Abfrage"""
+        with self._lock:
+            self._end_stale_hold(timestamp)
+            for name, value in data.items():
+                acc = self.accumulators.get(name)
+                if acc is not None:
+                    acc.add(value, timestamp)
+            self.samples += 1
+            self.confirmed = timestamp
+
+    def confirm(self, timestamp):
+        """Abfrage erfolgreich, aber ohne geänderte Werte (Deadband): gehaltene Werte gelten weiter"""
+        with self._lock:
+            self._end_stale_hold(timestamp)
+            if self.confirmed is not None:
+                self.confirmed = timestamp
+
+    def expire(self, timestamp):
+        """Abfrage fehlgeschlagen: gehaltene Werte enden bei 'timestamp'"""
+        with self._lock:
+            for acc in self.accumulators.values():
+                acc.end_hold(timestamp)
+            self.confirmed = None
+
+    def has_data(self, now):
+        """True, wenn seit dem letzten Fenster Werte kamen oder noch ein bestätigter Wert gehalten wird"""
+        if self.samples > 0:
+            return True
+        if self.confirmed is None or now - self.confirmed > self.max_hold:
+            return False
+        return any(acc.last is not None for acc in self.accumulators.values())
+
+    def close_window(self, timestamp):
+        """Schließt das Fenster für alle Register ab: Dictionary Register -> Kennzahlen"""
+        with self._lock:
+            self._end_stale_hold(timestamp)
+            self.samples = 0
+            return {name: acc.close_window(timestamp) for name, acc in self.accumulators.items()}
@@ -0,0 +1,237 @@
+# Komprimiertes Spalten-Archiv für abgeschlossene Monate
+# Eine Monats-Partition <tabelle>_YYYYMM kann aus pv_data.db in eine Datei
+# <db>_archive/<tabelle>_YYYYMM.pvc ausgelagert werden (siehe PV_Partitions.py --archive).
+# Jede Spalte liegt dort als eigener, mit zlib gepackter Block:
+#   - Zeitstempel: Delta-of-Delta (bei festem 60 s Raster fast nur Nullen)
+#   - Werte: skalierte Ganzzahlen als Differenz zum Vorgänger, mit den wenigsten Nachkommastellen
+#     (höchstens 3), die alle Werte der Spalte exakt wiedergeben, dazu eine Präsenzmaske für
+#     NULL-Werte (entfällt, wenn die Spalte lückenlos ist)
+#   - Spalten, deren Werte sich mit 3 Nachkommastellen nicht exakt wiederherstellen lassen,
+#     werden verlustfrei als float64-Bitmuster gespeichert (XOR mit dem Vorgänger, ohne Bit-Packing;
+#     deutlich größer). PV_Database rundet die Mittelwerte deshalb schon beim Schreiben auf die
+#     Auflösung des Registers, damit die skalierte Kodierung greift (Ziel: 10x kleiner als die Partition).
+# Die Ganzzahlen stehen als int64 little-endian im Block, dekodiert wird mit array.frombytes()
+# und itertools.accumulate() ohne Python-Schleife pro Wert. Das Archiv ist damit verlustfrei;
+# PV_Partitions.archive_partition() vergleicht jede Spalte, bevor die Partition gelöscht wird.
+#
+# Gelesen wird die Datei per mmap: der JSON-Kopf enthält Offset und Länge jedes Blocks,
+# entpackt werden nur die Zeitstempel und die angefragten Spalten (direkt aus dem
+# gemappten Speicher, ohne die Datei zu kopieren). PV_Partitions.query_range() liest
+# archivierte Monate transparent mit.
+#
+# Dateiaufbau: b"PVC1" | Kopflänge (uint32 LE) | Kopf (JSON, UTF-8) | Blöcke
+
+import bisect
+import itertools
+import json
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"PVC1"
+ARCHIVE_SUFFIX = ".pvc"
+DEFAULT_DECIMALS = 3   # Auflösung der gespeicherten Werte (Mittelwerte sind ohnehin gerundete Registerwerte)
+COMPRESS_LEVEL = 6
+
+
+def archive_dir(db_path):
+    """Verzeichnis der Archivdateien einer Datenbank (pv_data.db -> pv_data_archive)"""
+    return os.path.splitext(db_path)[0] + "_archive"
+
+
+def archive_path(db_path, partition):
+    return os.path.join(archive_dir(db_path), partition + ARCHIVE_SUFFIX)
+
+
+def list_archives(db_path, table):
+    """Partitionsnamen aller archivierten Monate einer Tabelle, zeitlich sortiert"""
+    directory = archive_dir(db_path)
+    if not db_path or not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf"^{re.escape(table)}_\d{{6}}{re.escape(ARCHIVE_SUFFIX)}$")
+    return sorted(name[:-len(ARCHIVE_SUFFIX)] for name in os.listdir(directory) if pattern.match(name))
+
+
+def _pack(values):
+    """int64-Liste -> zlib-gepackter little-endian Block"""
+    data = array('q', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return zlib.compress(data.tobytes(), COMPRESS_LEVEL)
+
+
+def _unpack(buffer):
+    """zlib-gepackter little-endian Block -> array('q')"""
+    data = array('q')
+    data.frombytes(zlib.decompress(buffer))
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
+
+def _encode_timestamps(timestamps):
+    """Delta-of-Delta: erster Wert steht im Kopf, danach Änderung des Abstands"""
+    encoded = []
+    prev_ts = timestamps[0]
+    prev_delta = 0
+    for ts in timestamps[1:]:
+        delta = ts - prev_ts
+        encoded.append(delta - prev_delta)
+        prev_ts, prev_delta = ts, delta
+    return encoded
+
+
+def _encode_values(values, decimals):
+    """
+    Speichert vorhandene Werte als Differenz zum Vorgänger: skaliert auf Ganzzahlen mit den
+    wenigsten Nachkommastellen (bis 'decimals'), die alle Werte exakt wiedergeben, sonst als
+    float64-Bitmuster (XOR statt Differenz).
+    :return: (Kodierung 'scaled' oder 'float', Nachkommastellen, Präsenzmaske, Ganzzahlen)
+    """
+    mask = bytes(0 if val is None else 1 for val in values)
+    mask = b"" if all(mask) else mask
+    present = [val for val in values if val is not None]
+    for digits in range(decimals + 1):
+        scale = 10 ** digits
+        scaled = [round(val * scale) for val in present]
+        if all(a / scale == b for a, b in zip(scaled, present)):
+            return 'scaled', digits, mask, [b - a for a, b in zip([0] + scaled, scaled)]
+    bits = array('q', array('d', present).tobytes())
+    return 'float', decimals, mask, [b ^ a for a, b in zip([0] + list(bits), bits)]
+
+
+def _decode_values(encoded, meta):
+    """Umkehrung von _encode_values() für einen entpackten Block"""
+    if meta.get('encoding', 'scaled') == 'float':
+        return array('d', array('q', itertools.accumulate(encoded, operator.xor)).tobytes()).tolist()
+    scale = 10 ** meta['decimals']
+    return [val / scale for val in itertools.accumulate(encoded)]
+
+
+def write_archive(path, timestamps, columns, decimals=DEFAULT_DECIMALS):
+    """
+    Schreibt einen Monat als Spalten-Archiv (atomar über eine temporäre Datei).
+    :param timestamps: Zeitstempel (int, aufsteigend)
+    :param columns: Dictionary Spaltenname -> Werteliste (gleiche Länge, None = NULL)
+    :param decimals: Höchste Nachkommastellen für die skalierte Kodierung (Spalten mit feineren
+                     Werten werden verlustfrei als float64 gespeichert)
+    :return: Dateigröße in Bytes
+    """
+    blocks = []
+    offset = 0
+
+    def add_block(payload):
+        nonlocal offset
+        blocks.append(payload)
+        entry = (offset, len(payload))
+        offset += len(payload)
+        return entry
+
+    header = {'rows': len(timestamps), 'first_ts': int(timestamps[0]) if timestamps else 0, 'columns': {}}
+    header['ts'] = add_block(_pack(_encode_timestamps([int(ts) for ts in timestamps]) if timestamps else []))
+    for name, values in columns.items():
+        encoding, digits, mask, deltas = _encode_values(values, decimals)
+        header['columns'][name] = {
+            'encoding': encoding,
+            'decimals': digits,
+            'present': len(deltas),
+            'values': add_block(_pack(deltas)),
+            'mask': add_block(zlib.compress(mask, COMPRESS_LEVEL) if mask else b""),
+        }
+
+    head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(head)) + head)
+        for payload in blocks:
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class ArchiveReader:
+    """Liest eine Archivdatei per mmap; entpackt werden nur die angefragten Spalten"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:   # leere Datei
+            self._file.close()
+            raise ValueError(f"Archivdatei {path} ist leer")
+        self._view = memoryview(self._map)
+        if bytes(self._view[:4]) != MAGIC:
+            self.close()
+            raise ValueError(f"{path} ist keine PV-Archivdatei")
+        head_len = struct.unpack_from('<I', self._map, 4)[0]
+        self.header = json.loads(bytes(self._view[8:8 + head_len]))
+        self._data_start = 8 + head_len
+        self.rows = self.header['rows']
+        self.columns = list(self.header['columns'])
+        self._timestamps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        self._map.close()
+        self._file.close()
+
+    def _block(self, entry):
+        offset, length = entry
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+    def timestamps(self):
+        if self._timestamps is None:
+            if not self.rows:
+                self._timestamps = []
+            else:
+                deltas = itertools.accumulate(_unpack(self._block(self.header['ts'])))
+                self._timestamps = list(itertools.accumulate(deltas, initial=self.header['first_ts']))
+        return self._timestamps
+
+    def column(self, name, start=0, end=None):
+        """Werte einer Spalte für die Zeilen [start, end) (None für NULL bzw. fehlende Spalte)"""
+        end = self.rows if end is None else end
+        meta = self.header['columns'].get(name)
+        if meta is None:
+            return [None] * (end - start)
+        values = _decode_values(_unpack(self._block(meta['values'])), meta)
+        if meta['mask'][1]:
+            mask = zlib.decompress(self._block(meta['mask']))
+            present = iter(values)
+            values = [next(present) if flag else None for flag in mask]
+        return values[start:end]
+
+    def read_range(self, columns, start_ts, end_ts, descending=False, limit=None):
+        """(timestamp, spalte1, ...) im Zeitraum [start_ts, end_ts], sortiert wie query_range()"""
+        timestamps = self.timestamps()
+        lo = bisect.bisect_left(timestamps, start_ts)
+        hi = bisect.bisect_right(timestamps, end_ts)
+        if lo >= hi:
+            return []
+        if limit is not None:
+            if descending:
+                lo = max(lo, hi - limit)
+            else:
+                hi = min(hi, lo + limit)
+        rows = list(zip(timestamps[lo:hi], *(self.column(col, lo, hi) for col in columns)))
+        if descending:
+            rows.reverse()
+        return rows
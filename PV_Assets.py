@@ -0,0 +1,150 @@
+# Cache für HTML-Seiten und gemeinsame statische Dateien (JS/CSS) des Webservers
+# Jede Datei wird einmal von der SD-Karte gelesen und mit vorberechneten Varianten im RAM gehalten:
+#   - gzip (immer) und brotli (nur wenn das Paket 'brotli' installiert ist), jeweils nur wenn kleiner
+#   - starkes ETag aus dem Inhalt, Last-Modified aus der mtime
+# Geändert wird eine Datei erkannt, indem ihre mtime höchstens alle 'check_interval' Sekunden
+# geprüft wird; dann wird sie neu geladen.
+#
+# Verweise einer HTML-Seite auf /static/<datei> werden beim Laden um ?v=<version> ergänzt.
+# Solche versionierten Adressen ändern sich mit dem Inhalt und dürfen deshalb lange im
+# Browser liegen (max-age ein Jahr, immutable); die Seiten selbst werden per ETag geprüft
+# (no-cache -> 304). Ändert sich eine verwendete statische Datei, wird auch die Seite neu
+# aufgebaut.
+
+import collections
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_PREFIX = "/static/"
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.json': 'application/json; charset=utf-8',
+}
+COMPRESSIBLE = ('text/', 'application/json', 'image/svg+xml')
+_STATIC_REF = re.compile(rb'((?:src|href)=")/static/([\w.\-]+)(")')
+
+Asset = collections.namedtuple('Asset', ['body', 'gzip_body', 'br_body', 'etag', 'version', 'last_modified',
+                                         'content_type'])
+
+
+class _Entry:
+    def __init__(self, asset, mtime, deps):
+        self.asset = asset
+        self.mtime = mtime
+        self.deps = deps          # statischer Dateiname -> Version beim Laden (nur HTML)
+        self.checked = time.monotonic()
+
+
+class AssetCache:
+    def __init__(self, root, static_dir="static", check_interval=2.0):
+        """
+        :param root: Verzeichnis der HTML-Seiten
+        :param static_dir: Unterverzeichnis für gemeinsame JS/CSS-Dateien (/static/<datei>)
+        :param check_interval: Sekunden, nach denen die mtime einer Datei erneut geprüft wird
+        """
+        self.root = root
+        self.static_root = os.path.join(root, static_dir)
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.RLock()   # eine HTML-Seite lädt beim Laden ihre statischen Dateien
+        self.loads = 0
+
+    def page(self, filename):
+        """HTML-Seite aus dem Wurzelverzeichnis (None, wenn nicht vorhanden)"""
+        return self._get(os.path.join(self.root, filename))
+
+    def static(self, name):
+        """Gemeinsame Datei unter /static/ (nur einfache Dateinamen, kein Pfad)"""
+        if not re.fullmatch(r"[\w.\-]+", name) or name.startswith('.'):
+            return None
+        return self._get(os.path.join(self.static_root, name))
+
+    def _get(self, path):
+        entry = self._entries.get(path)
+        if entry is not None and time.monotonic() - entry.checked < self.check_interval:
+            return entry.asset
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._entries.pop(path, None)
+            return None
+        if entry is not None and entry.mtime == mtime and not self._deps_changed(entry):
+            entry.checked = time.monotonic()
+            return entry.asset
+
+        with self._lock:
+            entry = self._load(path, mtime)
+            self._entries[path] = entry
+        return entry.asset
+
+    def _deps_changed(self, entry):
+        for name, version in entry.deps.items():
+            asset = self.static(name)
+            if asset is None or asset.version != version:
+                return True
+        return False
+
+    def _load(self, path, mtime):
+        with open(path, 'rb') as f:
+            body = f.read()
+        ext = os.path.splitext(path)[1].lower()
+        content_type = CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        deps = {}
+        if ext == '.html':
+            def link(match):
+                name = match.group(2).decode('ascii')
+                asset = self.static(name)
+                if asset is None:
+                    return match.group(0)
+                deps[name] = asset.version
+                return match.group(1) + f"/static/{name}?v={asset.version}".encode('ascii') + match.group(3)
+            body = _STATIC_REF.sub(link, body)
+
+        digest = hashlib.sha1(body).hexdigest()
+        gzip_body = br_body = None
+        if content_type.startswith(COMPRESSIBLE):
+            gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gzip_body) >= len(body):
+                gzip_body = None
+            if brotli is not None:
+                br_body = brotli.compress(body)
+                if len(br_body) >= len(body):
+                    br_body = None
+        self.loads += 1
+        asset = Asset(body, gzip_body, br_body, f'"{digest}"', digest[:10],
+                      email.utils.formatdate(mtime, usegmt=True), content_type)
+        return _Entry(asset, mtime, deps)
+
+    def stats(self):
+        return {
+            'cached': len(self._entries),
+            'loads': self.loads,
+            'bytes': sum(len(e.asset.body) + len(e.asset.gzip_body or b"") + len(e.asset.br_body or b"")
+                         for e in list(self._entries.values())),
+            'brotli': brotli is not None,
+        }
+
+
+def choose_encoding(asset, accept_encoding):
+    """:return: (Body, Content-Encoding oder None) passend zum Accept-Encoding des Clients"""
+    accepted = {token.split(';')[0].strip() for token in (accept_encoding or "").split(',')}
+    if asset.br_body is not None and 'br' in accepted:
+        return asset.br_body, 'br'
+    if asset.gzip_body is not None and 'gzip' in accepted:
+        return asset.gzip_body, 'gzip'
+    return asset.body, None
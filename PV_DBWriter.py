@@ -0,0 +1,358 @@
+# Eigener Schreib-Thread pro Datenbankdatei (Write-Behind)
+# Alle Schreibzugriffe auf pv_data.db laufen über eine begrenzte, thread-sichere Queue an
+# einen einzigen Thread, dem die Schreibverbindung gehört. Er fasst alle anstehenden Zeilen
+# in einer Transaktion zusammen (Group Commit). Ist SQLite gesperrt (z.B. durch ein Backup
+# des Wochenberichts), wird mit Backoff wiederholt; danach und bei voller Queue werden die
+# Zeilen in eine Spill-Datei (<db>.spill.jsonl) geschrieben und später nachgetragen.
+# Verworfen wird nie stillschweigend: nicht schreibbare Zeilen werden gezählt und gemeldet.
+#
+# SD-Karten-Modus (stage_interval > 0): Zeilen werden im RAM gesammelt und nur alle
+# stage_interval Sekunden in einer einzigen Transaktion geschrieben (außerdem bei flush(),
+# release() und über request_flush_all() beim SIGTERM). Zusammen mit synchronous=NORMAL
+# (im WAL-Modus nur noch fsync beim Checkpoint) sinkt die Zahl der Schreibvorgänge auf der
+# Karte entsprechend. max_data_loss() beziffert, was bei einem Stromausfall verloren gehen kann.
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PV_Metrics import METRICS
+
+_writers = {}
+_writers_lock = threading.Lock()
+_default_options = {}
+
+# Voreinstellungen für DB_WRITE_MODE in main_raspi.py
+WRITE_MODES = {
+    # jede Zeile sofort, fsync bei jedem Commit
+    'direct': {'stage_interval': 0, 'synchronous': "FULL", 'wal_autocheckpoint': 1000, 'checkpoint_interval': None},
+    # SD-Karte: 15 min im RAM sammeln, fsync nur beim stündlichen Checkpoint
+    'sdcard': {'stage_interval': 900, 'synchronous': "NORMAL", 'wal_autocheckpoint': 0, 'checkpoint_interval': 3600},
+}
+
+
+def configure(**options):
+    """Standard-Optionen für alle danach angelegten Writer (z.B. stage_interval, synchronous)"""
+    _default_options.update(options)
+
+
+def get_writer(db_path, **options):
+    """Gemeinsamer Writer für eine Datenbankdatei (mehrere Geräte-Tabellen teilen sich den Thread)"""
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None or not writer.is_running():
+            writer = DBWriter(db_path, **dict(_default_options, **options))
+            _writers[db_path] = writer
+        writer.users += 1
+        return writer
+
+
+def request_flush_all():
+    """Alle Writer sollen gesammelte Zeilen sofort schreiben (blockiert nicht, z.B. im Signal-Handler)"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.request_flush()
+
+
+class DBWriter:
+    def __init__(self, db_path, max_queue=500, batch_size=100, high_watermark=0.5, busy_timeout=1.0,
+                 max_lock_retries=5, spill_path=None, replay_interval=30, stage_interval=0, synchronous="FULL",
+                 wal_autocheckpoint=1000, checkpoint_interval=None):
+        """
+        :param max_queue: Maximale Anzahl wartender Zeilen (danach Spill auf Disk)
+        :param batch_size: Maximale Anzahl Zeilen pro Transaktion (Group Commit)
+        :param high_watermark: Anteil der Queue, ab dem congested() True liefert (Backpressure)
+        :param busy_timeout: SQLite-Timeout in Sekunden für einen einzelnen Schreibversuch
+        :param max_lock_retries: Versuche bei gesperrter Datenbank, bevor die Zeilen gespillt werden
+        :param replay_interval: Mindestabstand in Sekunden zwischen zwei Versuchen, die Spill-Datei nachzutragen
+        :param stage_interval: Sekunden, die Zeilen im RAM gesammelt werden (0: sofort schreiben)
+        :param synchronous: PRAGMA synchronous der Schreibverbindung (FULL, NORMAL oder OFF)
+        :param wal_autocheckpoint: PRAGMA wal_autocheckpoint in Seiten (0: nur eigene Checkpoints)
+        :param checkpoint_interval: Sekunden zwischen zwei eigenen Checkpoints (begrenzt bei NORMAL den Verlust)
+        """
+        self.db_path = db_path
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.high_watermark = int(max_queue * high_watermark)
+        self.busy_timeout = busy_timeout
+        self.max_lock_retries = max_lock_retries
+        self.spill_path = spill_path or db_path + ".spill.jsonl"
+        self.replay_interval = replay_interval
+        self.stage_interval = stage_interval
+        self.synchronous = synchronous.upper()
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+        self._next_replay = time.monotonic() + 1.0   # Handler der Tabellen erst registrieren lassen
+        self.handlers = {}   # Tabelle -> Funktion(conn, timestamp, values)
+        self.users = 0
+
+        self.batches = 0
+        self.rows_written = 0
+        self.lock_retries = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.staged = 0
+        self.checkpoints = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_total = 0.0
+
+        self._spill_lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="DBWriter", daemon=True)
+        self._thread.start()
+        METRICS.register_collector(f"db_writer:{db_path}", self._collect_metrics)
+
+    def register(self, table, handler):
+        """Registriert die Schreibfunktion einer Tabelle (wird im Writer-Thread mit dessen Verbindung aufgerufen)"""
+        self.handlers[table] = handler
+
+    def is_running(self):
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def congested(self):
+        """True, wenn die Queue über der Hochwassermarke liegt (Aufrufer sollte weiter aggregieren)"""
+        return self.queue.qsize() >= self.high_watermark
+
+    def submit(self, table, timestamp, values):
+        """
+        Reiht eine Zeile ein, ohne zu blockieren. Bei voller Queue wird sie in die Spill-Datei geschrieben.
+        :return: True, wenn die Zeile eingereiht wurde
+        """
+        try:
+            self.queue.put_nowait((table, timestamp, values))
+        except queue.Full:
+            self._spill([(table, timestamp, values)], "Queue voll")
+            return False
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    def request_flush(self):
+        """Gesammelte Zeilen beim nächsten Durchlauf schreiben, ohne zu warten"""
+        self._flush_now.set()
+
+    def flush(self, timeout=10.0):
+        """Wartet, bis alle eingereihten Zeilen geschrieben (oder gespillt) sind"""
+        self._flush_now.set()
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self.queue.unfinished_tasks
+
+    def release(self, timeout=10.0):
+        """Ein Benutzer weniger; der letzte schreibt die Queue leer und beendet den Thread"""
+        with _writers_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+        self.close(timeout)
+
+    def close(self, timeout=10.0):
+        """Schreibt die Queue leer und beendet den Thread, unabhängig von weiteren Benutzern"""
+        with _writers_lock:
+            if _writers.get(self.db_path) is self:
+                del _writers[self.db_path]
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def max_data_loss(self):
+        """
+        Obergrenze in Sekunden für Zeilen, die bei einem Stromausfall verloren gehen können
+        (None: unbegrenzt, bei synchronous=OFF kann die Datenbank beschädigt werden)
+        """
+        if self.synchronous == "OFF":
+            return None
+        loss = self.stage_interval
+        if self.synchronous == "NORMAL":
+            # WAL-Commits werden erst beim Checkpoint auf die Karte synchronisiert
+            if not self.checkpoint_interval:
+                return None
+            loss += self.checkpoint_interval
+        return loss
+
+    def describe_durability(self):
+        loss = self.max_data_loss()
+        mode = f"sammelt {self.stage_interval / 60:g} min im RAM" if self.stage_interval else "schreibt sofort"
+        limit = "unbegrenzt" if loss is None else f"{loss / 60:g} min"
+        return f"DB-Writer {mode}, synchronous={self.synchronous}, max. Datenverlust bei Stromausfall: {limit}"
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA wal_autocheckpoint={int(self.wal_autocheckpoint)}")
+        staged = []
+        last_commit = last_checkpoint = time.monotonic()
+        try:
+            while not (self._stop.is_set() and self.queue.empty() and not staged):
+                try:
+                    staged.append(self.queue.get(timeout=0.5))
+                    while True:
+                        staged.append(self.queue.get_nowait())
+                except queue.Empty:
+                    pass
+                self.staged = len(staged)
+                if not staged:
+                    self._replay_spill(conn)
+                    continue
+                due = (time.monotonic() - last_commit >= self.stage_interval
+                       or self._flush_now.is_set() or self._stop.is_set())
+                if not due:
+                    continue
+                self._flush_now.clear()
+                # Gesammelte Zeilen in einer Transaktion, sonst Group Commit in batch_size Schritten
+                size = len(staged) if self.stage_interval else self.batch_size
+                for idx in range(0, len(staged), size):
+                    batch = staged[idx:idx + size]
+                    try:
+                        self._commit(conn, batch)
+                    finally:
+                        for _ in batch:
+                            self.queue.task_done()
+                staged = []
+                self.staged = 0
+                last_commit = time.monotonic()
+                if self.checkpoint_interval and last_commit - last_checkpoint >= self.checkpoint_interval:
+                    self._checkpoint(conn)
+                    last_checkpoint = time.monotonic()
+        finally:
+            if self.checkpoint_interval:
+                self._checkpoint(conn)
+            conn.close()
+
+    def _checkpoint(self, conn):
+        """Überträgt das WAL in die Datenbank (mit fsync), ohne auf Leser zu warten"""
+        try:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            self.checkpoints += 1
+        except sqlite3.Error as e:
+            print(f"DB-Writer: Checkpoint fehlgeschlagen: {e}")
+
+    def _commit(self, conn, batch):
+        """Schreibt einen Schwung Zeilen in einer Transaktion, bei gesperrter DB mit Backoff"""
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with conn:
+                    for table, timestamp, values in batch:
+                        self.handlers[table](conn, timestamp, values)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    return self._commit_single(conn, batch, e)
+                attempt += 1
+                self.lock_retries += 1
+                if attempt >= self.max_lock_retries:
+                    self._spill(batch, f"Datenbank gesperrt ({e})")
+                    return False
+                time.sleep(min(5.0, 0.2 * 2 ** attempt))
+                continue
+            except Exception as e:
+                return self._commit_single(conn, batch, e)
+
+            elapsed_ms = (time.monotonic() - start) * 1000
+            self.batches += 1
+            self.rows_written += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._flush_total += elapsed_ms
+            return True
+
+    def _commit_single(self, conn, batch, error):
+        """Fehler im Group Commit: Zeilen einzeln schreiben, damit eine fehlerhafte nicht alle mitreißt"""
+        if len(batch) == 1:
+            self._fail(batch, error)
+            return False
+        results = [self._commit(conn, [row]) for row in batch]
+        return all(results)
+
+    def _fail(self, batch, error):
+        self.failed += len(batch)
+        print(f"Datenbank Fehler beim Schreiben ({len(batch)} Zeilen verworfen): {error}")
+
+    def _spill(self, rows, reason):
+        """Hängt Zeilen an die Spill-Datei an (werden nachgetragen, sobald die DB wieder schreibbar ist)"""
+        try:
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for table, timestamp, values in rows:
+                        f.write(json.dumps({'table': table, 'timestamp': timestamp, 'values': values}) + "\n")
+            self.spilled += len(rows)
+            print(f"DB-Writer: {len(rows)} Zeilen in {os.path.basename(self.spill_path)} ausgelagert ({reason})")
+        except OSError as e:
+            self._fail(rows, f"{reason}, Spill fehlgeschlagen: {e}")
+
+    def _replay_spill(self, conn):
+        """Trägt ausgelagerte Zeilen nach (nur bei leerer Queue, im Writer-Thread)"""
+        if time.monotonic() < self._next_replay or not os.path.exists(self.spill_path):
+            return
+        self._next_replay = time.monotonic() + self.replay_interval
+        with self._spill_lock:
+            try:
+                replay_path = self.spill_path + ".replay"
+                os.replace(self.spill_path, replay_path)
+            except OSError:
+                return
+        rows = []
+        unknown = []
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('table') in self.handlers:
+                    rows.append((entry['table'], entry['timestamp'], entry['values']))
+                else:
+                    unknown.append(line)
+        if unknown:
+            # Tabelle (noch) nicht registriert: Zeilen bleiben in der Spill-Datei
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    f.writelines(unknown)
+        for idx in range(0, len(rows), self.batch_size):
+            batch = rows[idx:idx + self.batch_size]
+            if self._commit(conn, batch):
+                self.replayed += len(batch)
+        os.remove(replay_path)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'staged': self.staged,
+            'max_queue_depth': self.max_queue_depth,
+            'batches': self.batches,
+            'rows_written': self.rows_written,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._flush_total / self.batches, 2) if self.batches else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'lock_retries': self.lock_retries,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'failed': self.failed,
+            'checkpoints': self.checkpoints,
+            'max_data_loss_s': self.max_data_loss(),
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        labels = {'db': os.path.basename(self.db_path)}
+        return [
+            ('pv_db_queue_depth', 'gauge', 'Wartende Zeilen in der Schreib-Queue', [(labels, stats['queue_depth'])]),
+            ('pv_db_staged_rows', 'gauge', 'Im RAM gesammelte, noch nicht geschriebene Zeilen', [(labels, stats['staged'])]),
+            ('pv_db_max_data_loss_seconds', 'gauge', 'Maximaler Datenverlust bei Stromausfall (fehlt: unbegrenzt)', [(labels, stats['max_data_loss_s'])]),
+            ('pv_db_rows_written_total', 'counter', 'Geschriebene Zeilen', [(labels, stats['rows_written'])]),
+            ('pv_db_batches_total', 'counter', 'Transaktionen (Group Commit)', [(labels, stats['batches'])]),
+            ('pv_db_flush_seconds_max', 'gauge', 'Längste Transaktion', [(labels, stats['max_flush_ms'] / 1000)]),
+            ('pv_db_lock_retries_total', 'counter', 'Wiederholungen wegen gesperrter Datenbank', [(labels, stats['lock_retries'])]),
+            ('pv_db_spilled_rows_total', 'counter', 'In die Spill-Datei ausgelagerte Zeilen', [(labels, stats['spilled'])]),
+            ('pv_db_failed_rows_total', 'counter', 'Nicht schreibbare Zeilen', [(labels, stats['failed'])]),
+        ]
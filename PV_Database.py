@@ -3,90 +3,235 @@ import time
 import os
 import datetime
 
+from PV_Aggregator import StreamingAggregator
+from PV_DBWriter import get_writer
+from PV_Partitions import create_partition, is_partitioned, partition_name, query_range, source_tables
+from PV_ReadPool import get_read_pool
+from PV_Rollups import RollupWriter
+from PV_Schema import create_narrow_table, narrow_table, register_series, set_storage_format, upgrade_schema
+
+MAX_DECIMALS = 6
+
+
+def register_decimals(data):
+    """
+    Auflösung, mit der ein Register gespeichert wird: "decimals" aus registers.json, sonst die
+    Nachkommastellen des Faktors (0.1 -> 1, 1 -> 0). Feiner liefert der Wechselrichter nicht.
+    """
+    if 'decimals' in data:
+        return int(data['decimals'])
+    factor = abs(data.get('factor', 1))
+    for decimals in range(MAX_DECIMALS):
+        if abs(round(factor, decimals) - factor) < 1e-9:
+            return decimals
+    return MAX_DECIMALS
+
+
+def quantize(value, decimals):
+    """Rundet einen Messwert auf die Auflösung des Registers (None bleibt None)"""
+    return None if value is None else round(value, decimals)
+
+
 class PV_Database:
-    def __init__(self, db_name="pv_data.db", registers_dict=None):
+    def __init__(self, db_name="pv_data.db", registers_dict=None, table_name="readings", rollups=True, storage="wide"):
         """
         Initialisiert die Datenbankverbindung und erstellt die Tabelle, falls nicht vorhanden.
         :param db_name: Name der Datenbankdatei
         :param registers_dict: Das Dictionary aus registers.json, um die Spalten zu definieren
+        :param table_name: Tabelle für die Messwerte (eigene Tabelle pro Gerät bei mehreren Wechselrichtern)
+        :param rollups: Stündliche/tägliche/monatliche Verdichtung mitführen (siehe PV_Rollups.py)
+        :param storage: "wide" (eine Spalte pro Register) oder "narrow" (eine Zeile pro Wert, siehe PV_Schema.py).
+                        Gilt nur für neue Tabellen, eine bestehende behält ihr Format.
         """
         self.db_path = os.path.join(os.path.dirname(__file__), db_name)
         self.registers = registers_dict if registers_dict else {}
-        self.buffer = []
-        self.lock = False # Einfacher Schutz, falls nötig, hier reicht aber meist die Thread-Sicherheit von Listen
+        self.table = table_name
+        # Laufende Kennzahlen pro Register statt gepufferter Kopien jeder Abfrage
+        self.aggregator = StreamingAggregator(self.registers.keys())
+        # Register mit "store_minmax": true bekommen zusätzlich die Spalten <name>_min und <name>_max
+        self.minmax_keys = [key for key, data in self.registers.items() if data.get('store_minmax')]
+        # Gespeicherte Auflösung pro Register (Mittelwerte werden darauf gerundet)
+        self.decimals = {key: register_decimals(data) for key, data in self.registers.items()}
         
-        # SQLite Verbindung aufbauen mit Timeout (5 Sek) für bessere Concurrency
+        # SQLite Verbindung für das Anlegen und Migrieren des Schemas beim Start
+        # (geschrieben wird im Writer-Thread, gelesen über den Pool von Nur-Lese-Verbindungen)
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        # Neue Datenbanken: freie Seiten können schrittweise zurückgegeben werden (PV_Retention.py),
+        # bei bestehenden Datenbanken ohne Wirkung
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
         # WAL-Modus aktivieren: Erlaubt gleichzeitiges Lesen und Schreiben
         self.conn.execute("PRAGMA journal_mode=WAL;")
+        # Schema-Version prüfen und fehlende Migrationsschritte einspielen
+        upgrade_schema(self.conn)
+        with self.conn:
+            self.storage = set_storage_format(self.conn, self.table, storage)
+        self.narrow = self.storage == 'narrow'
+        self.series_ids = {}
+        # Monats-Partitionen <tabelle>_YYYYMM (neue Datenbanken oder nach PV_Partitions.py --migrate),
+        # sonst die bisherige einzelne Tabelle
+        self.partitioned = is_partitioned(self.conn, self.table)
+        self._partitions = set()
         self._create_table()
+        self._add_missing_columns()
+
+        self.rollups = None
+        if rollups and self.registers:
+            try:
+                self.rollups = RollupWriter(self.conn, self.table, self.registers.keys())
+                self.rollups.create_tables()
+            except sqlite3.Error as e:
+                print(f"Datenbank Fehler beim Anlegen der Rollup-Tabellen: {e}")
+                self.rollups = None
+
+        # Geschrieben wird ausschließlich im Writer-Thread (eigene Verbindung, Group Commit)
+        self.writer = get_writer(self.db_path)
+        self.writer.register(self.table, self._write_row)
+        # Lesepfade (/api/history) blockieren weder den Writer noch sich gegenseitig
+        self.read_pool = get_read_pool(self.db_path)
+        self._deferred = 0 # Schreibvorgänge, die wegen voller Queue weiter aggregiert wurden
+        self._merged = 0   # Zeilen, die in eine vorhandene Zeile derselben Sekunde ergänzt wurden
 
     def _create_table(self):
         """Erstellt die Tabelle basierend auf den Register-Keys dynamisch"""
         if not self.registers:
             return
 
+        if self.narrow:
+            try:
+                with self.conn:
+                    create_narrow_table(self.conn, self.table)
+            except sqlite3.Error as e:
+                print(f"Datenbank Fehler beim Erstellen der Tabelle: {e}")
+            return
+
+        if self.partitioned:
+            self._ensure_partition(time.time())
+            return
+
         # Basis-Spalte Zeitstempel
         columns = ["timestamp INTEGER"]
         
         # Für jedes Register eine Spalte anlegen (Typ REAL für Durchschnittswerte)
-        for key in self.registers.keys():
+        for key in self._value_columns():
             columns.append(f"{key} REAL")
         
         col_str = ", ".join(columns)
-        query = f"CREATE TABLE IF NOT EXISTS readings ({col_str})"
+        query = f"CREATE TABLE IF NOT EXISTS {self.table} ({col_str})"
         
         try:
             with self.conn:
                 self.conn.execute(query)
+                # Nicht migrierte Tabelle: wenigstens ein Index für die Bereichsabfragen
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_timestamp ON {self.table} (timestamp)")
         except sqlite3.Error as e:
             print(f"Datenbank Fehler beim Erstellen der Tabelle: {e}")
 
-    def prepare_data(self, data, timestamp):
+    def _ensure_partition(self, timestamp, conn=None):
         """
-        Speichert Rohdaten temporär in einer Liste.
-        :param data: Dictionary mit den Rohwerten
-        :param timestamp: EPOCH Zeitstempel
+        Gibt die Partition für den Zeitstempel zurück und legt sie beim ersten Zugriff an.
+        :param conn: Verbindung des Writer-Threads (läuft dann in dessen Transaktion)
+        """
+        name = partition_name(self.table, timestamp)
+        if name not in self._partitions:
+            if conn is not None:
+                create_partition(conn, name, self._value_columns())
+            else:
+                try:
+                    with self.conn:
+                        create_partition(self.conn, name, self._value_columns())
+                except sqlite3.Error as e:
+                    print(f"Datenbank Fehler beim Anlegen der Partition {name}: {e}")
+                    return name
+            self._partitions.add(name)
+        return name
+
+    def _value_columns(self):
+        """Alle Wert-Spalten der Tabelle (Mittelwerte und optionale Min/Max-Spalten)"""
+        columns = list(self.registers.keys())
+        for key in self.minmax_keys:
+            columns.extend([f"{key}_min", f"{key}_max"])
+        return columns
+
+    def _add_missing_columns(self):
+        """
+        Ergänzt Spalten für neu in registers.json eingetragene Register in einer bestehenden Tabelle
+        (im schmalen Format: neue Serien) und vermerkt sie im Register-Verzeichnis
         """
-        if not data:
+        if not self.registers:
             return
+        try:
+            with self.conn:
+                self.series_ids, new_series = register_series(self.conn, self.table, self._value_columns())
+            if self.narrow:
+                if new_series:
+                    print(f"Datenbank: {len(new_series)} neue Serie(n) in {narrow_table(self.table)} angelegt")
+                return
+            added = set()
+            altered = 0
+            for table in source_tables(self.conn, self.table):
+                with self.conn:
+                    missing = self._add_columns(self.conn, table, self._value_columns())
+                if missing:
+                    added.update(missing)
+                    altered += 1
+            if added:
+                print(f"Datenbank: {len(added)} neue Spalte(n) in {altered} Tabelle(n) von {self.table} angelegt")
+        except sqlite3.Error as e:
+            print(f"Datenbank Fehler beim Ergänzen der Spalten: {e}")
 
-        # Wir speichern eine Kopie der Daten zusammen mit dem Zeitstempel
-        entry = data.copy()
-        entry['timestamp'] = timestamp
-        self.buffer.append(entry)
+    @staticmethod
+    def _add_columns(conn, table, columns):
+        """
+        ALTER TABLE für alle Spalten, die der Tabelle fehlen (ohne eigenes Commit, läuft in der
+        Transaktion des Aufrufers). :return: Liste der ergänzten Spalten
+        """
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        missing = [col for col in columns if col not in existing]
+        for col in missing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} REAL")
+        return missing
+
+    def prepare_data(self, data, timestamp, available=True):
+        """
+        Übernimmt die Rohdaten in die laufenden Kennzahlen (Anzahl, Summe, Min, Max, letzter Wert).
+        :param data: Dictionary mit den geänderten Rohwerten (fehlende Keys = unverändert)
+        :param timestamp: EPOCH Zeitstempel
+        :param available: False, wenn die Abfrage fehlgeschlagen ist (gehaltene Werte enden dann)
+        """
+        if not available:
+            self.aggregator.expire(timestamp)
+        elif data:
+            self.aggregator.add(data, timestamp)
+        else:
+            self.aggregator.confirm(timestamp)
 
     def persist_data(self):
         """
-        Berechnet den Mittelwert der gepufferten Daten und schreibt ihn in die DB.
+        Berechnet den zeitgewichteten Mittelwert seit dem letzten Aufruf und übergibt ihn dem Writer-Thread.
+        Ein Wert gilt vom Zeitpunkt seiner Meldung bis zur nächsten Änderung (Sample & Hold).
+        Mittelwert, Min und Max werden auf die Auflösung des Registers gerundet (register_decimals),
+        damit sie sich im Spalten-Archiv (PV_Archive) als kleine Ganzzahl-Deltas speichern lassen.
         Wird zyklisch aufgerufen.
         """
-        if not self.buffer:
+        if not self.aggregator.has_data(time.time()):
             return
 
-        # Daten aus dem Buffer holen und Buffer leeren (atomar-ähnlich)
-        current_buffer = self.buffer
-        self.buffer = []
-        
-        count = len(current_buffer)
-        if count == 0:
+        # Backpressure: staut sich die Schreib-Queue, wird weiter aggregiert statt eine Zeile anzuhängen
+        if self.writer.congested():
+            self._deferred += 1
+            print(f"DB-Writer ausgelastet ({self.writer.queue.qsize()} Zeilen in der Queue), {self.table} wird weiter aggregiert")
             return
 
-        # Durchschnittswerte berechnen
+        # Fenster abschließen (der gehaltene Wert geht als Startwert ins nächste Fenster)
+        window = self.aggregator.close_window(time.time())
+
+        # Durchschnittswerte (und optional Min/Max) übernehmen
         avg_data = {}
-        
-        # Wir iterieren über alle bekannten Register
         for key in self.registers.keys():
-            values = []
-            for entry in current_buffer:
-                val = entry.get(key)
-                if val is not None and isinstance(val, (int, float)):
-                    values.append(val)
-            
-            if values:
-                avg_data[key] = sum(values) / len(values)
-            else:
-                avg_data[key] = None
+            avg_data[key] = quantize(window[key]['mean'], self.decimals[key])
+        for key in self.minmax_keys:
+            avg_data[f"{key}_min"] = quantize(window[key]['min'], self.decimals[key])
+            avg_data[f"{key}_max"] = quantize(window[key]['max'], self.decimals[key])
 
         # Spezielle Anforderung: Print total_dc_power
         if 'total_dc_power' in avg_data and avg_data['total_dc_power'] is not None:
@@ -95,23 +240,105 @@ class PV_Database:
         # Zeitstempel für den DB-Eintrag (wir nehmen den aktuellen Zeitpunkt des Schreibens)
         write_timestamp = int(time.time())
 
+        # Nicht blockierend einreihen (bei voller Queue landet die Zeile in der Spill-Datei)
+        self.writer.submit(self.table, write_timestamp, avg_data)
+
+    def _write_row(self, conn, timestamp, values):
+        """
+        Schreibt eine Zeile samt Rollups (läuft im Writer-Thread innerhalb dessen Transaktion).
+        Gibt es für die Sekunde schon eine Zeile (z.B. persist_all() beim Beenden direkt nach dem
+        regulären Schreiben, nachgetragene Spill-Zeilen), bleibt sie erhalten; ergänzt werden nur
+        ihre fehlenden Werte, und nur diese gehen in die Rollups. Rohdaten und Rollups stimmen so überein.
+        """
+        if self.narrow:
+            stored, new_row = self._write_narrow(conn, timestamp, values)
+        else:
+            stored, new_row = self._write_wide(conn, timestamp, values)
+        if not new_row:
+            self._merged += 1
+        # Rollups in derselben Transaktion mitführen
+        if self.rollups and (new_row or stored):
+            self.rollups.add_row(timestamp, stored, conn, new_row)
+
+    def _base_key(self, key):
+        """Register, zu dem eine Spalte gehört (<name>_min/<name>_max gehören zu <name>)"""
+        if key.endswith(('_min', '_max')) and key[:-4] in self.registers:
+            return key[:-4]
+        return key
+
+    def _write_narrow(self, conn, timestamp, values):
+        """
+        Schmales Format: nur vorhandene Werte, eine Zeile pro Serie. Vorhandene Werte derselben
+        Sekunde werden nicht überschrieben. :return: (geschriebene Werte, True wenn keiner vorhanden war)
+        """
+        unknown = [key for key in values if key not in self.series_ids]
+        if unknown:
+            # z.B. nachgetragene Zeilen aus der Spill-Datei mit inzwischen entfernten Registern
+            self.series_ids, _ = register_series(conn, self.table, unknown)
+        query = f"INSERT OR IGNORE INTO {narrow_table(self.table)} (series_id, timestamp, value) VALUES (?, ?, ?)"
+        stored = {}
+        kept = set()   # Register, deren Wert schon vorhanden war (ihre Min/Max bleiben dann auch)
+        present = [key for key, val in values.items() if val is not None]
+        # Register vor ihren Min/Max-Spalten, damit diese bei einem vorhandenen Wert mit übersprungen werden
+        for key in sorted(present, key=lambda k: k != self._base_key(k)):
+            if self._base_key(key) in kept:
+                continue
+            if conn.execute(query, (self.series_ids[key], timestamp, values[key])).rowcount:
+                stored[key] = values[key]
+            else:
+                kept.add(self._base_key(key))
+        return stored, not kept
+
+    def _write_wide(self, conn, timestamp, values):
         # SQL Insert vorbereiten
         cols = ['timestamp']
-        vals = [write_timestamp]
+        vals = [timestamp]
         placeholders = ['?']
 
-        for key, val in avg_data.items():
+        for key, val in values.items():
             cols.append(key)
             vals.append(val)
             placeholders.append('?')
 
-        query = f"INSERT INTO readings ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
+        stored, new_row = values, True
+        if self.partitioned:
+            # Zeitstempel ist Primärschlüssel der Partition: ein zweiter Eintrag in derselben Sekunde
+            # füllt nur die leeren Spalten der vorhandenen Zeile (samt Min/Max des Registers)
+            target = self._ensure_partition(timestamp, conn)
+            cursor = conn.execute(f"SELECT * FROM {target} WHERE timestamp = ?", (timestamp,))
+            existing = cursor.fetchone()
+            if existing is None:
+                query = f"INSERT INTO {target} ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
+            else:
+                existing = dict(zip((col[0] for col in cursor.description), existing))
+                stored = {key: val for key, val in values.items()
+                          if val is not None and existing.get(self._base_key(key)) is None}
+                new_row = False
+                if not stored:
+                    return stored, new_row
+                query = f"UPDATE {target} SET {', '.join(f'{key} = ?' for key in stored)} WHERE timestamp = ?"
+                vals = list(stored.values()) + [timestamp]
+        else:
+            target = self.table
+            query = f"INSERT INTO {self.table} ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
 
         try:
-            with self.conn:
-                self.conn.execute(query, vals)
-        except sqlite3.Error as e:
-            print(f"Datenbank Fehler beim Schreiben: {e}")
+            conn.execute(query, vals)
+        except sqlite3.OperationalError as e:
+            if 'no column named' not in str(e):
+                raise
+            # Spalte fehlt (z.B. Zeile aus der Spill-Datei mit einem inzwischen entfernten Register):
+            # ergänzen statt die Zeile zu verwerfen
+            missing = self._add_columns(conn, target, values.keys())
+            print(f"Datenbank: fehlende Spalte(n) {', '.join(missing)} in {target} ergänzt")
+            conn.execute(query, vals)
+        return stored, new_row
+
+    def stats(self):
+        stats = self.writer.stats()
+        stats['deferred'] = self._deferred
+        stats['merged_rows'] = self._merged
+        return stats
 
     def get_today_values(self, col_names=None, date_obj=None):
         """Gibt die historischen Werte eines bestimmten Tages für das Chart zurück"""
@@ -137,17 +364,15 @@ class PV_Database:
             start_ts = start_dt.timestamp()
             end_ts = end_dt.timestamp()
 
-            cursor = self.conn.cursor()
-
             # Nur valide Spaltennamen für die SQL-Abfrage verwenden
-            valid_cols = [c for c in col_names if isinstance(c, str) and (c in self.registers or c == "total_dc_power")]
+            known_cols = set(self._value_columns())
+            valid_cols = [c for c in col_names if isinstance(c, str) and (c in known_cols or c == "total_dc_power")]
             if not valid_cols:
                 return data # Leere Datenstruktur zurückgeben, wenn keine validen Spalten da sind
 
-            cols_str = ", ".join(valid_cols)
-            query = f"SELECT timestamp, {cols_str} FROM readings WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp ASC"
-            cursor.execute(query, (start_ts, end_ts))
-            rows = cursor.fetchall()
+            # Query-Router: liest nur die Partition(en) des Tages, über eine eigene Nur-Lese-Verbindung
+            with self.read_pool.connection() as conn:
+                rows = query_range(conn, self.table, valid_cols, start_ts, end_ts)
 
             for row in rows:
                 dt = datetime.datetime.fromtimestamp(row[0])
@@ -162,4 +387,6 @@ class PV_Database:
         return data
 
     def close(self):
+        # Writer schreibt die Queue leer (der letzte Benutzer beendet den Thread)
+        self.writer.release()
         self.conn.close()
@@ -0,0 +1,77 @@
+# Änderungserkennung (Deadband) zwischen Modbus-Abfrage und den Verbrauchern
+# (Web-Cache, Datenbank-Puffer). Nachts ändern sich fast alle Register nicht,
+# trotzdem wurde bisher bei jedem Poll jeder Wert neu formatiert und gepuffert.
+#
+# Konfiguration pro Register in registers.json (beides optional):
+#   "deadband": 5        -> absolute Schwelle in der Einheit des Registers (nach 'factor')
+#   "deadband_pct": 1.0  -> relative Schwelle in Prozent des zuletzt gemeldeten Werts
+# Ohne Angabe wird jede Änderung weitergegeben. Ein Wert wird weitergegeben, sobald er
+# eine der Schwellen überschreitet, von/zu None (Lesefehler) wechselt oder länger als
+# max_age Sekunden nicht mehr gemeldet wurde.
+
+import time
+
+
+class ChangeDetector:
+    def __init__(self, registers, max_age=600):
+        """
+        :param registers: Das Dictionary aus registers.json
+        :param max_age: Spätestens nach dieser Zeit (Sekunden) wird ein Wert erneut gemeldet
+        """
+        self.max_age = max_age
+        self.thresholds = {}
+        for name, data in registers.items():
+            absolute = float(data.get('deadband', 0) or 0)
+            relative = float(data.get('deadband_pct', 0) or 0) / 100
+            if absolute or relative:
+                self.thresholds[name] = (absolute, relative)
+
+        self.last = {}          # Register -> zuletzt gemeldeter Wert
+        self.last_emit = {}     # Register -> Zeitpunkt der letzten Meldung
+        self.received = 0
+        self.emitted = 0
+
+    def _changed(self, name, val, now):
+        if name not in self.last:
+            return True
+        last = self.last[name]
+        if now - self.last_emit[name] >= self.max_age:
+            return True
+        if val is None or last is None or isinstance(val, str) or isinstance(last, str):
+            return val != last
+
+        threshold = self.thresholds.get(name)
+        if threshold is None:
+            return val != last
+        absolute, relative = threshold
+        limit = max(absolute, abs(last) * relative)
+        return abs(val - last) > limit
+
+    def filter(self, raw, now=None):
+        """
+        Gibt nur die Werte zurück, die sich gegenüber der letzten Meldung geändert haben
+        :param raw: Rohwerte einer Abfrage (ohne Präfix)
+        """
+        if now is None:
+            now = time.monotonic()
+        changed = {}
+        for name, val in raw.items():
+            if self._changed(name, val, now):
+                changed[name] = val
+                self.last[name] = val
+                self.last_emit[name] = now
+        self.received += len(raw)
+        self.emitted += len(changed)
+        return changed
+
+    def reset(self):
+        """Vergisst alle gemeldeten Werte (der nächste Poll liefert wieder alles)"""
+        self.last.clear()
+        self.last_emit.clear()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'emitted': self.emitted,
+            'suppressed_pct': round(100 * (1 - self.emitted / self.received), 1) if self.received else 0.0,
+        }
@@ -0,0 +1,309 @@
+# Mehrere Modbus-Geräte (zweiter Wechselrichter, Batterie-Stack auf eigener Unit ID,
+# externer Zähler) parallel abfragen.
+#
+# Optionale Konfiguration in devices.json (fehlt die Datei, wird nur der Wechselrichter
+# aus den Konstanten in main_raspi.py abgefragt):
+# [
+#     {"name": "wr1", "ip": "192.168.178.154", "port": 502, "slave_id": 1, "registers": "registers.json"},
+#     {"name": "wr2", "ip": "192.168.178.155", "slave_id": 1, "registers": "registers.json", "timeout": 3,
+#      "storage": "narrow"}
+# ]
+# Das erste Gerät ist das Hauptgerät: seine Keys bleiben ohne Präfix (kompatibel zu den
+# Webseiten) und es schreibt in die Tabelle 'readings'. Alle weiteren Geräte bekommen
+# das Präfix "<name>_" und eine eigene Tabelle "readings_<name>".
+
+import concurrent.futures
+import json
+import os
+import re
+import threading
+import time
+
+from PV_Database import PV_Database
+from PV_Deadband import ChangeDetector
+from PV_Metrics import METRICS
+from PV_Modbus import MAX_BLOCK_SIZE, ModbusSession, build_read_plan
+from PV_ModbusAsync import AsyncModbusEngine
+from PV_Pacing import AdaptivePacer
+from PV_Scheduler import PollScheduler
+
+CYCLE_TIME = METRICS.histogram('pv_poll_cycle_seconds', 'Dauer eines Poll-Zyklus pro Gerät', ('device',))
+START_LATENESS = METRICS.histogram('pv_poll_start_lateness_seconds',
+                                   'Verspätung des Zyklusstarts gegenüber der geplanten Deadline', ('device',))
+NONE_VALUES = METRICS.counter('pv_modbus_none_values_total', 'Register ohne gültigen Wert (None)', ('device',))
+
+# Werte, die bei mehreren Geräten zu Anlagen-Summen (Präfix "site_") addiert werden
+SITE_TOTAL_KEYS = ['total_dc_power', 'daily_pv_generation', 'battery_power', 'export_power',
+                   'daily_import_energy', 'daily_export_energy']
+
+
+class ModbusDevice:
+    """Ein Modbus-Gerät mit eigener Register-Map, eigenem Scheduler, eigener Verbindung und Tabelle"""
+
+    def __init__(self, name, host, port, slave_id, registers, prefix="", table_name="readings",
+                 default_interval=5, timeout=None, engine="sync", async_depth=4, pacing=True, deadband=True, logger=None,
+                 storage="wide"):
+        self.name = name
+        self.prefix = prefix
+        self.registers = registers
+        self.logger = logger
+        # Adaptive Taktung: gelernte Pause/Blockgröße aus pacing_state.json (Schlüssel = Gerätename)
+        self.pacer = AdaptivePacer(key=name) if pacing else None
+        max_block = self.pacer.max_block if self.pacer else MAX_BLOCK_SIZE
+        self.plan = build_read_plan(registers, max_block)
+        self.scheduler = PollScheduler(registers, default_interval=default_interval, max_block=max_block)
+        # Maximale Wartezeit des Poll-Loops auf dieses Gerät (danach wird es übersprungen)
+        self.timeout = timeout if timeout else max(1.0, self.scheduler.tick * 2)
+
+        if engine == "async":
+            self.session = AsyncModbusEngine(host, port=port, slave_id=slave_id, depth=async_depth,
+                                             cycle_deadline=max(0.5, self.scheduler.tick * 0.8), logger=logger,
+                                             pacer=self.pacer, name=name)
+        else:
+            self.session = ModbusSession(host, port=port, slave_id=slave_id, logger=logger, pacer=self.pacer,
+                                         name=name)
+        self.lock = threading.Lock() # Poll-Loop und Web-Thread (leerer Cache) teilen sich die Verbindung
+
+        self.db = PV_Database(registers_dict=registers, table_name=table_name, storage=storage)
+        # Änderungserkennung: an Cache und Datenbank gehen nur geänderte Werte (Schwellen aus registers.json)
+        self.changes = ChangeDetector(registers) if deadband else None
+        self.timeouts = 0 # Zyklen, in denen das Gerät nicht rechtzeitig geantwortet hat
+        self.available = True # False nach einer fehlgeschlagenen Abfrage (keine Verbindung, Lesefehler)
+
+    def read(self, plan=None):
+        """
+        Liest die Register des Leseplans (Standard: alle) blockweise über die dauerhafte Verbindung aus
+        und gibt ein Dictionary mit Rohwerten (Zahlen, ohne Präfix) zurück
+        """
+        data_output = {}
+        if plan is None:
+            plan = self.plan
+
+        start = time.monotonic()
+        with self.lock:
+            if self.session.ensure_connected():
+                try:
+                    data_output = self.session.read_plan(plan)
+                    self.available = True
+                except Exception as e:
+                    self.available = False
+                    msg = f"[{self.name}] Fehler beim Lesen der Register: {e}"
+                    print(msg)
+                    if self.logger:
+                        self.logger.log_error(msg)
+                    self.session.invalidate()
+            else:
+                self.available = False
+                msg = f"[{self.name}] Keine Verbindung zum Gerät möglich"
+                print(msg)
+                if self.logger:
+                    self.logger.log_error(msg)
+
+        CYCLE_TIME.observe(time.monotonic() - start, (self.name,))
+        none_count = sum(1 for val in data_output.values() if val is None)
+        if none_count:
+            NONE_VALUES.inc((self.name,), none_count)
+        return data_output
+
+    def _apply_pacing(self):
+        """Übernimmt eine vom Pacer geänderte Blockgröße in die Lesepläne"""
+        if self.pacer and self.pacer.max_block != self.scheduler.max_block:
+            self.scheduler.set_max_block(self.pacer.max_block)
+            self.plan = build_read_plan(self.registers, self.pacer.max_block)
+
+    def poll(self):
+        """Liest nur die aktuell fälligen Register (Multi-Rate Scheduler)"""
+        self._apply_pacing()
+        plan = self.scheduler.due()
+        if not plan:
+            return {}
+        START_LATENESS.observe(self.scheduler.last_lateness, (self.name,))
+        return self.read(plan)
+
+    def close(self):
+        self.session.close()
+        if self.pacer:
+            self.pacer.save(force=True)
+
+
+class DeviceManager:
+    """Fragt alle Geräte parallel ab und führt die Ergebnisse zu einem Snapshot zusammen"""
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.primary = devices[0]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="ModbusDevice")
+        self._futures = {}   # Gerät -> laufende Abfrage
+        self.latest = {device.name: {} for device in devices}   # Letzte Rohwerte pro Gerät
+
+        # Einheiten für die UI-Formatierung (Keys mit Präfix)
+        self.units = {}
+        for device in devices:
+            for name, data in device.registers.items():
+                self.units[device.prefix + name] = data.get('unit', '')
+        if len(devices) > 1:
+            for key in SITE_TOTAL_KEYS:
+                if key in self.primary.registers:
+                    self.units[f"site_{key}"] = self.primary.registers[key].get('unit', '')
+
+        # Vorhandene Zähler der Geräte erst beim Abruf von /metrics einsammeln
+        METRICS.register_collector('devices', self._collect_metrics)
+
+    def poll(self):
+        """
+        Startet für jedes freie Gerät eine Abfrage der fälligen Register und wartet höchstens bis
+        zum Timeout des jeweiligen Geräts. Ein langsames Gerät blockiert die anderen nicht: seine
+        Abfrage läuft weiter und das Ergebnis wird im nächsten Zyklus abgeholt.
+        :return: Dictionary Gerät -> geänderte Rohwerte (nur Geräte mit Ergebnis)
+        """
+        start = time.monotonic()
+        for device in self.devices:
+            if device not in self._futures:
+                self._futures[device] = self.executor.submit(device.poll)
+
+        results = {}
+        for device in sorted(self._futures, key=lambda d: d.timeout):
+            future = self._futures[device]
+            remaining = device.timeout - (time.monotonic() - start)
+            try:
+                raw = future.result(timeout=max(0.0, remaining))
+            except concurrent.futures.TimeoutError:
+                device.timeouts += 1
+                # Nach der Wiederkehr alle Werte melden (gehaltene Werte enden nach MAX_HOLD)
+                if device.changes:
+                    device.changes.reset()
+                continue
+            except Exception as e:
+                print(f"[{device.name}] Fehler bei der Abfrage: {e}")
+                device.available = False
+                raw = {}
+            del self._futures[device]
+            self.latest[device.name].update(raw)
+            if not device.available and device.changes:
+                device.changes.reset()
+            results[device] = device.changes.filter(raw) if device.changes else raw
+
+        return results
+
+    def merge(self, results):
+        """Führt die Rohwerte aller Geräte mit Präfix zusammen und ergänzt die Anlagen-Summen"""
+        merged = {}
+        for device, raw in results.items():
+            if device.prefix:
+                for name, val in raw.items():
+                    merged[device.prefix + name] = val
+            else:
+                merged.update(raw)
+
+        # Anlagen-Summen nur neu bilden, wenn sich einer der Summanden geändert hat
+        if len(self.devices) > 1 and any(key in raw for raw in results.values() for key in SITE_TOTAL_KEYS):
+            for key in SITE_TOTAL_KEYS:
+                values = [latest.get(key) for latest in self.latest.values()]
+                values = [val for val in values if isinstance(val, (int, float))]
+                if values:
+                    merged[f"site_{key}"] = sum(values)
+        return merged
+
+    def wait_time(self):
+        """Sekunden bis zum nächsten fälligen Register über alle Geräte"""
+        return min(device.scheduler.wait_time() for device in self.devices)
+
+    def stats(self):
+        return {
+            'reconnects': sum(device.session.reconnect_count for device in self.devices),
+            'missed_deadlines': sum(device.scheduler.missed_deadlines for device in self.devices),
+            'timeouts': sum(device.timeouts for device in self.devices),
+            'pacing': {device.name: device.pacer.stats() for device in self.devices if device.pacer},
+            'deadband': {device.name: device.changes.stats() for device in self.devices if device.changes},
+        }
+
+    def _collect_metrics(self):
+        def per_device(func):
+            return [({'device': device.name}, func(device)) for device in self.devices]
+
+        families = [
+            ('pv_modbus_retries_total', 'counter', 'Wiederholte Modbus-Anfragen',
+             per_device(lambda d: d.session.retries)),
+            ('pv_modbus_reconnects_total', 'counter', 'Neu aufgebaute Modbus-Verbindungen',
+             per_device(lambda d: d.session.reconnect_count)),
+            ('pv_poll_missed_deadlines_total', 'counter', 'Übersprungene Zeitschlitze des Schedulers',
+             per_device(lambda d: d.scheduler.missed_deadlines)),
+            ('pv_poll_device_timeouts_total', 'counter', 'Zyklen, in denen das Gerät nicht rechtzeitig antwortete',
+             per_device(lambda d: d.timeouts)),
+            ('pv_poll_cycles_total', 'counter', 'Gestartete Poll-Zyklen', per_device(lambda d: d.scheduler.cycles)),
+        ]
+        paced = [device for device in self.devices if device.pacer]
+        if paced:
+            families.append(('pv_modbus_request_gap_seconds', 'gauge', 'Aktuelle Pause zwischen zwei Anfragen',
+                             [({'device': d.name}, round(d.pacer.gap, 4)) for d in paced]))
+            families.append(('pv_modbus_max_block_registers', 'gauge', 'Aktuelle maximale Blockgröße',
+                             [({'device': d.name}, d.pacer.max_block) for d in paced]))
+        filtered = [device for device in self.devices if device.changes]
+        if filtered:
+            families.append(('pv_deadband_suppressed_total', 'counter', 'Unveränderte Werte, die nicht weitergereicht wurden',
+                             [({'device': d.name}, d.changes.received - d.changes.emitted) for d in filtered]))
+        return families
+
+    def persist_all(self):
+        for device in self.devices:
+            device.db.persist_data()
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        self.executor.shutdown(wait=False)
+
+
+def load_device_configs(devices_file, default_device):
+    """
+    Lädt die Geräteliste aus devices.json. Fehlt die Datei, wird nur das Standardgerät verwendet.
+    :param default_device: Dictionary mit name, ip, port, slave_id, registers (Dateiname)
+    """
+    configs = [default_device]
+    if os.path.exists(devices_file):
+        try:
+            with open(devices_file, 'r', encoding='utf-8') as f:
+                configs = json.load(f)
+        except Exception as e:
+            print(f"Fehler beim Laden der {os.path.basename(devices_file)}: {e}")
+
+    valid = []
+    for cfg in configs:
+        if not re.fullmatch(r'[A-Za-z0-9_]+', str(cfg.get('name', ''))):
+            print(f"Ungültiger Gerätename '{cfg.get('name')}' (erlaubt: Buchstaben, Ziffern, _) - Gerät wird ignoriert")
+            continue
+        valid.append(cfg)
+    return valid or [default_device]
+
+
+def create_devices(configs, default_interval=5, engine="sync", async_depth=4, pacing=True, deadband=True,
+                   logger=None, registers_cache=None, storage="wide"):
+    """Erzeugt die Geräte. Das erste Gerät behält Keys ohne Präfix und die Tabelle 'readings'."""
+    base_dir = os.path.dirname(__file__)
+    registers_cache = dict(registers_cache or {})
+    devices = []
+    for idx, cfg in enumerate(configs):
+        reg_file = cfg.get('registers', 'registers.json')
+        if reg_file not in registers_cache:
+            try:
+                with open(os.path.join(base_dir, reg_file), 'r', encoding='utf-8') as f:
+                    registers_cache[reg_file] = json.load(f)
+            except Exception as e:
+                print(f"Fehler beim Laden der {reg_file}: {e}")
+                registers_cache[reg_file] = {}
+
+        name = cfg['name']
+        primary = idx == 0
+        devices.append(ModbusDevice(
+            name, cfg['ip'], cfg.get('port', 502), cfg.get('slave_id', 1), registers_cache[reg_file],
+            prefix="" if primary else f"{name}_",
+            table_name="readings" if primary else f"readings_{name}",
+            default_interval=cfg.get('interval', default_interval),
+            timeout=cfg.get('timeout'),
+            engine=cfg.get('engine', engine),
+            async_depth=cfg.get('async_depth', async_depth),
+            pacing=cfg.get('pacing', pacing),
+            deadband=cfg.get('deadband', deadband),
+            logger=logger,
+            storage=cfg.get('storage', storage)))
+    return devices
@@ -0,0 +1,347 @@
+# Asyncio-HTTP-Server (nur Standardbibliothek) für PV_Web und die Go-e API
+# Ersetzt ThreadingMixIn + HTTPServer, der pro Anfrage einen neuen Thread startete:
+#   - HTTP/1.1 mit Keep-Alive: ein Tablet hält eine Verbindung offen statt pro Abruf neu zu verbinden
+#   - alle Verbindungen laufen in einem Event-Loop-Thread; nur blockierende Arbeit (Datenbank,
+#     Homematic/Fritz/Go-e-Aufrufe) geht als Offload in einen Thread-Pool fester Größe
+#   - Obergrenzen: gleichzeitig bearbeitete Anfragen (sonst 503), belegte Worker-Threads (sonst 503,
+#     auch wenn eine Bearbeitung nach dem Zeitlimit noch im Thread weiterläuft), offene Streams (SSE),
+#     Größe von Kopf und Body
+#   - Zeitlimits: Kopf lesen, Leerlauf zwischen zwei Anfragen einer Verbindung, Bearbeitung
+#     einer Anfrage (sonst 504)
+#
+# Die Anwendung ist eine Funktion handler(request) -> Response | Offload | StreamResponse,
+# die im Event-Loop läuft und deshalb nicht blockieren darf:
+#   Response(status, body, content_type, headers)  fertige Antwort
+#   Offload(func)                                  func() -> Response läuft im Thread-Pool
+#   StreamResponse(producer, content_type, headers) async producer(write, run_blocking) schreibt
+#                                                  solange er will; danach wird die Verbindung geschlossen
+
+import asyncio
+import concurrent.futures
+import http
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from PV_Metrics import METRICS
+
+SERVER_NAME = "PV_Web"
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body, client):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers   # Kopfzeilen mit kleingeschriebenen Namen
+        self.body = body
+        self.client = client
+        parsed = urlparse(target)
+        self.path = parsed.path
+        self.query = parse_qs(parsed.query)
+
+    def header(self, name, default=""):
+        return self.headers.get(name.lower(), default)
+
+
+class Response:
+    def __init__(self, status=200, body=b"", content_type=None, headers=None):
+        self.status = status
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.headers = list(headers or [])
+        if content_type:
+            self.headers.insert(0, ('Content-Type', content_type))
+
+    @classmethod
+    def error(cls, status, message=None):
+        status = http.HTTPStatus(status)
+        return cls(status.value, f"{status.value} {message or status.phrase}\n", 'text/plain; charset=utf-8')
+
+
+class Offload:
+    """Blockierende Bearbeitung: func() -> Response läuft im Thread-Pool des Servers"""
+
+    def __init__(self, func):
+        self.func = func
+
+
+class StreamResponse:
+    """Offene Antwort ohne Länge (z.B. Server-Sent Events); die Verbindung endet mit dem Producer"""
+
+    def __init__(self, producer, content_type, headers=None):
+        self.producer = producer
+        self.content_type = content_type
+        self.headers = list(headers or [])
+
+
+class AsyncHTTPServer:
+    def __init__(self, handler, port=8080, host='0.0.0.0', workers=4, max_concurrent=32, max_streams=32,
+                 header_timeout=10.0, keepalive_timeout=30.0, request_timeout=30.0, max_body=64 * 1024,
+                 name=SERVER_NAME):
+        """
+        :param handler: handler(request) -> Response | Offload | StreamResponse (läuft im Event-Loop)
+        :param workers: Threads für blockierende Bearbeitung (Offload)
+        :param max_concurrent: Gleichzeitig bearbeitete Anfragen, darüber 503 (Streams zählen nicht mit)
+        :param max_streams: Gleichzeitig offene Streams, darüber 503
+        :param header_timeout: Sekunden für das Lesen von Anfragezeile, Kopf und Body
+        :param keepalive_timeout: Sekunden Leerlauf, nach denen eine Keep-Alive-Verbindung geschlossen wird
+        :param request_timeout: Sekunden für eine Bearbeitung im Thread-Pool, darüber 504
+        :param max_body: Größte angenommene Body-Größe in Bytes, darüber 413
+        """
+        self.handler = handler
+        self.port = port
+        self.host = host
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.max_streams = max_streams
+        self.header_timeout = header_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.max_body = max_body
+        self.name = name
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-worker")
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+        self.connections = 0
+        self.active = 0
+        self.streams = 0
+        self.requests = 0
+        self.keepalive_reuses = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.busy_workers = 0   # Belegte Threads im Pool (bis die Funktion wirklich zurückkehrt)
+        METRICS.register_collector(f"http:{port}", self._collect_metrics)
+
+    def start(self):
+        """Startet den Event-Loop in einem Daemon-Thread und wartet, bis der Port gebunden ist"""
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-loop", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error:
+            raise self._start_error
+
+    def stop(self, timeout=5.0):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(timeout)
+        self.executor.shutdown(wait=False)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._serve, self.host, self.port, reuse_address=True))
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            # Offene Verbindungen (Keep-Alive, Streams) abbrechen und ihr Aufräumen abwarten
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        client = writer.get_extra_info('peername')
+        served = 0
+        try:
+            while True:
+                # Erste Anfrage: Kopf-Zeitlimit; danach Leerlauf-Zeitlimit der Keep-Alive-Verbindung
+                timeout = self.header_timeout if served == 0 else self.keepalive_timeout
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, Response.error(431), keep_alive=False)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request, error = self._parse(head, client)
+                if error:
+                    await self._write(writer, error, keep_alive=False)
+                    break
+                length = request.header('content-length', '0')
+                if not length.isdigit() or 'transfer-encoding' in request.headers:
+                    await self._write(writer, Response.error(411), keep_alive=False)
+                    break
+                if int(length) > self.max_body:
+                    await self._write(writer, Response.error(413), keep_alive=False)
+                    break
+                if int(length):
+                    try:
+                        request.body = await asyncio.wait_for(reader.readexactly(int(length)), self.header_timeout)
+                    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                        break
+
+                if served:
+                    self.keepalive_reuses += 1
+                served += 1
+                self.requests += 1
+                keep_alive = self._keep_alive(request)
+                response = await self._dispatch(request)
+
+                if isinstance(response, StreamResponse):
+                    await self._stream(writer, request, response)
+                    break
+                await self._write(writer, response, keep_alive, head_only=request.method == 'HEAD')
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass # Client weg oder Server wird beendet
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _parse(self, head, client):
+        """:return: (Request, None) oder (None, Fehlerantwort)"""
+        try:
+            lines = head.decode('iso-8859-1').split("\r\n")
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            return None, Response.error(400)
+        if not version.startswith("HTTP/1."):
+            return None, Response.error(505)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                return None, Response.error(400)
+            headers[name.strip().lower()] = value.strip()
+        return Request(method, target, version, headers, b"", client), None
+
+    @staticmethod
+    def _keep_alive(request):
+        connection = request.header('connection').lower()
+        if request.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def _submit(self, func, *args):
+        """
+        Startet func im Thread-Pool. Der Worker gilt als belegt, bis func zurückkehrt, auch wenn
+        der Aufrufer nach dem Zeitlimit nicht mehr wartet (ein Thread lässt sich nicht abbrechen).
+        """
+        self.busy_workers += 1
+        future = self.executor.submit(func, *args)
+
+        def release(_):
+            try:
+                self._loop.call_soon_threadsafe(self._release_worker)
+            except RuntimeError:
+                pass # Event-Loop ist bereits beendet
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future, loop=self._loop)
+
+    def _release_worker(self):
+        self.busy_workers -= 1
+
+    async def _dispatch(self, request):
+        """Ruft den Handler auf (blockierende Teile im Thread-Pool) und begrenzt die Parallelität"""
+        if self.active >= self.max_concurrent:
+            self.rejected += 1
+            return Response.error(503, "Server ausgelastet")
+        self.active += 1
+        try:
+            response = self.handler(request)
+            if isinstance(response, Offload):
+                if self.busy_workers >= self.workers:
+                    # Alle Threads belegt (z.B. hängende Verlaufsabfragen): sofort ablehnen statt einzureihen
+                    self.rejected += 1
+                    return Response.error(503, "Alle Worker belegt")
+                response = await asyncio.wait_for(self._submit(response.func), self.request_timeout)
+            return response
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return Response.error(504, "Zeitlimit überschritten")
+        except Exception as e:
+            print(f"Webserver: Fehler bei {request.method} {request.path}: {e}")
+            return Response.error(500)
+        finally:
+            self.active -= 1
+
+    async def _write(self, writer, response, keep_alive, head_only=False):
+        status = http.HTTPStatus(response.status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Server: {self.name}"]
+        lines.extend(f"{name}: {value}" for name, value in response.headers)
+        if status.value != 304:
+            lines.append(f"Content-Length: {len(response.body)}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        if keep_alive:
+            lines.append(f"Keep-Alive: timeout={int(self.keepalive_timeout)}")
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode('iso-8859-1')
+        if not head_only and status.value != 304:
+            data += response.body
+        writer.write(data)
+        await writer.drain()
+
+    async def _stream(self, writer, request, response):
+        if self.streams >= self.max_streams:
+            self.rejected += 1
+            await self._write(writer, Response.error(503, "Zu viele offene Streams"), keep_alive=False)
+            return
+        lines = ["HTTP/1.1 200 OK", f"Server: {self.name}", f"Content-Type: {response.content_type}"]
+        lines.extend(f"{name}: {value}" for name, value in response.headers)
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('iso-8859-1'))
+
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+
+        async def run_blocking(func, *args):
+            return await self._submit(func, *args)
+
+        self.streams += 1
+        try:
+            await writer.drain()
+            await response.producer(write, run_blocking)
+        except (ConnectionError, asyncio.CancelledError):
+            pass # Client hat die Seite geschlossen
+        finally:
+            self.streams -= 1
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'active': self.active,
+            'streams': self.streams,
+            'requests': self.requests,
+            'keepalive_reuses': self.keepalive_reuses,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'busy_workers': self.busy_workers,
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        labels = {'server': self.name, 'port': str(self.port)}
+        return [
+            ('pv_http_connections', 'gauge', 'Offene HTTP-Verbindungen', [(labels, stats['connections'])]),
+            ('pv_http_active_requests', 'gauge', 'Gerade bearbeitete Anfragen', [(labels, stats['active'])]),
+            ('pv_http_streams', 'gauge', 'Offene Streams (SSE)', [(labels, stats['streams'])]),
+            ('pv_http_requests_total', 'counter', 'Bearbeitete Anfragen', [(labels, stats['requests'])]),
+            ('pv_http_keepalive_reuses_total', 'counter', 'Anfragen über eine bestehende Verbindung', [(labels, stats['keepalive_reuses'])]),
+            ('pv_http_rejected_total', 'counter', 'Wegen Überlast abgewiesene Anfragen (503)', [(labels, stats['rejected'])]),
+            ('pv_http_timeouts_total', 'counter', 'Anfragen über dem Zeitlimit (504)', [(labels, stats['timeouts'])]),
+            ('pv_http_busy_workers', 'gauge', 'Belegte Threads für blockierende Bearbeitung', [(labels, stats['busy_workers'])]),
+        ]
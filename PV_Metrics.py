@@ -0,0 +1,134 @@
+# Messpunkte für den Abfrage-Pfad (Latenzen, Zähler) im Prometheus-Textformat.
+# Die Messwerte werden im Hot-Path nur hochgezählt (Dictionary-Zugriff + bisect);
+# formatiert wird erst beim Abruf von /metrics. Werte, die ohnehin schon als Zähler
+# in den Objekten liegen (Reconnects, Retries, verpasste Deadlines), werden über
+# Collector-Funktionen erst beim Abruf eingesammelt.
+
+import bisect
+import threading
+
+# Standard-Buckets in Sekunden (Modbus-Anfragen über den WiNet-S liegen typ. bei 20-300 ms)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = [f'{name}="{_escape(val)}"' for name, val in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}   # Labels -> [Zähler pro Bucket (+Inf am Ende), Summe, Anzahl]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self.series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = {}
+
+    def counter(self, name, help_text, labelnames=()):
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help_text, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help_text, labelnames, buckets)
+        return self.metrics[name]
+
+    def register_collector(self, key, func):
+        """
+        Registriert (oder ersetzt) eine Funktion, die erst beim Abruf aufgerufen wird.
+        Sie liefert eine Liste von (Name, Typ, Hilfetext, [(Label-Dictionary, Wert), ...]).
+        """
+        self.collectors[key] = func
+
+    def render(self):
+        """Gibt alle Messwerte im Prometheus-Textformat (Version 0.0.4) zurück"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        for key, func in list(self.collectors.items()):
+            try:
+                families = func()
+            except Exception as e:
+                print(f"Fehler im Metrics-Collector '{key}': {e}")
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_str = _format_labels(labels.keys(), labels.values())
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Gemeinsame Registry für den Prozess (wird von PV_Web unter /metrics ausgeliefert)
+METRICS = MetricsRegistry()
@@ -0,0 +1,384 @@
+# Gemeinsame Modbus-Logik für main.py und main_raspi.py
+# Fasst die Register aus registers.json zu zusammenhängenden Blöcken zusammen,
+# damit pro Poll-Zyklus nur wenige Modbus-Transaktionen nötig sind.
+
+import random
+import select
+import struct
+import time
+
+from pymodbus.client import ModbusTcpClient
+
+from PV_Metrics import METRICS
+
+# Maximale Anzahl Register pro read_input_registers Anfrage (Modbus-Spezifikation)
+MAX_BLOCK_SIZE = 125
+
+# Modbus Exception Codes, die auf Überlast hindeuten (5: Acknowledge, 6: Device Busy)
+BUSY_EXCEPTION_CODES = (5, 6)
+
+# Feste Pause zwischen zwei Anfragen, wenn keine adaptive Taktung (PV_Pacing) aktiv ist
+DEFAULT_REQUEST_GAP = 0.05
+
+# Messpunkte (Ausgabe unter /metrics, siehe PV_Metrics)
+REQUEST_LATENCY = METRICS.histogram('pv_modbus_request_seconds',
+                                    'Antwortzeit einer erfolgreichen Modbus-Anfrage pro Block/Register',
+                                    ('device', 'block'))
+DECODE_ERRORS = METRICS.counter('pv_modbus_decode_errors_total',
+                                'Antworten, die nicht dekodiert werden konnten', ('device',))
+
+
+# Unterstützte Datentypen: Typ -> (Anzahl Register, struct-Code, Wortreihenfolge getauscht)
+# sw = Swapped Words. Sungrow nutzt oft (Low Word, High Word)
+REGISTER_TYPES = {
+    'uint16be': (1, 'H', False),
+    'int16be': (1, 'h', False),
+    'int8be': (1, 'xb', False),      # Nur das Low-Byte, mit Vorzeichen
+    'uint32be': (2, 'I', False),
+    'int32be': (2, 'i', False),
+    'uint32sw': (2, 'I', True),
+    'int32sw': (2, 'i', True),
+    'float32be': (2, 'f', False),
+    'float32sw': (2, 'f', True),
+    'uint64be': (4, 'Q', False),
+    'uint64sw': (4, 'Q', True),      # z.B. Energiezähler
+    'int64sw': (4, 'q', True),
+    'string': (None, 's', False),    # ASCII-Text (z.B. Seriennummer), Länge in Registern über 'length'
+}
+
+
+def register_count(data):
+    """Anzahl der 16-Bit Register, die ein Eintrag aus registers.json belegt"""
+    count = REGISTER_TYPES[data['type']][0]
+    if count is None:
+        count = data.get('length', 1)
+    return count
+
+
+class BlockDecoder:
+    """
+    Vorkompilierter Decoder für einen Adressblock.
+    Offsets, struct-Formate und Faktoren werden einmalig beim Start berechnet. Alle Werte
+    eines Blocks werden anschließend mit einem einzigen struct.unpack_from dekodiert:
+    normale Typen aus dem Big-Endian Puffer, Typen mit getauschter Wortreihenfolge aus dem
+    wortweise umgedrehten Puffer (dort liegen die Worte bereits in der richtigen Reihenfolge).
+    """
+
+    def __init__(self, fields, count):
+        """
+        :param fields: Liste von (name, offset, count, dtype, factor)
+        :param count: Anzahl der Register des Blocks
+        """
+        self.count = count
+        self.buffer_format = struct.Struct(f'>{count}H')
+        self.needs_swapped = any(REGISTER_TYPES[f[3]][2] for f in fields)
+
+        self.names = []
+        self.factors = []
+        self.parts = []  # (Struct, swapped) in der Reihenfolge von names
+
+        normal = sorted((f for f in fields if not REGISTER_TYPES[f[3]][2]), key=lambda f: f[1])
+        swapped = sorted((f for f in fields if REGISTER_TYPES[f[3]][2]),
+                         key=lambda f: count - f[1] - f[2])
+        self._compile(normal, False)
+        self._compile(swapped, True)
+
+    def _compile(self, fields, swapped):
+        """Baut aus den Feldern ein gemeinsames struct-Format (Lücken als Pad-Bytes)"""
+        fmt = '>'
+        pos = 0
+        overlapping = []
+        for name, offset, count, dtype, factor in fields:
+            # Im umgedrehten Puffer beginnt ein Wert an Position (Blocklänge - offset - count)
+            start = (self.count - offset - count) if swapped else offset
+            if start < pos:
+                # Überlappende Register passen nicht in das gemeinsame Format
+                overlapping.append((name, start, count, dtype, factor))
+                continue
+            fmt += f'{(start - pos) * 2}x' if start > pos else ''
+            fmt += self._code(dtype, count)
+            pos = start + count
+            self._add_name(name, dtype, factor)
+        if pos:
+            self.parts.append((struct.Struct(fmt), swapped))
+
+        for name, start, count, dtype, factor in overlapping:
+            self.parts.append((struct.Struct(f'>{start * 2}x{self._code(dtype, count)}'), swapped))
+            self._add_name(name, dtype, factor)
+
+    def _add_name(self, name, dtype, factor):
+        self.names.append(name)
+        # Faktor None kennzeichnet Texte, die nicht skaliert werden
+        self.factors.append(None if dtype == 'string' else factor)
+
+    @staticmethod
+    def _code(dtype, count):
+        code = REGISTER_TYPES[dtype][1]
+        if code == 's':
+            return f'{count * 2}s'
+        return code
+
+    def decode(self, regs):
+        """Dekodiert alle Werte des Blocks aus der Registerliste"""
+        raw = self.buffer_format.pack(*regs[:self.count])
+        rev = self.buffer_format.pack(*reversed(regs[:self.count])) if self.needs_swapped else None
+
+        values = []
+        for fmt, swapped in self.parts:
+            values.extend(fmt.unpack_from(rev if swapped else raw))
+
+        result = {}
+        for name, val, factor in zip(self.names, values, self.factors):
+            if factor is None:
+                result[name] = val.decode('ascii', errors='ignore').strip('\x00 ')
+            else:
+                result[name] = val * factor
+        return result
+
+
+def build_read_plan(registers, max_block=MAX_BLOCK_SIZE):
+    """
+    Gruppiert die Register in möglichst wenige zusammenhängende Adressbereiche.
+    Lücken zwischen den Registern werden mitgelesen, solange der Bereich
+    max_block Register nicht überschreitet. Für jeden Block wird einmalig ein
+    BlockDecoder kompiliert.
+    :param registers: Das Dictionary aus registers.json
+    :param max_block: Maximale Blockgröße in Registern (Modbus-Limit: 125)
+    :return: Liste von Blöcken {'start', 'count', 'registers': [(name, offset, count, dtype, factor), ...], 'decoder'}
+    """
+    items = sorted(registers.items(), key=lambda item: item[1]['address'])
+
+    plan = []
+    block = None
+    for name, data in items:
+        if data.get('type') not in REGISTER_TYPES:
+            print(f"Unbekannter Datentyp '{data.get('type')}' für Register {name} - wird ignoriert")
+            continue
+
+        addr = data['address']
+        count = register_count(data)
+
+        # Neuen Block beginnen, wenn das Register nicht mehr in den aktuellen passt
+        if block is None or addr + count - block['start'] > max_block:
+            block = {'start': addr, 'count': 0, 'registers': []}
+            plan.append(block)
+
+        block['count'] = max(block['count'], addr + count - block['start'])
+        block['registers'].append((name, addr - block['start'], count, data['type'], data.get('factor', 1)))
+
+    for block in plan:
+        block['decoder'] = BlockDecoder(block['registers'], block['count'])
+
+    return plan
+
+
+def decode_block(block, regs):
+    """Dekodiert alle Register eines Blocks aus dem gelesenen Puffer"""
+    return block['decoder'].decode(regs)
+
+
+def decode_block_checked(block, regs, device=""):
+    """
+    Wie decode_block, zählt aber Dekodierfehler (zu kurze Antwort, ungültiger String)
+    und liefert für die Register des Blocks dann None
+    """
+    try:
+        return decode_block(block, regs)
+    except (struct.error, ValueError, IndexError):
+        DECODE_ERRORS.inc((device,))
+        return {field[0]: None for field in block['registers']}
+
+
+def split_block(block):
+    """
+    Zerlegt einen Block in Einzelblöcke pro Register (Fallback, falls der Wechselrichter
+    den ganzen Bereich mit einer Modbus-Exception ablehnt). Wird beim ersten Bedarf kompiliert.
+    """
+    if 'singles' not in block:
+        singles = []
+        for name, offset, count, dtype, factor in block['registers']:
+            field = (name, 0, count, dtype, factor)
+            singles.append({'start': block['start'] + offset, 'count': count, 'registers': [field],
+                            'decoder': BlockDecoder([field], count)})
+        block['singles'] = singles
+    return block['singles']
+
+
+def read_input_registers(client, address, count, slave_id):
+    """Robuste Methode für alle pymodbus Versionen"""
+    try:
+        return client.read_input_registers(address=address, count=count, device_id=slave_id)
+    except TypeError:
+        try:
+            return client.read_input_registers(address=address, count=count, slave=slave_id)
+        except TypeError:
+            return client.read_input_registers(address=address, count=count, unit=slave_id)
+
+
+def backoff_delay(failed_attempts, base, maximum):
+    """Exponentielles Backoff mit Jitter, damit mehrere Clients nicht synchron anklopfen"""
+    delay = min(maximum, base * (2 ** (failed_attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+class ModbusSession:
+    """
+    Langlebige Modbus-TCP-Verbindung zum Wechselrichter.
+    Die Verbindung bleibt über alle Poll-Zyklen offen und wird nur bei Bedarf neu
+    aufgebaut (exponentielles Backoff mit Jitter). Der WiNet-S Dongle akzeptiert nur
+    wenige Clients, ständige Handshakes führen dort zu "Connection reset" Fehlern.
+    """
+
+    def __init__(self, host, port=502, slave_id=1, timeout=3, backoff_base=0.5, backoff_max=60, logger=None, pacer=None, name=None):
+        """
+        :param host: IP-Adresse des Wechselrichters oder WiNet-S Dongles
+        :param slave_id: Modbus Unit ID
+        :param backoff_base: Wartezeit in Sekunden nach dem ersten fehlgeschlagenen Verbindungsversuch
+        :param backoff_max: Obergrenze der Wartezeit zwischen zwei Verbindungsversuchen
+        :param pacer: Optionaler PV_Pacing.AdaptivePacer für die Pause zwischen den Anfragen
+        :param name: Gerätename für die Messpunkte (Standard: host)
+        """
+        self.host = host
+        self.port = port
+        self.slave_id = slave_id
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger
+        self.pacer = pacer
+        self.name = name or host
+        self.client = ModbusTcpClient(host, port=port, timeout=timeout)
+
+        self.reconnect_count = 0   # Erfolgreiche Neuverbindungen nach dem ersten Connect
+        self.failed_attempts = 0   # Fehlgeschlagene Verbindungsversuche in Folge
+        self.retries = 0           # Wiederholte Leseversuche nach Fehlern
+        self.next_attempt = 0.0    # Frühester Zeitpunkt (monotonic) für den nächsten Versuch
+        self._ever_connected = False
+
+    def is_alive(self):
+        """Prüft, ob der Socket offen ist und nicht von der Gegenstelle geschlossen wurde"""
+        sock = getattr(self.client, 'socket', None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if readable:
+                # Lesbar ohne offene Anfrage: EOF (Gegenstelle hat geschlossen) oder veraltete Daten
+                return False
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def ensure_connected(self):
+        """
+        Stellt sicher, dass eine Verbindung besteht.
+        Während eines laufenden Backoffs wird kein neuer Versuch unternommen.
+        :return: True, wenn die Verbindung nutzbar ist
+        """
+        if self.is_alive():
+            return True
+
+        now = time.monotonic()
+        if now < self.next_attempt:
+            return False
+
+        self.client.close()
+        if self.client.connect():
+            if self._ever_connected:
+                self.reconnect_count += 1
+            self._ever_connected = True
+            self.failed_attempts = 0
+            self.next_attempt = 0.0
+            return True
+
+        self.failed_attempts += 1
+        delay = backoff_delay(self.failed_attempts, self.backoff_base, self.backoff_max)
+        self.next_attempt = now + delay
+        if self.logger:
+            self.logger.log_error(f"Verbindung zu {self.host}:{self.port} fehlgeschlagen "
+                                  f"(Versuch {self.failed_attempts}), nächster Versuch in {delay:.1f}s")
+        return False
+
+    def invalidate(self):
+        """Verwirft die aktuelle Verbindung nach einem Fehler (z.B. Broken Pipe)"""
+        self.client.close()
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        """Kennzahlen der Verbindung für Status-Ausgaben"""
+        return {
+            'connected': self.is_alive(),
+            'reconnects': self.reconnect_count,
+            'failed_attempts': self.failed_attempts,
+            'retries': self.retries,
+        }
+
+    def _read_with_retry(self, address, count, label):
+        """Liest einen Adressbereich mit bis zu 3 Versuchen, falls die Verbindung abbricht (Broken Pipe)"""
+        rr = None
+        for attempt in range(3):
+            if attempt:
+                self.retries += 1
+            start = time.monotonic()
+            try:
+                rr = read_input_registers(self.client, address, count, self.slave_id)
+                if not rr.isError():
+                    latency = time.monotonic() - start
+                    REQUEST_LATENCY.observe(latency, (self.name, f"Block {address}-{address + count - 1}"))
+                    if self.pacer:
+                        self.pacer.on_success(latency)
+                    break # Erfolgreich gelesen
+                if self.pacer and getattr(rr, 'exception_code', None) in BUSY_EXCEPTION_CODES:
+                    self.pacer.on_failure()
+            except Exception as e:
+                # Bei Fehler Verbindung verwerfen und (unter Beachtung des Backoffs) neu aufbauen
+                rr = None
+                if self.pacer:
+                    self.pacer.on_failure()
+                if self.logger:
+                    self.logger.log_error(f"Lese-Versuch {attempt+1} fehlgeschlagen für {label}: {e}")
+                self.invalidate()
+                if not self.ensure_connected():
+                    break
+
+        # Kurze Pause, um den Wechselrichter/Dongle nicht zu überlasten (verhindert Connection Reset)
+        if self.pacer:
+            self.pacer.wait()
+        else:
+            time.sleep(DEFAULT_REQUEST_GAP)
+        return rr
+
+    def read_plan(self, plan):
+        """
+        Liest alle Blöcke des Leseplans und gibt ein Dictionary mit Rohwerten (Zahlen) zurück.
+        Liefert der Wechselrichter für einen Block einen Modbus-Fehler (z.B. ungültige Adresse
+        in einer Lücke), werden die Register dieses Blocks einzeln nachgelesen.
+        Ist die Verbindung gestört, werden die Werte des Blocks auf None gesetzt.
+        """
+        data_output = {}
+
+        for block in plan:
+            label = f"Block {block['start']}-{block['start'] + block['count'] - 1}"
+            rr = self._read_with_retry(block['start'], block['count'], label)
+
+            if rr and not rr.isError():
+                data_output.update(decode_block_checked(block, rr.registers, self.name))
+                continue
+
+            if rr is None:
+                # Verbindung gestört: Einzelabfragen würden nur weitere Timeouts erzeugen
+                for field in block['registers']:
+                    data_output[field[0]] = None
+                continue
+
+            # Fallback: Register des Blocks einzeln lesen
+            for single in split_block(block):
+                name = single['registers'][0][0]
+                rr = self._read_with_retry(single['start'], single['count'], name)
+                if rr and not rr.isError():
+                    data_output.update(decode_block_checked(single, rr.registers, self.name))
+                else:
+                    data_output[name] = None # None ist besser für DB als "Error" String
+
+        return data_output
@@ -0,0 +1,353 @@
+# Optionale asyncio-Engine für die Modbus-Abfrage
+# Hält mehrere Transaktionen (unterschiedliche Transaction IDs) gleichzeitig offen,
+# sodass ein Poll-Zyklus nur noch wenige Round-Trips dauert.
+#
+# Hinweis: Der AsyncModbusTcpClient von pymodbus (ab 3.7) serialisiert alle Anfragen
+# über ein asyncio.Lock. Für echtes Pipelining wird das Modbus-TCP-Framing (MBAP-Header
+# + Funktionscode 0x04) daher hier direkt auf asyncio-Streams umgesetzt.
+
+import asyncio
+import struct
+import threading
+import time
+
+from PV_Modbus import BUSY_EXCEPTION_CODES, REQUEST_LATENCY, backoff_delay, decode_block_checked, split_block
+
+# Modbus Funktionscode "Read Input Registers"
+FC_READ_INPUT_REGISTERS = 0x04
+# Pipelining wird erst abgeschaltet, wenn in so vielen Poll-Zyklen hintereinander eine gepipelinte
+# Anfrage in den Timeout lief, die allein wiederholt beantwortet wurde (ein WLAN-Aussetzer zählt nicht)
+PIPELINE_STRIKES = 3
+PIPELINE_RETRY_AFTER = 3600   # Sekunden seriellen Betriebs, nach denen die volle Tiefe erneut probiert wird
+
+
+class ModbusExceptionResponse(Exception):
+    """Der Wechselrichter hat eine Modbus-Exception (z.B. Code 2: ungültige Adresse) geliefert"""
+
+    def __init__(self, code):
+        super().__init__(f"Modbus Exception Code {code}")
+        self.code = code
+
+
+class AsyncModbusEngine:
+    """
+    Modbus-TCP-Client mit Pipelining auf einer einzigen Verbindung.
+    Läuft in einem eigenen Event-Loop-Thread und bietet dieselbe Schnittstelle wie
+    PV_Modbus.ModbusSession (ensure_connected, read_plan, invalidate, close, stats),
+    sodass main_raspi.py die Engine per Konfiguration austauschen kann.
+    """
+
+    def __init__(self, host, port=502, slave_id=1, depth=4, cycle_deadline=4.0, request_timeout=2.0,
+                 backoff_base=0.5, backoff_max=60, logger=None, pacer=None, name=None):
+        """
+        :param depth: Maximale Anzahl gleichzeitig offener Transaktionen (wird auf 1 reduziert, wenn das
+                      Gateway wiederholt keine parallelen Transaktionen beantwortet, und nach
+                      PIPELINE_RETRY_AFTER Sekunden erneut probiert)
+        :param cycle_deadline: Zeitbudget in Sekunden für einen kompletten Poll-Zyklus
+        :param request_timeout: Timeout für eine einzelne Transaktion
+        :param pacer: Optionaler PV_Pacing.AdaptivePacer (Pause vor jedem Senden)
+        :param name: Gerätename für die Messpunkte (Standard: host)
+        """
+        self.host = host
+        self.port = port
+        self.slave_id = slave_id
+        self.depth = max(1, depth)
+        self.configured_depth = self.depth
+        self.cycle_deadline = cycle_deadline
+        self.request_timeout = request_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger
+        self.pacer = pacer
+        self.name = name or host
+
+        self.reconnect_count = 0
+        self.failed_attempts = 0
+        self.next_attempt = 0.0
+        self.deadline_misses = 0
+        self.retries = 0
+        self.pipeline_strikes = 0   # Aufeinanderfolgende Zyklen mit Timeouts, die nur gepipelint auftraten
+        self._cycle_pipeline_failed = False
+        self._serial_since = None   # Seit wann ohne Pipelining gelesen wird (monotonic)
+        self._exclusive_waiting = 0   # Serielle Wiederholungen, die auf eine freie Leitung warten
+        self._ever_connected = False
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}   # Transaction ID -> Future
+        self._next_tid = 0
+        self._in_flight = 0
+
+        # Eigener Event-Loop im Hintergrund, damit der Haupt-Thread nicht blockiert wird
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ModbusAsyncLoop", daemon=True)
+        self._thread.start()
+        # Begrenzung der offenen Transaktionen (Condition statt Semaphore, da sich 'depth' ändern kann)
+        self._slots = self._call(self._create_condition(), 2)
+
+    # --- Schnittstelle für den synchronen Aufrufer (Poll-Loop) ---
+
+    def ensure_connected(self):
+        return self._call(self._ensure_connected(), self.request_timeout + 1)
+
+    def submit(self, plan):
+        """Startet einen Poll-Zyklus und liefert sofort ein concurrent.futures.Future zurück"""
+        return asyncio.run_coroutine_threadsafe(self.read_plan_async(plan), self._loop)
+
+    def read_plan(self, plan):
+        """Liest den kompletten Leseplan und gibt das Dictionary mit Rohwerten zurück"""
+        return self.submit(plan).result(self.cycle_deadline + 1)
+
+    def invalidate(self):
+        self._call(self._disconnect(), 2)
+
+    def close(self):
+        if self._loop.is_running():
+            self._call(self._disconnect(), 2)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def is_alive(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    def stats(self):
+        return {
+            'connected': self.is_alive(),
+            'reconnects': self.reconnect_count,
+            'failed_attempts': self.failed_attempts,
+            'deadline_misses': self.deadline_misses,
+            'retries': self.retries,
+            'depth': self.depth,
+            'pipeline_strikes': self.pipeline_strikes,
+        }
+
+    @staticmethod
+    async def _create_condition():
+        return asyncio.Condition()
+
+    def _call(self, coro, timeout):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    # --- Verbindungsverwaltung (läuft im Event-Loop) ---
+
+    async def _ensure_connected(self):
+        if self.is_alive():
+            return True
+
+        now = time.monotonic()
+        if now < self.next_attempt:
+            return False
+
+        await self._disconnect()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.request_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.failed_attempts += 1
+            delay = backoff_delay(self.failed_attempts, self.backoff_base, self.backoff_max)
+            self.next_attempt = now + delay
+            if self.logger:
+                self.logger.log_error(f"Async-Verbindung zu {self.host}:{self.port} fehlgeschlagen "
+                                      f"({e}), nächster Versuch in {delay:.1f}s")
+            return False
+
+        if self._ever_connected:
+            self.reconnect_count += 1
+        self._ever_connected = True
+        self.failed_attempts = 0
+        self.next_attempt = 0.0
+        self._reader_task = asyncio.ensure_future(self._receive_loop(self._reader))
+        return True
+
+    async def _disconnect(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._reader = None
+        self._fail_pending(ConnectionError("Verbindung geschlossen"))
+
+    def _fail_pending(self, exc):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self._pending.clear()
+
+    async def _receive_loop(self, reader):
+        """Liest Antworten und ordnet sie über die Transaction ID der wartenden Anfrage zu"""
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                tid, _, length, _ = struct.unpack('>HHHB', header)
+                pdu = await reader.readexactly(length - 1)
+                fut = self._pending.pop(tid, None)
+                if fut is None or fut.done():
+                    continue # Verspätete Antwort einer bereits abgebrochenen Anfrage
+
+                if pdu[0] & 0x80:
+                    fut.set_exception(ModbusExceptionResponse(pdu[1]))
+                else:
+                    byte_count = pdu[1]
+                    fut.set_result(list(struct.unpack(f'>{byte_count // 2}H', pdu[2:2 + byte_count])))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # EOF oder Protokollfehler: Verbindung ist nicht mehr nutzbar
+            if self._writer:
+                self._writer.close()
+            self._fail_pending(ConnectionError(f"Verbindung verloren: {e}"))
+
+    def _allocate_tid(self):
+        """Vergibt eine Transaction ID, die aktuell nicht in Benutzung ist"""
+        while True:
+            self._next_tid = self._next_tid % 0xFFFF + 1
+            if self._next_tid not in self._pending:
+                return self._next_tid
+
+    async def read_block(self, address, count, exclusive=False):
+        """
+        Sendet eine Read-Input-Registers Anfrage und wartet auf die zugehörige Antwort.
+        Läuft eine gepipelinte Anfrage in den Timeout, wird sie einmal allein (ohne parallele
+        Transaktionen) wiederholt. Wird sie dann beantwortet, lag es am Pipelining; erst nach
+        PIPELINE_STRIKES Zyklen in Folge mit solchen Fällen wird die Tiefe auf 1 gesetzt. Ein Verbindungsabbruch
+        oder ein Timeout auch ohne Pipelining ist ein normaler Lesefehler.
+        :param exclusive: Erst senden, wenn keine andere Transaktion offen ist
+        """
+        async with self._slots:
+            if exclusive:
+                self._exclusive_waiting += 1
+                try:
+                    await self._slots.wait_for(lambda: self._in_flight == 0)
+                finally:
+                    self._exclusive_waiting -= 1
+            else:
+                await self._slots.wait_for(lambda: self._in_flight < self.depth and not self._exclusive_waiting)
+            self._in_flight += 1
+            pipelined = self._in_flight > 1
+        retry = False
+        try:
+            if self.pacer and self.pacer.gap > 0:
+                await asyncio.sleep(self.pacer.gap)
+            start = time.monotonic()
+            regs = await self._transact(address, count)
+            latency = time.monotonic() - start
+            REQUEST_LATENCY.observe(latency, (self.name, f"Block {address}-{address + count - 1}"))
+            if self.pacer:
+                self.pacer.on_success(latency)
+            return regs
+        except ModbusExceptionResponse as e:
+            if self.pacer and e.code in BUSY_EXCEPTION_CODES:
+                self.pacer.on_failure()
+            raise
+        except asyncio.TimeoutError:
+            if self.pacer:
+                self.pacer.on_failure()
+            if not pipelined or not self.is_alive():
+                raise
+            retry = True
+            self.retries += 1
+        finally:
+            async with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+        if retry:
+            regs = await self.read_block(address, count, exclusive=True)
+            # Allein beantwortet: der Timeout lag am Pipelining
+            self._cycle_pipeline_failed = True
+            return regs
+
+    def _end_cycle(self):
+        """Zählt Zyklen mit Pipelining-Fehlern; ein Zyklus ohne setzt den Zähler zurück"""
+        if not self._cycle_pipeline_failed:
+            self.pipeline_strikes = 0
+            return
+        self._cycle_pipeline_failed = False
+        self.pipeline_strikes += 1
+        if self.depth > 1 and self.pipeline_strikes >= PIPELINE_STRIKES:
+            self.depth = 1
+            self._serial_since = time.monotonic()
+            if self.logger:
+                self.logger.log_error(f"Gateway beantwortet wiederholt keine parallelen Transaktionen, Pipelining "
+                                      f"für {PIPELINE_RETRY_AFTER // 60} min deaktiviert")
+
+    def _probe_pipelining(self):
+        """Nach PIPELINE_RETRY_AFTER Sekunden seriellen Betriebs die konfigurierte Tiefe erneut probieren"""
+        if self.depth < self.configured_depth and time.monotonic() - self._serial_since >= PIPELINE_RETRY_AFTER:
+            self.depth = self.configured_depth
+            # Ein erneuter Zyklus mit Fehlschlag schaltet sofort wieder ab
+            self.pipeline_strikes = PIPELINE_STRIKES - 1
+
+    async def _transact(self, address, count):
+        if not self.is_alive():
+            raise ConnectionError("Keine Verbindung")
+
+        tid = self._allocate_tid()
+        fut = self._loop.create_future()
+        self._pending[tid] = fut
+
+        # MBAP-Header: Transaction ID, Protocol ID (0), Länge, Unit ID + PDU
+        frame = struct.pack('>HHHBBHH', tid, 0, 6, self.slave_id, FC_READ_INPUT_REGISTERS, address, count)
+        self._writer.write(frame)
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, self.request_timeout)
+        finally:
+            self._pending.pop(tid, None)
+
+    # --- Poll-Zyklus ---
+
+    async def _read_block_values(self, block):
+        """Liest einen Block (Fallback: einzelne Register) und gibt die dekodierten Werte zurück"""
+        try:
+            regs = await self.read_block(block['start'], block['count'])
+            return decode_block_checked(block, regs, self.name)
+        except ModbusExceptionResponse:
+            pass
+        except Exception as e:
+            if self.logger:
+                self.logger.log_error(f"Async-Lesen Block {block['start']} fehlgeschlagen: {e!r}")
+            return {field[0]: None for field in block['registers']}
+
+        # Fallback: Register des Blocks einzeln lesen (ebenfalls parallel)
+        async def read_single(single):
+            try:
+                regs = await self.read_block(single['start'], single['count'])
+                return decode_block_checked(single, regs, self.name)
+            except Exception:
+                return {single['registers'][0][0]: None}
+
+        data_output = {}
+        for values in await asyncio.gather(*(read_single(single) for single in split_block(block))):
+            data_output.update(values)
+        return data_output
+
+    async def read_plan_async(self, plan):
+        """
+        Liest alle Blöcke mit bis zu 'depth' gleichzeitig offenen Transaktionen.
+        Blöcke, die bis zur Zyklus-Deadline nicht beantwortet wurden, liefern None.
+        """
+        data_output = {}
+        if not await self._ensure_connected():
+            return data_output
+
+        self._probe_pipelining()
+        tasks = {asyncio.ensure_future(self._read_block_values(block)): block for block in plan}
+        done, pending = await asyncio.wait(tasks, timeout=self.cycle_deadline)
+
+        for task in done:
+            data_output.update(task.result())
+
+        if pending:
+            self.deadline_misses += 1
+            for task in pending:
+                task.cancel()
+                for field in tasks[task]['registers']:
+                    data_output[field[0]] = None
+            if self.logger:
+                self.logger.log_error(f"Async-Poll-Zyklus: {len(pending)} Blöcke nach {self.cycle_deadline}s nicht beantwortet")
+
+        self._end_cycle()
+        return data_output
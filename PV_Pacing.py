@@ -0,0 +1,136 @@
+# Adaptive Taktung der Modbus-Anfragen für den WiNet-S Dongle (AIMD)
+# Statt fester Pausen (50 ms zwischen Anfragen) wird die Pause zwischen zwei Anfragen
+# und die maximale Blockgröße zur Laufzeit angepasst:
+#  - Erfolg mit guter Latenz: Pause wird additiv verkürzt, Blockgröße additiv erhöht
+#  - Timeout, Verbindungsabbruch oder "Device Busy": Pause wird multiplikativ verlängert,
+#    Blockgröße halbiert
+# Die gelernten Werte werden in pacing_state.json gespeichert und beim Start geladen.
+# Geschrieben wird nur, wenn sich Pause (auf 1 ms gerundet) oder Blockgröße gegenüber dem
+# gespeicherten Stand geändert haben, höchstens einmal pro save_interval und beim Beenden
+# (schont die SD-Karte; die geglättete Latenz allein löst kein Speichern aus).
+
+import json
+import os
+import threading
+import time
+
+from PV_Modbus import MAX_BLOCK_SIZE
+
+DEFAULT_STATE_FILE = os.path.join(os.path.dirname(__file__), "pacing_state.json")
+
+
+class AdaptivePacer:
+    def __init__(self, key="inverter", state_file=DEFAULT_STATE_FILE, gap=0.05, min_gap=0.0, max_gap=2.0,
+                 gap_step=0.005, max_block=MAX_BLOCK_SIZE, min_block=16, block_step=8, latency_target=0.25,
+                 save_interval=3600):
+        """
+        :param key: Name des Geräts (mehrere Geräte teilen sich die Zustandsdatei)
+        :param gap: Startwert der Pause zwischen zwei Anfragen in Sekunden
+        :param gap_step: Additive Verkürzung der Pause nach einer erfolgreichen Anfrage
+        :param block_step: Additive Vergrößerung der Blockgröße nach einer erfolgreichen Anfrage
+        :param latency_target: Liegt die geglättete Antwortzeit darüber, wird nicht weiter beschleunigt
+        :param save_interval: Mindestabstand in Sekunden zwischen zwei Speichervorgängen (außer beim Beenden)
+        """
+        self.key = key
+        self.state_file = state_file
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.gap_step = gap_step
+        self.min_block = min_block
+        self.block_limit = max_block
+        self.block_step = block_step
+        self.latency_target = latency_target
+        self.save_interval = save_interval
+
+        self.gap = gap
+        self.max_block = max_block
+        self.latency = None          # Geglättete Antwortzeit (EWMA)
+        self.successes = 0
+        self.failures = 0
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        self._load()
+        self._saved = self._persisted()   # Stand in der Datei (bzw. Startwerte)
+        self.saves = 0
+
+    def _load(self):
+        """Lädt die zuletzt gelernten Werte für dieses Gerät"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f).get(self.key, {})
+            self.gap = min(self.max_gap, max(self.min_gap, float(state.get('gap', self.gap))))
+            self.max_block = min(self.block_limit, max(self.min_block, int(state.get('max_block', self.max_block))))
+            self.latency = state.get('latency', self.latency)
+        except Exception as e:
+            print(f"Fehler beim Laden der {os.path.basename(self.state_file)}: {e}")
+
+    def _persisted(self):
+        """Die Werte, deren Änderung ein Speichern rechtfertigt"""
+        return round(self.gap, 3), self.max_block
+
+    def save(self, force=False):
+        """
+        Speichert geänderte Werte (höchstens alle save_interval Sekunden).
+        :param force: Intervall ignorieren (beim Beenden); ohne Änderung wird auch dann nicht geschrieben
+        """
+        if not self.state_file or self._persisted() == self._saved:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_save < self.save_interval:
+            return
+        with self._lock:
+            try:
+                state = {}
+                if os.path.exists(self.state_file):
+                    with open(self.state_file, 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                state[self.key] = {'gap': round(self.gap, 4), 'max_block': self.max_block,
+                                   'latency': round(self.latency, 4) if self.latency is not None else None,
+                                   'updated': int(time.time())}
+                tmp_path = self.state_file + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=4)
+                os.replace(tmp_path, self.state_file)
+                self._saved = self._persisted()
+                self._last_save = now
+                self.saves += 1
+            except Exception as e:
+                print(f"Fehler beim Speichern der {os.path.basename(self.state_file)}: {e}")
+
+    def on_success(self, latency):
+        """Erfolgreiche Anfrage: additiv beschleunigen, solange die Latenz im Rahmen bleibt"""
+        with self._lock:
+            self.successes += 1
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if self.latency > self.latency_target:
+                # Dongle antwortet langsam: Pause leicht verlängern statt weiter zu beschleunigen
+                self.gap = min(self.max_gap, self.gap + self.gap_step)
+            else:
+                self.gap = max(self.min_gap, self.gap - self.gap_step)
+                self.max_block = min(self.block_limit, self.max_block + self.block_step)
+        self.save()
+
+    def on_failure(self):
+        """Timeout, Reset oder Überlast-Exception: multiplikativ bremsen"""
+        with self._lock:
+            self.failures += 1
+            self.gap = min(self.max_gap, max(self.gap * 2, 0.05))
+            self.max_block = max(self.min_block, self.max_block // 2)
+        self.save()
+
+    def wait(self):
+        """Pause zwischen zwei Anfragen"""
+        if self.gap > 0:
+            time.sleep(self.gap)
+
+    def stats(self):
+        return {
+            'gap_ms': round(self.gap * 1000, 1),
+            'max_block': self.max_block,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'successes': self.successes,
+            'failures': self.failures,
+            'saves': self.saves,
+        }
@@ -0,0 +1,317 @@
+# Monatliche Partitionierung der Messwert-Tabellen
+# Statt einer einzigen, stetig wachsenden Tabelle 'readings' ohne Index gibt es pro Monat
+# (lokale Zeit) eine Tabelle <tabelle>_YYYYMM. Jede Partition ist eine WITHOUT ROWID Tabelle
+# mit dem Zeitstempel als Primärschlüssel: die Zeilen liegen nach Zeit sortiert im B-Baum,
+# eine Bereichsabfrage liest nur die betroffenen Seiten der betroffenen Monate.
+#
+# Der Query-Router (query_range) verteilt eine Bereichsabfrage auf die passenden Partitionen.
+# Eine noch nicht migrierte Tabelle (ohne Partitionen) wird wie bisher gelesen und bekommt
+# einen Index auf timestamp.
+#
+# Migration einer bestehenden pv_data.db (Dienst vorher stoppen):
+#   python PV_Partitions.py --migrate                 (Tabelle 'readings')
+#   python PV_Partitions.py --migrate --table readings_wr2 --drop-legacy
+# Die alte Tabelle bleibt als <tabelle>_legacy erhalten, außer bei --drop-legacy.
+#
+# Abgeschlossene Monate können in komprimierte Spalten-Archive ausgelagert werden (PV_Archive.py),
+# query_range() liest sie transparent mit:
+#   python PV_Partitions.py --archive                 (alle Monate älter als 3 Monate)
+#   python PV_Partitions.py --archive --keep-months 1
+
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import time
+
+from PV_Archive import ArchiveReader, archive_path, list_archives, write_archive
+from PV_Schema import query_narrow, series_ids, storage_format
+
+
+def partition_name(table, timestamp):
+    """Name der Monats-Partition für einen Zeitstempel (lokale Zeit)"""
+    return f"{table}_{datetime.datetime.fromtimestamp(timestamp).strftime('%Y%m')}"
+
+
+def partition_bounds(name):
+    """(Beginn, Beginn des Folgemonats) einer Partition als EPOCH"""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime.datetime(year, month, 1)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    return start.timestamp(), end.timestamp()
+
+
+def list_partitions(conn, table):
+    """Alle vorhandenen Partitionen einer Tabelle, zeitlich sortiert"""
+    pattern = re.compile(rf"^{re.escape(table)}_\d{{6}}$")
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return sorted(name for (name,) in rows if pattern.match(name))
+
+
+def table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def is_partitioned(conn, table):
+    """True, wenn die Tabelle partitioniert ist (oder noch gar nicht existiert: neue Datenbanken)"""
+    return bool(list_partitions(conn, table)) or not table_exists(conn, table)
+
+
+def source_tables(conn, table, start_ts=None, end_ts=None):
+    """
+    Tabellen, die für den Zeitraum gelesen werden müssen: die überlappenden Partitionen
+    bzw. die unpartitionierte Tabelle
+    """
+    partitions = list_partitions(conn, table)
+    if not partitions:
+        return [table] if table_exists(conn, table) else []
+    selected = []
+    for name in partitions:
+        p_start, p_end = partition_bounds(name)
+        if (end_ts is None or p_start <= end_ts) and (start_ts is None or p_end > start_ts):
+            selected.append(name)
+    return selected
+
+
+def columns_of(conn, table):
+    """Spalten der Messwert-Tabelle (bei Partitionen: der jüngsten Partition bzw. Archivdatei)"""
+    if storage_format(conn, table) == 'narrow':
+        return ['timestamp'] + list(series_ids(conn, table))
+    sources = source_tables(conn, table)
+    if sources:
+        return [row[1] for row in conn.execute(f"PRAGMA table_info({sources[-1]})")]
+    path = db_file(conn)
+    archives = list_archives(path, table)
+    if not archives:
+        return []
+    with ArchiveReader(archive_path(path, archives[-1])) as reader:
+        return ['timestamp'] + reader.columns
+
+
+def db_file(conn):
+    """Pfad der Datenbankdatei einer Verbindung (leer bei In-Memory-Datenbanken)"""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path or ""
+    return ""
+
+
+def month_sources(conn, table, start_ts=None, end_ts=None):
+    """
+    Datenquellen für den Zeitraum pro Monat, zeitlich sortiert: Liste von (tabelle, archivdatei).
+    Ein Monat kann in der Datenbank, im Archiv oder (nach nachgetragenen Zeilen) in beiden liegen.
+    """
+    tables = source_tables(conn, table, start_ts, end_ts)
+    if tables == [table]:
+        return [(table, None)]
+    path = db_file(conn)
+    sources = {name: [name, None] for name in tables}
+    for name in list_archives(path, table):
+        p_start, p_end = partition_bounds(name)
+        if (end_ts is None or p_start <= end_ts) and (start_ts is None or p_end > start_ts):
+            sources.setdefault(name, [None, None])[1] = archive_path(path, name)
+    return [tuple(sources[name]) for name in sorted(sources)]
+
+
+def _query_table(conn, source, columns, start_ts, end_ts, order, limit):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({source})")}
+    exprs = [col if col in existing else f"NULL AS {col}" for col in columns]
+    query = f"SELECT timestamp, {', '.join(exprs)} FROM {source} WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp {order}"
+    params = [start_ts, end_ts]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+
+def query_range(conn, table, columns, start_ts, end_ts, descending=False, limit=None):
+    """
+    Query-Router: liest (timestamp, spalte1, ...) im Zeitraum [start_ts, end_ts] aus allen
+    betroffenen Partitionen und Archivdateien, zeitlich sortiert. Fehlt eine Spalte in einer
+    älteren Partition, wird NULL geliefert. Tabellen im schmalen Format (PV_Schema) werden
+    in dieselbe Zeilenform gebracht.
+    """
+    if storage_format(conn, table) == 'narrow':
+        return query_narrow(conn, table, columns, start_ts, end_ts, descending, limit)
+    order = "DESC" if descending else "ASC"
+    sources = month_sources(conn, table, start_ts, end_ts)
+    if descending:
+        sources = sources[::-1]
+
+    rows = []
+    for source, archive in sources:
+        remaining = None if limit is None else limit - len(rows)
+        chunk = _query_table(conn, source, columns, start_ts, end_ts, order, remaining) if source else []
+        if archive:
+            with ArchiveReader(archive) as reader:
+                archived = reader.read_range(columns, start_ts, end_ts, descending, remaining)
+            if chunk:
+                # Nachgetragene Zeilen in der Datenbank haben Vorrang vor dem Archiv
+                seen = {row[0] for row in chunk}
+                chunk = sorted(chunk + [row for row in archived if row[0] not in seen],
+                               key=lambda row: row[0], reverse=descending)[:remaining]
+            else:
+                chunk = archived
+        rows.extend(chunk)
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+def create_partition(conn, name, value_columns):
+    """Legt eine Monats-Partition an (WITHOUT ROWID, Zeitstempel als Primärschlüssel)"""
+    columns = ["timestamp INTEGER PRIMARY KEY"] + [f"{col} REAL" for col in value_columns]
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(columns)}) WITHOUT ROWID")
+
+
+def migrate(conn, table, drop_legacy=False):
+    """
+    Verteilt die Zeilen einer unpartitionierten Tabelle auf Monats-Partitionen.
+    Zeilen mit identischem Zeitstempel werden zusammengefasst (die zuletzt geschriebene gewinnt).
+    :return: (gelesene Zeilen, geschriebene Zeilen, Anzahl Partitionen)
+    """
+    if not table_exists(conn, table):
+        print(f"Tabelle {table} nicht gefunden (bereits migriert?)")
+        return 0, 0, 0
+
+    value_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] != 'timestamp']
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp)")
+    first, last, total = conn.execute(f"SELECT MIN(timestamp), MAX(timestamp), COUNT(*) FROM {table}").fetchone()
+
+    legacy = f"{table}_legacy"
+    written = 0
+    partitions = []
+    with conn:
+        if first is not None:
+            name = partition_name(table, first)
+            while True:
+                start, end = partition_bounds(name)
+                create_partition(conn, name, value_columns)
+                cols = ", ".join(['timestamp'] + value_columns)
+                conn.execute(f"INSERT OR REPLACE INTO {name} ({cols}) SELECT {cols} FROM {table} "
+                             f"WHERE timestamp >= ? AND timestamp < ? ORDER BY rowid", (start, end))
+                written += conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                partitions.append(name)
+                if end > last:
+                    break
+                name = partition_name(table, end)
+
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_timestamp")
+        if drop_legacy:
+            conn.execute(f"DROP TABLE {table}")
+        else:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    return total, written, len(partitions)
+
+
+def archive_partition(conn, name):
+    """
+    Lagert eine Monats-Partition in eine Archivdatei aus und löscht sie danach aus der Datenbank.
+    Liegt für den Monat schon ein Archiv vor (nachgetragene Zeilen), werden beide zusammengeführt.
+    :return: (Zeilen, Dateigröße in Bytes)
+    """
+    path = archive_path(db_file(conn), name)
+    table_cols = [row[1] for row in conn.execute(f"PRAGMA table_info({name})") if row[1] != 'timestamp']
+    columns = list(table_cols)
+    merged = {}
+    if os.path.exists(path):
+        with ArchiveReader(path) as reader:
+            columns += [col for col in reader.columns if col not in columns]
+            for row in reader.read_range(columns, float('-inf'), float('inf')):
+                merged[row[0]] = row[1:]
+    padding = (None,) * (len(columns) - len(table_cols))
+    for row in conn.execute(f"SELECT timestamp, {', '.join(table_cols)} FROM {name} ORDER BY timestamp"):
+        merged[row[0]] = row[1:] + padding
+
+    timestamps = sorted(merged)
+    values = {col: [merged[ts][i] for ts in timestamps] for i, col in enumerate(columns)}
+    size = write_archive(path, timestamps, values)
+
+    # Erst nach erfolgreicher Kontrolle der Archivdatei (Zeitstempel und jede Spalte) aus der Datenbank löschen
+    with ArchiveReader(path) as reader:
+        if reader.timestamps() != timestamps:
+            raise ValueError(f"Archivdatei {path} fehlerhaft, Partition {name} bleibt erhalten")
+        for col in columns:
+            if reader.column(col) != values[col]:
+                raise ValueError(f"Spalte {col} in {path} fehlerhaft, Partition {name} bleibt erhalten")
+    with conn:
+        conn.execute(f"DROP TABLE {name}")
+    return len(timestamps), size
+
+
+def archive_closed_months(conn, table, keep_months=3):
+    """
+    Archiviert alle Partitionen, die mehr als 'keep_months' Monate vor dem aktuellen Monat liegen.
+    :return: Liste von (Partition, Zeilen, Bytes in der Datenbank, Bytes im Archiv)
+    """
+    today = datetime.date.today()
+    index = today.year * 12 + today.month - 1 - keep_months
+    cutoff = f"{table}_{index // 12:04d}{index % 12 + 1:02d}"
+    results = []
+    for name in list_partitions(conn, table):
+        if name >= cutoff:
+            break
+        db_bytes = partition_size(conn, name)
+        rows, size = archive_partition(conn, name)
+        results.append((name, rows, db_bytes, size))
+    return results
+
+
+def partition_size(conn, name):
+    """Belegter Speicher einer Tabelle in Bytes (None, wenn SQLite ohne dbstat-Tabelle gebaut ist)"""
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monatliche Partitionierung der Messwert-Tabellen")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), "pv_data.db"))
+    parser.add_argument('--table', default="readings")
+    parser.add_argument('--migrate', action='store_true', help="Bestehende Tabelle in Monats-Partitionen überführen")
+    parser.add_argument('--drop-legacy', action='store_true', help="Alte Tabelle nach der Migration löschen")
+    parser.add_argument('--archive', action='store_true', help="Abgeschlossene Monate in Spalten-Archive auslagern")
+    parser.add_argument('--keep-months', type=int, default=3, help="Anzahl Monate vor dem aktuellen, die in der Datenbank bleiben")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Fehler: Datenbank nicht gefunden unter {args.db}")
+        return
+
+    conn = sqlite3.connect(args.db, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    if args.migrate:
+        start = time.perf_counter()
+        total, written, count = migrate(conn, args.table, args.drop_legacy)
+        if count:
+            print(f"Migration {args.table}: {total} Zeilen gelesen, {written} Zeilen in {count} Partitionen "
+                  f"geschrieben ({time.perf_counter() - start:.1f} s)")
+            if total != written:
+                print(f"  {total - written} Zeilen mit doppeltem Zeitstempel zusammengefasst")
+            if args.drop_legacy:
+                print("  Alte Tabelle gelöscht. Speicherplatz wird erst mit 'VACUUM' freigegeben.")
+            else:
+                print(f"  Alte Tabelle umbenannt in {args.table}_legacy")
+
+    if args.archive:
+        start = time.perf_counter()
+        results = archive_closed_months(conn, args.table, args.keep_months)
+        for name, rows, db_bytes, size in results:
+            ratio = f", Faktor {db_bytes / size:.1f}" if db_bytes and size else ""
+            print(f"  {name}: {rows} Zeilen archiviert ({size / 1024:.0f} KiB{ratio})")
+        if results:
+            print(f"Archivierung {args.table}: {len(results)} Monate in {time.perf_counter() - start:.1f} s. "
+                  f"Speicherplatz wird erst mit 'VACUUM' freigegeben.")
+
+    for name in list_partitions(conn, args.table):
+        rows = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+        print(f"  {name}: {rows} Zeilen")
+    for name in list_archives(args.db, args.table):
+        print(f"  {name}: archiviert ({os.path.getsize(archive_path(args.db, name)) / 1024:.0f} KiB)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Pool von Nur-Lese-Verbindungen für Verlaufsabfragen
+# Die Schreibverbindung gehört exklusiv dem DB-Writer-Thread (PV_DBWriter). Alle Lesepfade
+# (/api/history, Visualizer, Wochenbericht) holen sich eine eigene Verbindung aus diesem Pool:
+#   - geöffnet mit mode=ro und PRAGMA query_only: ein Lesezugriff kann nie eine Sperre zum Schreiben nehmen
+#   - mmap_size/cache_size: Seiten der Partitionen werden gemappt statt per read() kopiert
+# Im WAL-Modus lesen die Verbindungen parallel zueinander und zum Writer. Eine Verbindung
+# gehört für die Dauer der Abfrage genau einem Thread; danach geht sie zurück in den Pool
+# und bleibt offen (Anfragen laufen in wechselnden Threads: Webserver-Pool, Visualizer,
+# Wochenbericht; die Zahl der Verbindungen bleibt so unabhängig davon). Ist der Pool ausgeschöpft,
+# wartet der nächste Leser, statt weitere Verbindungen zu öffnen.
+
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PV_Metrics import METRICS
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def open_readonly(db_path, timeout=5, mmap_size=64 * 1024 * 1024, cache_kib=8192):
+    """Öffnet eine Nur-Lese-Verbindung (auch für Werkzeuge außerhalb des Dienstes)"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout, check_same_thread=False)
+    conn.execute("PRAGMA query_only = 1")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_kib)}")
+    return conn
+
+
+def get_read_pool(db_path, **options):
+    """Gemeinsamer Pool pro Datenbankdatei"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ReadPool(db_path, **options)
+        return pool
+
+
+class ReadPool:
+    def __init__(self, db_path, size=4, wait_timeout=10.0, **connect_options):
+        """
+        :param size: Maximale Anzahl gleichzeitig offener Lese-Verbindungen
+        :param wait_timeout: Maximale Wartezeit auf eine freie Verbindung in Sekunden
+        :param connect_options: Weitergereicht an open_readonly() (mmap_size, cache_kib, timeout)
+        """
+        self.db_path = db_path
+        self.size = size
+        self.wait_timeout = wait_timeout
+        self.connect_options = connect_options
+        self._idle = queue.LifoQueue()   # zuletzt benutzte Verbindung zuerst (Cache noch warm)
+        self._created = 0
+        self._lock = threading.Lock()
+
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.max_wait_ms = 0.0
+        METRICS.register_collector(f"read_pool:{db_path}", self._collect_metrics)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Leiht eine Verbindung für die Dauer des with-Blocks aus"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = open_readonly(self.db_path, **self.connect_options)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                start = time.monotonic()
+                self.waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.wait_timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(f"Keine freie Lese-Verbindung nach {self.wait_timeout} s")
+                self.max_wait_ms = max(self.max_wait_ms, (time.monotonic() - start) * 1000)
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            self.in_use -= 1
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """Schließt alle freien Verbindungen (ausgeliehene werden bei der Rückgabe wieder eingereiht)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'open': self._created,
+            'in_use': self.in_use,
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'max_wait_ms': round(self.max_wait_ms, 2),
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        labels = {'db': os.path.basename(self.db_path)}
+        return [
+            ('pv_db_read_connections_open', 'gauge', 'Offene Lese-Verbindungen', [(labels, stats['open'])]),
+            ('pv_db_read_connections_in_use', 'gauge', 'Ausgeliehene Lese-Verbindungen', [(labels, stats['in_use'])]),
+            ('pv_db_read_checkouts_total', 'counter', 'Ausgeliehene Lese-Verbindungen gesamt', [(labels, stats['checkouts'])]),
+            ('pv_db_read_waits_total', 'counter', 'Leser, die auf eine freie Verbindung warten mussten', [(labels, stats['waits'])]),
+        ]
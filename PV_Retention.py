@@ -0,0 +1,325 @@
+# Aufbewahrungsregeln und Verdichtung für pv_data.db
+# Ohne Pflege wächst die Datenbank unbegrenzt. RetentionJob läuft als Hintergrund-Thread und
+# erledigt in den ruhigen Stunden (Standard 01:00-05:00 Uhr):
+#   1. Löschen abgelaufener Daten je Stufe (Rohdaten, Archivdateien, stündlich, täglich,
+#      monatlich) in kleinen Transaktionen mit Pause dazwischen. Der DB-Writer wartet deshalb
+#      höchstens eine Batch-Dauer auf die Schreibsperre (pv_retention_max_lock_seconds).
+#      Leere Monats-Partitionen werden entfernt.
+#   2. PRAGMA incremental_vacuum in kleinen Schritten (nur wenn auto_vacuum=INCREMENTAL, siehe unten)
+#   3. WAL-Checkpoint (TRUNCATE): die -wal Datei schrumpft wieder auf 0 Byte
+# Freigegebene Bytes werden gemeldet (Konsole, stats(), /metrics).
+#
+# Regeln: Tage pro Stufe, None = für immer, z.B. {'raw': 90, 'hourly': 5 * 365, 'daily': None}
+# Rohdaten und Archive bleiben standardmäßig für immer (opt-in). Auch mit Regel werden sie nur
+# dort gelöscht, wo die Rollups den Zeitraum abdecken (ab dem ersten Rollup-Zeitraum, ältere
+# Daten erst nach 'python PV_Rollups.py --backfill'). Archivdateien (PV_Archive) haben eine
+# eigene Stufe 'archive' und werden nie über die Regel für 'raw' gelöscht.
+#
+# Bestehende Datenbanken haben auto_vacuum=NONE; gelöschte Seiten werden dann wiederverwendet,
+# die Datei schrumpft aber nicht. Einmalig umstellen (Dienst vorher stoppen, dauert ein VACUUM):
+#   python PV_Retention.py --enable-incremental-vacuum
+# Einmaliger Lauf von Hand (ohne Ruhezeit-Fenster):
+#   python PV_Retention.py --run [--raw-days 90 --hourly-days 1825]
+
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from PV_Archive import archive_path, list_archives
+from PV_Metrics import METRICS
+from PV_Partitions import db_file, list_partitions, partition_bounds, source_tables, table_exists
+from PV_Rollups import ROLLUP_LEVELS, next_bucket, rollup_table
+from PV_Schema import narrow_table, series_ids, storage_format
+
+DEFAULT_RULES = {'raw': None, 'archive': None, 'hourly': 5 * 365, 'daily': None, 'monthly': None}
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _file_bytes(db_path):
+    """Größe von Datenbank und WAL-Datei in Bytes"""
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+
+class RetentionJob:
+    def __init__(self, db_path, tables=("readings",), rules=None, quiet_hours=(1, 5), interval=600,
+                 batch_size=500, batch_pause=0.2, vacuum_pages=256, busy_timeout=0.5):
+        """
+        :param tables: Messwert-Tabellen (die Rollup-Tabellen werden automatisch mitbehandelt)
+        :param rules: Aufbewahrung in Tagen pro Stufe ('raw', 'archive', 'hourly', 'daily', 'monthly'),
+                      None = für immer
+        :param quiet_hours: (Beginn, Ende) in Stunden lokaler Zeit, in denen gearbeitet wird
+        :param interval: Sekunden zwischen zwei Prüfungen
+        :param batch_size: Maximale Anzahl Zeilen pro Lösch-Transaktion
+        :param batch_pause: Pause in Sekunden nach jeder Transaktion (der Writer kommt dazwischen)
+        :param vacuum_pages: Seiten pro incremental_vacuum-Schritt
+        :param busy_timeout: SQLite-Timeout; ist die Datenbank länger gesperrt, wird die Runde abgebrochen
+        """
+        self.db_path = db_path
+        self.tables = list(tables)
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.quiet_hours = quiet_hours
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.busy_timeout = busy_timeout
+
+        self.runs = 0
+        self.rows_deleted = 0
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+        self.max_lock_ms = 0.0
+        self.last_run = None
+        self._last_day = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        METRICS.register_collector(f"retention:{db_path}", self._collect_metrics)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="RetentionJob", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _in_quiet_hours(self, now):
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= now.hour < end
+        return now.hour >= start or now.hour < end
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            now = datetime.datetime.now()
+            # Einmal pro Nacht, sobald das Ruhezeit-Fenster beginnt
+            if self._in_quiet_hours(now) and self._last_day != now.date():
+                self._last_day = now.date()
+                try:
+                    self.run_once()
+                except sqlite3.Error as e:
+                    print(f"Retention: Abbruch ({e}), nächster Versuch in der nächsten Nacht")
+
+    def run_once(self):
+        """Ein vollständiger Durchlauf. :return: Dictionary mit den Ergebnissen dieser Runde"""
+        before = _file_bytes(self.db_path)
+        start = time.monotonic()
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            deleted = 0
+            files = 0
+            file_bytes = 0
+            for table in self.tables:
+                deleted += self._expire_raw(conn, table)
+                count, size = self._expire_archives(conn, table)
+                files += count
+                file_bytes += size
+                for level, _ in ROLLUP_LEVELS:
+                    target = rollup_table(table, level)
+                    if table_exists(conn, target):
+                        deleted += self._expire_rows(conn, target, 'bucket', self._cutoff(level))
+            vacuumed = self._incremental_vacuum(conn)
+            self._checkpoint(conn)
+        finally:
+            conn.close()
+
+        reclaimed = max(0, before - _file_bytes(self.db_path)) + file_bytes
+        self.runs += 1
+        self.rows_deleted += deleted
+        self.files_deleted += files
+        self.bytes_reclaimed += reclaimed
+        self.last_run = time.time()
+        result = {'rows_deleted': deleted, 'files_deleted': files, 'pages_vacuumed': vacuumed,
+                  'bytes_reclaimed': reclaimed, 'seconds': round(time.monotonic() - start, 1)}
+        print(f"Retention: {deleted} Zeilen und {files} Archivdateien gelöscht, {vacuumed} Seiten freigegeben, "
+              f"{reclaimed / 1024 / 1024:.1f} MiB zurückgewonnen ({result['seconds']} s)")
+        return result
+
+    def _cutoff(self, level):
+        """EPOCH, vor dem Daten der Stufe gelöscht werden (None: behalten)"""
+        days = self.rules.get(level)
+        if days is None:
+            return None
+        return int(time.time() - days * 86400)
+
+    @staticmethod
+    def _rollup_coverage(conn, table):
+        """
+        Zeitpunkt (EPOCH), ab dem Rohdaten sicher in den Rollups stecken: Ende des ersten Zeitraums
+        der feinsten vorhandenen Stufe (der erste Zeitraum kann angebrochen sein). None: keine Rollups
+        """
+        ends = []
+        for level, _ in ROLLUP_LEVELS:
+            target = rollup_table(table, level)
+            if table_exists(conn, target):
+                first = conn.execute(f"SELECT MIN(bucket) FROM {target}").fetchone()[0]
+                if first is not None:
+                    ends.append(next_bucket(level, first))
+        return min(ends) if ends else None
+
+    def _expire_raw(self, conn, table):
+        cutoff = self._cutoff('raw')
+        covered = self._rollup_coverage(conn, table)
+        if cutoff is None or covered is None:
+            return 0
+        # Nur Zeilen, die schon in den Rollups stecken (ältere erst nach einem Backfill)
+        in_rollups = f"timestamp >= {int(covered)}"
+        if storage_format(conn, table) == 'narrow':
+            target = narrow_table(table)
+            if not table_exists(conn, target):
+                return 0
+            # Primärschlüssel (series_id, timestamp): pro Serie löschen, damit jeder Batch ein Bereichs-Scan bleibt
+            return sum(self._expire_rows(conn, target, 'timestamp', cutoff, f"series_id = {sid} AND {in_rollups}")
+                       for sid in series_ids(conn, table).values())
+
+        deleted = 0
+        for source in source_tables(conn, table, end_ts=cutoff):
+            deleted += self._expire_rows(conn, source, 'timestamp', cutoff, in_rollups)
+            if (source in list_partitions(conn, table) and partition_bounds(source)[1] <= cutoff
+                    and conn.execute(f"SELECT 1 FROM {source} LIMIT 1").fetchone() is None):
+                # Leere, vollständig abgelaufene Partition entfernen (Monat ist vorbei, es kommt nichts mehr)
+                self._locked(conn, f"DROP TABLE {source}")
+        return deleted
+
+    def _expire_archives(self, conn, table):
+        """
+        Löscht Archivdateien (PV_Archive), deren Monat nach der Stufe 'archive' vollständig abgelaufen
+        und in den Rollups enthalten ist. :return: (Anzahl, Bytes)
+        """
+        cutoff = self._cutoff('archive')
+        covered = self._rollup_coverage(conn, table)
+        if cutoff is None or covered is None:
+            return 0, 0
+        path = db_file(conn)
+        removed = 0
+        size = 0
+        for name in list_archives(path, table):
+            start, end = partition_bounds(name)
+            if end <= cutoff and start >= covered:
+                target = archive_path(path, name)
+                size += os.path.getsize(target)
+                os.remove(target)
+                removed += 1
+        return removed, size
+
+    def _expire_rows(self, conn, target, key, cutoff, condition=None):
+        """Löscht alle Zeilen mit key < cutoff in Transaktionen zu höchstens batch_size Zeilen"""
+        if cutoff is None:
+            return 0
+        where = f"{key} < ?" + (f" AND {condition}" if condition else "")
+        deleted = 0
+        while not self._stop.is_set():
+            # Grenze des nächsten Batches über den Index bestimmen, dann als Bereich löschen
+            row = conn.execute(f"SELECT {key} FROM {target} WHERE {where} ORDER BY {key} LIMIT 1 OFFSET ?",
+                               (cutoff, self.batch_size)).fetchone()
+            bound = cutoff if row is None else row[0]
+            count = self._locked(conn, f"DELETE FROM {target} WHERE {where}", (bound,))
+            deleted += count
+            if row is None or count == 0:
+                break
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def _locked(self, conn, query, params=()):
+        """Eine Schreib-Transaktion; die Dauer, in der die Sperre gehalten wurde, wird mitgeschrieben"""
+        start = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(query, params)
+            cursor.fetchall()   # incremental_vacuum gibt pro Schritt eine Zeile zurück und läuft nur beim Abholen weiter
+            count = cursor.rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.max_lock_ms = max(self.max_lock_ms, (time.monotonic() - start) * 1000)
+        return count
+
+    def _incremental_vacuum(self, conn):
+        """Gibt freie Seiten schrittweise an das Dateisystem zurück (nur bei auto_vacuum=INCREMENTAL)"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return 0
+        initial = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free and not self._stop.is_set():
+            self._locked(conn, f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(self.batch_pause)
+        return initial - free
+
+    def _checkpoint(self, conn):
+        """WAL in die Datenbank übertragen und die -wal Datei kürzen (scheitert still, wenn gerade geschrieben wird)"""
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'rows_deleted': self.rows_deleted,
+            'files_deleted': self.files_deleted,
+            'bytes_reclaimed': self.bytes_reclaimed,
+            'max_lock_ms': round(self.max_lock_ms, 2),
+            'last_run': self.last_run,
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        labels = {'db': os.path.basename(self.db_path)}
+        return [
+            ('pv_retention_rows_deleted_total', 'counter', 'Gelöschte Zeilen (Aufbewahrungsregeln)', [(labels, stats['rows_deleted'])]),
+            ('pv_retention_bytes_reclaimed_total', 'counter', 'Zurückgewonnener Speicher in Bytes', [(labels, stats['bytes_reclaimed'])]),
+            ('pv_retention_max_lock_seconds', 'gauge', 'Längste Schreibsperre einer Lösch-Transaktion', [(labels, stats['max_lock_ms'] / 1000)]),
+            ('pv_retention_last_run_timestamp', 'gauge', 'Zeitpunkt des letzten Durchlaufs', [(labels, stats['last_run'])]),
+        ]
+
+
+def enable_incremental_vacuum(db_path):
+    """Stellt auto_vacuum auf INCREMENTAL um (erfordert ein VACUUM, Dienst vorher stoppen)"""
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            print("auto_vacuum ist bereits INCREMENTAL")
+            return
+        before = _file_bytes(db_path)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"auto_vacuum = INCREMENTAL gesetzt, {before / 1024 / 1024:.1f} -> {_file_bytes(db_path) / 1024 / 1024:.1f} MiB")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aufbewahrungsregeln und Verdichtung der Datenbank")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), "pv_data.db"))
+    parser.add_argument('--table', action='append', help="Messwert-Tabelle (mehrfach möglich, Standard: readings)")
+    parser.add_argument('--run', action='store_true', help="Einen Durchlauf sofort ausführen")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true', help="auto_vacuum=INCREMENTAL einstellen (VACUUM)")
+    for level in DEFAULT_RULES:
+        parser.add_argument(f'--{level}-days', type=int, help=f"Aufbewahrung der Stufe '{level}' in Tagen")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Fehler: Datenbank nicht gefunden unter {args.db}")
+        return
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(args.db)
+    if args.run:
+        rules = {level: getattr(args, f"{level}_days") for level in DEFAULT_RULES
+                 if getattr(args, f"{level}_days") is not None}
+        job = RetentionJob(args.db, tables=args.table or ["readings"], rules=rules, batch_pause=0.0)
+        job.run_once()
+        print(f"Längste Schreibsperre: {job.stats()['max_lock_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
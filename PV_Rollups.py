@@ -0,0 +1,310 @@
+# Verdichtete Tabellen (Rollups) für lange Zeiträume
+# Zu jeder Messwert-Tabelle (z.B. 'readings') werden die Tabellen <tabelle>_hourly,
+# <tabelle>_daily und <tabelle>_monthly geführt. Pro Zeitraum (Stunde/Tag/Monat, lokale Zeit)
+# und Register stehen dort Summe, Anzahl, Minimum, Maximum und letzter Wert:
+#   <register>_sum, <register>_count, <register>_min, <register>_max, <register>_last
+# Der Mittelwert ergibt sich als _sum / _count. PV_Database aktualisiert die Rollups bei
+# jedem persist_data() per UPSERT mit, für bestehende Datenbanken gibt es den Backfill:
+#
+#   python PV_Rollups.py --backfill                 (Tabelle 'readings' in pv_data.db)
+#   python PV_Rollups.py --backfill --table readings_wr2
+#
+# Leser (Visualizer, Wochenbericht) wählen mit fetch_series() die gröbste Stufe, die die
+# gewünschte Auflösung noch erfüllt, statt hunderttausende Minutenwerte zu laden.
+
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+from PV_Archive import ARCHIVE_SUFFIX
+from PV_Partitions import columns_of, month_sources, partition_bounds, partition_name, query_range
+from PV_Schema import narrow_table, storage_format
+
+# Stufe -> nominale Länge in Sekunden (Monat: kürzester Monat, für die Auswahl der Stufe)
+ROLLUP_LEVELS = (('hourly', 3600), ('daily', 86400), ('monthly', 28 * 86400))
+ROLLUP_STATS = ('sum', 'count', 'min', 'max', 'last')
+
+
+def rollup_table(table, level):
+    return f"{table}_{level}"
+
+
+def bucket_start(level, timestamp):
+    """Beginn des Stunden-/Tages-/Monatszeitraums (lokale Zeit) als EPOCH"""
+    dt = datetime.datetime.fromtimestamp(timestamp)
+    if level == 'hourly':
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+    elif level == 'daily':
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        dt = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return int(dt.timestamp())
+
+
+def next_bucket(level, bucket):
+    """Beginn des auf 'bucket' folgenden Zeitraums (Tage mit 23/25 Stunden, Monate mit 28-31 Tagen)"""
+    if level == 'hourly':
+        return bucket + 3600
+    if level == 'daily':
+        return bucket_start(level, bucket + 26 * 3600)
+    return bucket_start(level, bucket + 32 * 86400)
+
+
+def table_columns(conn, table):
+    """Spaltennamen einer Tabelle (leer, wenn die Tabelle nicht existiert)"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def base_columns(columns):
+    """Register-Spalten einer Messwert-Tabelle (ohne timestamp und ohne die _min/_max Zusatzspalten)"""
+    names = [col for col in columns if col != 'timestamp']
+    return [col for col in names
+            if not ((col.endswith('_min') or col.endswith('_max')) and col[:-4] in names)]
+
+
+class RollupWriter:
+    """Legt die Rollup-Tabellen an und verdichtet neue Zeilen inkrementell"""
+
+    def __init__(self, conn, table, register_names):
+        self.conn = conn
+        self.table = table
+        self.names = list(register_names)
+        self._upsert_sql = {level: self._build_upsert(level) for level, _ in ROLLUP_LEVELS}
+
+    def _stat_columns(self):
+        return [f"{name}_{stat}" for name in self.names for stat in ROLLUP_STATS]
+
+    def create_tables(self):
+        """Erstellt die Rollup-Tabellen bzw. ergänzt Spalten für neue Register"""
+        for level, _ in ROLLUP_LEVELS:
+            target = rollup_table(self.table, level)
+            columns = ["bucket INTEGER PRIMARY KEY", "row_count INTEGER", "last_ts INTEGER"]
+            for col in self._stat_columns():
+                columns.append(f"{col} INTEGER DEFAULT 0" if col.endswith('_count') else f"{col} REAL")
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {target} ({', '.join(columns)})")
+
+            existing = set(table_columns(self.conn, target))
+            for col in self._stat_columns():
+                if col not in existing:
+                    col_type = "INTEGER DEFAULT 0" if col.endswith('_count') else "REAL"
+                    self.conn.execute(f"ALTER TABLE {target} ADD COLUMN {col} {col_type}")
+        self.conn.commit()
+
+    def _build_upsert(self, level):
+        target = rollup_table(self.table, level)
+        cols = ['bucket', 'row_count', 'last_ts'] + self._stat_columns()
+        updates = ["row_count = row_count + excluded.row_count", "last_ts = max(last_ts, excluded.last_ts)"]
+        for name in self.names:
+            updates.append(f"{name}_sum = coalesce({name}_sum + excluded.{name}_sum, {name}_sum, excluded.{name}_sum)")
+            updates.append(f"{name}_count = {name}_count + excluded.{name}_count")
+            updates.append(f"{name}_min = coalesce(min({name}_min, excluded.{name}_min), {name}_min, excluded.{name}_min)")
+            updates.append(f"{name}_max = coalesce(max({name}_max, excluded.{name}_max), {name}_max, excluded.{name}_max)")
+            updates.append(f"{name}_last = coalesce(excluded.{name}_last, {name}_last)")
+        return (f"INSERT INTO {target} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                f"ON CONFLICT(bucket) DO UPDATE SET {', '.join(updates)}")
+
+    @staticmethod
+    def _new_aggregate():
+        return {'row_count': 0, 'last_ts': None, 'stats': {}}
+
+    def _accumulate(self, agg, timestamp, values, new_row=True):
+        """
+        Nimmt eine Zeile der Messwert-Tabelle in ein Aggregat auf
+        :param new_row: False, wenn die Werte in eine bereits gezählte Zeile ergänzt wurden
+        """
+        if new_row:
+            agg['row_count'] += 1
+        agg['last_ts'] = timestamp
+        for name in self.names:
+            val = values.get(name)
+            if not isinstance(val, (int, float)):
+                continue
+            # Liegen Min/Max der Minute vor (store_minmax), werden diese statt des Mittelwerts verwendet
+            low = values.get(f"{name}_min")
+            high = values.get(f"{name}_max")
+            low = val if low is None else low
+            high = val if high is None else high
+            stat = agg['stats'].get(name)
+            if stat is None:
+                agg['stats'][name] = [val, 1, low, high, val]
+            else:
+                stat[0] += val
+                stat[1] += 1
+                stat[2] = min(stat[2], low)
+                stat[3] = max(stat[3], high)
+                stat[4] = val
+
+    def _write(self, level, bucket, agg, conn=None):
+        params = [bucket, agg['row_count'], agg['last_ts']]
+        for name in self.names:
+            params.extend(agg['stats'].get(name, (None, 0, None, None, None)))
+        (conn or self.conn).execute(self._upsert_sql[level], params)
+
+    def add_row(self, timestamp, values, conn=None, new_row=True):
+        """
+        Verdichtet eine neu geschriebene Zeile in alle Stufen.
+        Wird innerhalb der Transaktion des INSERTs aufgerufen (kein eigenes Commit).
+        :param conn: Verbindung des Writer-Threads (Standard: die beim Anlegen übergebene)
+        :param new_row: False, wenn nur fehlende Werte einer vorhandenen Zeile ergänzt wurden
+        """
+        agg = self._new_aggregate()
+        self._accumulate(agg, timestamp, values, new_row)
+        for level, _ in ROLLUP_LEVELS:
+            self._write(level, bucket_start(level, timestamp), agg, conn)
+
+    def backfill(self, chunk_size=5000):
+        """
+        Baut alle Rollups aus der Messwert-Tabelle neu auf (einmalig für bestehende Datenbanken).
+        Die Zeilen werden zeitlich sortiert gestreamt; offen ist immer nur ein Zeitraum pro Stufe.
+        :return: Anzahl verarbeiteter Zeilen
+        """
+        for level, _ in ROLLUP_LEVELS:
+            self.conn.execute(f"DELETE FROM {rollup_table(self.table, level)}")
+
+        raw_columns = set(columns_of(self.conn, self.table))
+        select_cols = [col for col in self.names if col in raw_columns]
+        select_cols += [f"{name}_{suffix}" for name in self.names for suffix in ('min', 'max')
+                        if f"{name}_{suffix}" in raw_columns]
+
+        open_buckets = {level: (None, None) for level, _ in ROLLUP_LEVELS}
+        processed = 0
+        if storage_format(self.conn, self.table) == 'narrow':
+            # Schmales Format: monatsweise über den Query-Router lesen
+            first, last = self.conn.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {narrow_table(self.table)}").fetchone()
+            month = partition_name(self.table, first) if first is not None else None
+            while month is not None:
+                start_ts, end_ts = partition_bounds(month)
+                rows = query_range(self.conn, self.table, select_cols, start_ts, end_ts - 1)
+                self._backfill_rows(rows, select_cols, open_buckets)
+                processed += len(rows)
+                month = partition_name(self.table, end_ts) if end_ts <= last else None
+        for source, archive in month_sources(self.conn, self.table):
+            if archive:
+                # Archivierter Monat (ggf. zusammen mit nachgetragenen Zeilen in der Datenbank)
+                start_ts, end_ts = partition_bounds(source or os.path.basename(archive)[:-len(ARCHIVE_SUFFIX)])
+                rows = query_range(self.conn, self.table, select_cols, start_ts, end_ts - 1)
+                self._backfill_rows(rows, select_cols, open_buckets)
+                processed += len(rows)
+                continue
+            existing = set(table_columns(self.conn, source))
+            exprs = [col if col in existing else f"NULL AS {col}" for col in select_cols]
+            cursor = self.conn.execute(f"SELECT timestamp, {', '.join(exprs)} FROM {source} ORDER BY timestamp ASC")
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                self._backfill_rows(rows, select_cols, open_buckets)
+                processed += len(rows)
+
+        for level, (bucket, agg) in open_buckets.items():
+            if agg is not None:
+                self._write(level, bucket, agg)
+        self.conn.commit()
+        return processed
+
+    def _backfill_rows(self, rows, select_cols, open_buckets):
+        """Verteilt einen Schwung Rohzeilen auf die offenen Zeiträume, abgeschlossene werden geschrieben"""
+        for row in rows:
+            timestamp = row[0]
+            values = dict(zip(select_cols, row[1:]))
+            for level, _ in ROLLUP_LEVELS:
+                bucket = bucket_start(level, timestamp)
+                current, agg = open_buckets[level]
+                if bucket != current:
+                    if agg is not None:
+                        self._write(level, current, agg)
+                    agg = self._new_aggregate()
+                    open_buckets[level] = (bucket, agg)
+                self._accumulate(agg, timestamp, values)
+
+
+def _rollup_expression(col, rollup_cols):
+    """SQL-Ausdruck für eine Spalte der Messwert-Tabelle in einer Rollup-Tabelle (None: nicht vorhanden)"""
+    if f"{col}_sum" in rollup_cols:
+        return f"{col}_sum / NULLIF({col}_count, 0)"
+    if (col.endswith('_min') or col.endswith('_max')) and col in rollup_cols:
+        return col
+    return None
+
+
+def choose_level(conn, table, columns, start_ts, end_ts, max_points):
+    """
+    Gröbste Rollup-Stufe, deren Zeiträume nicht länger als die gewünschte Auflösung sind
+    und die alle Spalten enthält. None: Rohdaten verwenden.
+    """
+    resolution = (end_ts - start_ts) / max(1, max_points)
+    for level, length in reversed(ROLLUP_LEVELS):
+        if length > resolution:
+            continue
+        rollup_cols = set(table_columns(conn, rollup_table(table, level)))
+        if rollup_cols and all(_rollup_expression(col, rollup_cols) for col in columns):
+            return level
+    return None
+
+
+def fetch_series(conn, table, columns, start_ts, end_ts, max_points=1000):
+    """
+    Liefert (stufe, zeilen) für einen Zeitraum. Jede Zeile ist (timestamp, wert1, wert2, ...);
+    bei Rollups ist der Zeitstempel der Beginn des Zeitraums und der Wert der Mittelwert
+    (bzw. Minimum/Maximum für _min/_max Spalten). stufe ist 'raw' oder eine Rollup-Stufe.
+    """
+    level = choose_level(conn, table, columns, start_ts, end_ts, max_points)
+    if level is None:
+        return 'raw', query_range(conn, table, columns, start_ts, end_ts)
+
+    rollup_cols = set(table_columns(conn, rollup_table(table, level)))
+    exprs = [_rollup_expression(col, rollup_cols) for col in columns]
+    query = (f"SELECT bucket, {', '.join(exprs)} FROM {rollup_table(table, level)} "
+             f"WHERE bucket BETWEEN ? AND ? ORDER BY bucket ASC")
+    return level, conn.execute(query, (bucket_start(level, start_ts), end_ts)).fetchall()
+
+
+def fetch_bucket(conn, table, level, timestamp, columns, stat='last'):
+    """
+    Liest eine Kennzahl (sum/count/min/max/last) mehrerer Register für den Zeitraum, der
+    'timestamp' enthält. None, wenn es die Rollup-Tabelle oder den Zeitraum nicht gibt.
+    """
+    target = rollup_table(table, level)
+    rollup_cols = set(table_columns(conn, target))
+    if not rollup_cols or not all(f"{col}_{stat}" in rollup_cols for col in columns):
+        return None
+    query = f"SELECT {', '.join(f'{col}_{stat}' for col in columns)} FROM {target} WHERE bucket = ?"
+    return conn.execute(query, (bucket_start(level, timestamp),)).fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollup-Tabellen (stündlich/täglich/monatlich) verwalten")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), "pv_data.db"))
+    parser.add_argument('--table', default="readings")
+    parser.add_argument('--backfill', action='store_true', help="Rollups aus den vorhandenen Daten neu aufbauen")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Fehler: Datenbank nicht gefunden unter {args.db}")
+        return
+
+    conn = sqlite3.connect(args.db, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    names = base_columns(columns_of(conn, args.table))
+    if not names:
+        print(f"Fehler: Tabelle {args.table} nicht gefunden oder leer")
+        conn.close()
+        return
+
+    writer = RollupWriter(conn, args.table, names)
+    writer.create_tables()
+    if args.backfill:
+        start = time.perf_counter()
+        rows = writer.backfill()
+        print(f"Backfill {args.table}: {rows} Zeilen in {time.perf_counter() - start:.1f} s verdichtet")
+    for level, _ in ROLLUP_LEVELS:
+        target = rollup_table(args.table, level)
+        count = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+        print(f"  {target}: {count} Zeilen")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Multi-Rate Scheduler für die Modbus-Abfrage
+# Register können in registers.json ein eigenes Intervall ("interval", Sekunden) und eine
+# Priorität ("priority", kleiner = wichtiger) bekommen. Schnelle Leistungswerte werden so
+# z.B. jede Sekunde gelesen, Lebensdauer-Zähler nur alle paar Minuten.
+
+import time
+
+from PV_Modbus import MAX_BLOCK_SIZE, build_read_plan
+
+DEFAULT_PRIORITY = 10
+
+
+class PollScheduler:
+    def __init__(self, registers, default_interval=5, max_block=MAX_BLOCK_SIZE):
+        """
+        :param registers: Das Dictionary aus registers.json
+        :param default_interval: Intervall für Register ohne eigenes 'interval'
+        :param max_block: Maximale Blockgröße für die Lesepläne
+        """
+        self.registers = registers
+        self.max_block = max_block
+
+        # Register nach Intervall gruppieren
+        self.groups = {}
+        for name, data in registers.items():
+            interval = float(data.get('interval', default_interval))
+            self.groups.setdefault(interval, []).append(name)
+
+        # Feste Taktung ohne Drift: Deadlines werden um das Intervall weitergeschoben,
+        # nicht ab dem Zeitpunkt der tatsächlichen Ausführung neu berechnet
+        now = time.monotonic()
+        self.next_due = {interval: now for interval in self.groups}
+
+        self.missed_deadlines = 0   # Übersprungene Zeitschlitze (Zyklus kam zu spät)
+        self.max_lateness = 0.0     # Größte Verspätung eines Zyklus in Sekunden
+        self.last_lateness = 0.0    # Verspätung des zuletzt gestarteten Zyklus
+        self.cycles = 0
+        self._plans = {}            # frozenset(Intervalle) -> Leseplan
+
+    @property
+    def tick(self):
+        """Kürzestes konfiguriertes Intervall"""
+        return min(self.groups) if self.groups else 1.0
+
+    def wait_time(self, now=None):
+        """Sekunden bis zur nächsten fälligen Gruppe"""
+        if not self.next_due:
+            return self.tick
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, min(self.next_due.values()) - now)
+
+    def due(self, now=None):
+        """
+        Ermittelt alle fälligen Gruppen, schiebt deren Deadlines weiter und liefert den
+        (gecachten) Leseplan für die fälligen Register. Blöcke mit wichtigeren Registern
+        stehen vorne.
+        :return: Leseplan (Liste von Blöcken), leer wenn nichts fällig ist
+        """
+        if now is None:
+            now = time.monotonic()
+
+        due_intervals = []
+        lateness_now = 0.0
+        for interval, deadline in self.next_due.items():
+            if now < deadline:
+                continue
+            due_intervals.append(interval)
+
+            lateness = now - deadline
+            lateness_now = max(lateness_now, lateness)
+            self.max_lateness = max(self.max_lateness, lateness)
+            # Ganze verpasste Zeitschlitze überspringen statt sie nachzuholen
+            skipped = int(lateness // interval)
+            self.missed_deadlines += skipped
+            self.next_due[interval] = deadline + (skipped + 1) * interval
+
+        if not due_intervals:
+            return []
+
+        self.cycles += 1
+        self.last_lateness = lateness_now
+        key = frozenset(due_intervals)
+        if key not in self._plans:
+            self._plans[key] = self._build_plan(due_intervals)
+        return self._plans[key]
+
+    def _build_plan(self, intervals):
+        names = [name for interval in intervals for name in self.groups[interval]]
+        subset = {name: self.registers[name] for name in names}
+        plan = build_read_plan(subset, self.max_block)
+
+        def block_priority(block):
+            return min(self.registers[field[0]].get('priority', DEFAULT_PRIORITY) for field in block['registers'])
+
+        plan.sort(key=block_priority)
+        return plan
+
+    def set_max_block(self, max_block):
+        """Ändert die Blockgröße und verwirft die gecachten Lesepläne"""
+        if max_block != self.max_block:
+            self.max_block = max_block
+            self._plans.clear()
+
+    def stats(self):
+        return {
+            'cycles': self.cycles,
+            'missed_deadlines': self.missed_deadlines,
+            'max_lateness': round(self.max_lateness, 3),
+            'intervals': {interval: len(names) for interval, names in sorted(self.groups.items())},
+        }
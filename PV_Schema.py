@@ -0,0 +1,149 @@
+# Versionierte Schema-Verwaltung für pv_data.db
+# Die Schema-Version steht in PRAGMA user_version; upgrade_schema() spielt beim Start alle
+# fehlenden Migrationsschritte nacheinander ein. Neue Register aus registers.json werden
+# automatisch ergänzt (ALTER TABLE bzw. neue Serie) und in der Tabelle 'series' vermerkt:
+#   series (series_id, table_name, name, added)
+#
+# Zwei Speicherformate für die Messwerte:
+#   - "wide"   (Standard): eine Spalte pro Register in <tabelle> bzw. den Monats-Partitionen
+#   - "narrow": eine Zeile pro vorhandenem Wert in <tabelle>_narrow (series_id, timestamp, value).
+#     Register ohne Wert (Lesefehler, selten lesbare Register) belegen keinen Platz, neue
+#     Register brauchen kein ALTER TABLE und alte Zeilen werden nie umgeschrieben.
+# Leser gehen über PV_Partitions.query_range(), das beide Formate gleich zurückgibt.
+#
+# Status anzeigen: python PV_Schema.py [--db pv_data.db]
+
+import argparse
+import os
+import sqlite3
+import time
+
+SCHEMA_VERSION = 2
+
+
+def _migrate_v1(conn):
+    """Version 1: Register-Verzeichnis 'series' (für beide Speicherformate)"""
+    conn.execute("CREATE TABLE IF NOT EXISTS series (series_id INTEGER PRIMARY KEY, table_name TEXT NOT NULL, "
+                 "name TEXT NOT NULL, added INTEGER, UNIQUE (table_name, name))")
+
+
+def _migrate_v2(conn):
+    """Version 2: Speicherformat pro Messwert-Tabelle"""
+    conn.execute("CREATE TABLE IF NOT EXISTS storage (table_name TEXT PRIMARY KEY, format TEXT NOT NULL)")
+
+
+MIGRATIONS = {1: _migrate_v1, 2: _migrate_v2}
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade_schema(conn):
+    """
+    Spielt alle fehlenden Migrationsschritte ein (jeder Schritt in eigener Transaktion).
+    :return: (alte Version, neue Version)
+    """
+    start = current = schema_version(conn)
+    while current < SCHEMA_VERSION:
+        current += 1
+        with conn:
+            MIGRATIONS[current](conn)
+            conn.execute(f"PRAGMA user_version = {current}")
+    if current != start:
+        print(f"Datenbank-Schema aktualisiert: Version {start} -> {current}")
+    return start, current
+
+
+def narrow_table(table):
+    return f"{table}_narrow"
+
+
+def storage_format(conn, table):
+    """Speicherformat einer Messwert-Tabelle ('wide' oder 'narrow'), 'wide' wenn nicht vermerkt"""
+    try:
+        row = conn.execute("SELECT format FROM storage WHERE table_name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:   # Datenbank vor Schema-Version 2
+        return 'wide'
+    return row[0] if row else 'wide'
+
+
+def set_storage_format(conn, table, storage):
+    """Vermerkt das Format beim ersten Anlegen; ein bestehendes Format wird nicht umgestellt"""
+    conn.execute("INSERT OR IGNORE INTO storage (table_name, format) VALUES (?, ?)", (table, storage))
+    return storage_format(conn, table)
+
+
+def create_narrow_table(conn, table):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {narrow_table(table)} (series_id INTEGER, timestamp INTEGER, "
+                 f"value REAL, PRIMARY KEY (series_id, timestamp)) WITHOUT ROWID")
+
+
+def register_series(conn, table, names):
+    """
+    Trägt Register in das Verzeichnis ein (neue bekommen eine series_id).
+    :return: (Dictionary Name -> series_id, Liste neu eingetragener Namen)
+    """
+    known = dict(conn.execute("SELECT name, series_id FROM series WHERE table_name = ?", (table,)))
+    added = [name for name in names if name not in known]
+    for name in added:
+        cursor = conn.execute("INSERT INTO series (table_name, name, added) VALUES (?, ?, ?)",
+                              (table, name, int(time.time())))
+        known[name] = cursor.lastrowid
+    return known, added
+
+
+def series_ids(conn, table):
+    """Dictionary Name -> series_id aller Register einer Tabelle"""
+    try:
+        return dict(conn.execute("SELECT name, series_id FROM series WHERE table_name = ? ORDER BY series_id", (table,)))
+    except sqlite3.OperationalError:
+        return {}
+
+
+def query_narrow(conn, table, columns, start_ts, end_ts, descending=False, limit=None):
+    """
+    Liest (timestamp, spalte1, ...) aus dem schmalen Format. Pro Serie ein Bereichs-Scan über den
+    Primärschlüssel, zusammengeführt nach Zeitstempel; fehlende Werte sind None.
+    """
+    ids = series_ids(conn, table)
+    rows = {}
+    for idx, col in enumerate(columns):
+        if col not in ids:
+            continue
+        cursor = conn.execute(f"SELECT timestamp, value FROM {narrow_table(table)} "
+                              f"WHERE series_id = ? AND timestamp BETWEEN ? AND ?", (ids[col], start_ts, end_ts))
+        for timestamp, value in cursor:
+            row = rows.get(timestamp)
+            if row is None:
+                row = rows[timestamp] = [timestamp] + [None] * len(columns)
+            row[idx + 1] = value
+    ordered = [tuple(rows[ts]) for ts in sorted(rows, reverse=descending)]
+    return ordered if limit is None else ordered[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema-Version und Register-Verzeichnis der Datenbank")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), "pv_data.db"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Fehler: Datenbank nicht gefunden unter {args.db}")
+        return
+
+    conn = sqlite3.connect(args.db, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    upgrade_schema(conn)
+    print(f"Schema-Version: {schema_version(conn)}")
+    tables = [name for (name,) in conn.execute("SELECT DISTINCT table_name FROM series ORDER BY table_name")]
+    for table in tables:
+        ids = series_ids(conn, table)
+        print(f"  {table}: {len(ids)} Serien, Format {storage_format(conn, table)}")
+        if storage_format(conn, table) == 'narrow':
+            count = conn.execute(f"SELECT COUNT(*) FROM {narrow_table(table)}").fetchone()[0]
+            print(f"    {count} Werte in {narrow_table(table)}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
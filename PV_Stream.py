@@ -0,0 +1,299 @@
+# Push-Kanal für die Webseiten (Server-Sent Events, GET /api/stream?topics=pv,status)
+# Statt dass jede offene Seite /api im eigenen Takt abfragt, veröffentlicht der Poll-Loop
+# nach jeder Abfrage einen Snapshot (PV_Web.publish). Der Snapshot wird in Themen zerlegt,
+# jedes Thema einmal serialisiert und nur bei Änderung an alle Abonnenten dieses Themas
+# verteilt. Die Arbeit pro Poll ist damit unabhängig von der Zahl der offenen Tablets.
+#
+# Themen (Schlüssel des /api-Dictionaries):
+#   status    timestamp
+#   pv        Register, Anlagen-Summen, flow_state (alles, was keinem anderen Thema gehört)
+#   charge    charge_mode*, goe_*
+#   fritz     fritz_*
+#   esp       zisterne_*
+#   outdoor   hm_outdoor_*
+#   homematic homematic_data, homematic_error
+#   rubbish   rubbish_data
+#
+# Aus denselben Fragmenten entsteht pro Änderung ein unveränderlicher /api-Snapshot (Snapshot):
+# fertige UTF-8-Bytes, eine gzip-Variante, eine fortlaufende Version und ein ETag. /api schreibt
+# nur noch diese Bytes und beantwortet If-None-Match mit 304, solange sich nichts geändert hat.
+#
+# Seiten brauchen meist nur wenige Themen. Profile (PROFILES, /api?profile=pv) setzen ihren
+# Snapshot aus den Fragmenten ihrer Themen zusammen; /api?fields=a,b liefert nur die genannten
+# Schlüssel. Beide werden erst bei Bedarf gebaut, bis zur nächsten Änderung eines ihrer Themen
+# gecacht und bekommen ihre Version von diesen Themen: ändert sich nur Homematic, bleibt der
+# Stand von profile=pv gleich (304).
+#
+# Jeder Abonnent hält pro Thema nur das jeweils neueste Ereignis: ein langsamer Client
+# bekommt Zwischenstände nicht nachgeliefert, und sein Puffer wächst nie über ein Ereignis
+# pro Thema. Ohne neue Daten geht alle 'heartbeat' Sekunden ein SSE-Kommentar raus, damit
+# Proxys und WLAN-Router die Verbindung offen halten und der Client Abbrüche bemerkt.
+
+import collections
+import gzip
+import json
+import threading
+import time
+import zlib
+
+from PV_Metrics import METRICS
+
+TOPICS = ('status', 'pv', 'charge', 'fritz', 'esp', 'outdoor', 'homematic', 'rubbish')
+_EXACT = {
+    'timestamp': 'status',
+    'homematic_data': 'homematic',
+    'homematic_error': 'homematic',
+    'rubbish_data': 'rubbish',
+}
+_PREFIXES = (('charge_mode', 'charge'), ('goe_', 'charge'), ('fritz_', 'fritz'), ('zisterne_', 'esp'),
+             ('hm_outdoor_', 'outdoor'))
+HEARTBEAT = b": ping\n\n"
+# Ändert sich nur der Zeitstempel der Veröffentlichung, gilt der Stand als unverändert
+# (gleiche Bytes, gleiche Version, 304 für /api); timestamp zeigt so die letzte echte Änderung
+VOLATILE_TOPICS = {'status'}
+GZIP_MIN_SIZE = 512   # kleinere Antworten werden unkomprimiert gesendet
+# Profil -> Themen der jeweiligen Seite (/api?profile=, /api/stream?profile=)
+PROFILES = {
+    'hub': ('status', 'outdoor', 'rubbish'),   # index.html
+    'pv': ('status', 'pv'),
+    'charge': ('status', 'charge'),
+    'windows': ('status', 'homematic'),
+    'others': ('status', 'esp', 'fritz'),
+    'history': ('status',),
+}
+MAX_PROJECTIONS = 32   # gecachte ?fields=-Kombinationen (darüber wird der Cache geleert)
+
+# Unveränderlicher Stand für /api (body/gzip_body: fertige Bytes, etag inkl. Anführungszeichen)
+Snapshot = collections.namedtuple('Snapshot', ['version', 'body', 'gzip_body', 'etag'])
+
+
+def topic_of(key):
+    """Thema eines Schlüssels im /api-Dictionary"""
+    topic = _EXACT.get(key)
+    if topic:
+        return topic
+    for prefix, topic in _PREFIXES:
+        if key.startswith(prefix):
+            return topic
+    return 'pv'
+
+
+def parse_topics(value):
+    """'pv,status' -> Menge bekannter Themen (leer/None = alle)"""
+    if not value:
+        return set(TOPICS)
+    return {topic.strip() for topic in value.split(',') if topic.strip() in TOPICS}
+
+
+def parse_fields(value):
+    """'battery_soc, total_dc_power' -> Tupel der Schlüssel (Reihenfolge wie angefragt, ohne Doppelte)"""
+    return tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+
+
+class Subscription:
+    """Ein offener Stream; sammelt die neuesten Ereignisse seiner Themen bis zum nächsten take()"""
+
+    def __init__(self, topics):
+        self.topics = topics
+        self._pending = {}   # Thema -> neuestes, noch nicht gesendetes Ereignis (bytes)
+        self._lock = threading.Lock()
+        self._waker = None
+        self.closed = False
+
+    def set_waker(self, func):
+        """func() wird bei jedem neuen Ereignis aufgerufen (z.B. loop.call_soon_threadsafe für asyncio)"""
+        self._waker = func
+
+    def _offer(self, topic, event):
+        with self._lock:
+            self._pending[topic] = event
+        if self._waker:
+            self._waker()
+
+    def take(self):
+        """Bytes aller anstehenden Ereignisse ohne zu warten (None = nichts neu, b"" = geschlossen)"""
+        with self._lock:
+            if self.closed:
+                return b""
+            if not self._pending:
+                return None
+            chunk = b"".join(self._pending.values())
+            self._pending.clear()
+            return chunk
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        if self._waker:
+            self._waker()
+
+
+class StreamHub:
+    def __init__(self, heartbeat=15.0, name="web"):
+        """
+        :param heartbeat: Sekunden ohne Ereignis, nach denen ein SSE-Kommentar gesendet wird
+        :param name: Schlüssel für die Metriken (ein Hub pro Webserver)
+        """
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._events = {}     # Thema -> zuletzt serialisiertes Ereignis (für neue Abonnenten)
+        self._payloads = {}   # Thema -> JSON des letzten Fragments (Änderungserkennung)
+        self._fragments = {}  # Thema -> letztes Fragment (Quelle für ?fields=)
+        self._topic_versions = {}   # Thema -> Version seiner letzten Änderung
+        self._views = {}      # Profil bzw. Feld-Tupel -> Snapshot (Teilansichten, bei Bedarf gebaut)
+        self._lock = threading.Lock()
+        # Startkennung im ETag: nach einem Neustart passt kein altes ETag zufällig zur neuen Versionsnummer
+        self._epoch = format(int(time.time()), 'x')
+        self.snapshot = None
+
+        self.version = 0
+        self.publishes = 0
+        self.events_sent = 0
+        METRICS.register_collector(f"stream:{name}", self._collect_metrics)
+
+    def publish(self, data):
+        """
+        Zerlegt einen Snapshot in Themen und verteilt geänderte Fragmente.
+        :return: Anzahl geänderter oder entfallener Themen
+        """
+        fragments = {}
+        for key, value in data.items():
+            fragments.setdefault(topic_of(key), {})[key] = value
+
+        changed = {}
+        for topic, fragment in fragments.items():
+            payload = json.dumps(fragment)
+            if self._payloads.get(topic) != payload:
+                changed[topic] = payload
+        removed = self._payloads.keys() - fragments.keys()
+
+        with self._lock:
+            self.publishes += 1
+            if self.snapshot is not None and not removed and changed.keys() <= VOLATILE_TOPICS:
+                return 0
+            self.version += 1
+            for topic, payload in changed.items():
+                self._payloads[topic] = payload
+                self._fragments[topic] = fragments[topic]
+                self._topic_versions[topic] = self.version
+                self._events[topic] = f"id: {self.version}\nevent: {topic}\ndata: {payload}\n\n".encode('utf-8')
+            # Entfallenes Thema: leeres Fragment an die Abonnenten (löscht seine Schlüssel im Browser),
+            # neue Abonnenten bekommen dafür nichts mehr
+            tombstones = {}
+            for topic in removed:
+                del self._payloads[topic]
+                del self._fragments[topic]
+                self._events.pop(topic, None)
+                self._topic_versions[topic] = self.version
+                tombstones[topic] = f"id: {self.version}\nevent: {topic}\ndata: {{}}\n\n".encode('utf-8')
+            events = {topic: self._events[topic] for topic in changed}
+            events.update(tombstones)
+            self.snapshot = self._build_snapshot()
+            subscribers = list(self._subscribers)
+
+        for sub in subscribers:
+            for topic in events.keys() & sub.topics:
+                sub._offer(topic, events[topic])
+                self.events_sent += 1
+        return len(events)
+
+    def _build_snapshot(self, topics=None, version=None, tag=None):
+        """
+        Setzt die serialisierten Fragmente zu einem JSON-Objekt zusammen (ohne erneutes json.dumps).
+        :param topics: Nur diese Themen (None = alle)
+        :param tag: Zusatz im ETag, damit sich Teilansichten derselben Version unterscheiden
+        """
+        payloads = [payload for topic, payload in self._payloads.items() if topics is None or topic in topics]
+        inner = ", ".join(payload[1:-1] for payload in payloads if payload != "{}")
+        return self._make_snapshot(("{" + inner + "}").encode('utf-8'), version, tag)
+
+    def _make_snapshot(self, body, version=None, tag=None):
+        version = self.version if version is None else version
+        gzip_body = gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_SIZE else None
+        etag = f'"{self._epoch}-{version}-{tag}"' if tag else f'"{self._epoch}-{version}"'
+        return Snapshot(version, body, gzip_body, etag)
+
+    def _view_version(self, topics):
+        """
+        Version einer Teilansicht: letzte Änderung ihrer Themen (der Zeitstempel allein zählt nicht,
+        außer die Ansicht besteht nur aus flüchtigen Themen wie profile=history oder fields=timestamp)
+        """
+        relevant = [topic for topic in topics if topic not in VOLATILE_TOPICS] or topics
+        return max([self._topic_versions.get(topic, 0) for topic in relevant] or [0])
+
+    def profile_snapshot(self, profile):
+        """Snapshot eines Profils (PROFILES) oder None, wenn noch nichts veröffentlicht wurde"""
+        topics = PROFILES[profile]
+        with self._lock:
+            if self.snapshot is None:
+                return None
+            version = self._view_version(topics)
+            view = self._views.get(profile)
+            if view is None or view.version != version:
+                view = self._build_snapshot(topics, version, profile)
+                self._views[profile] = view
+            return view
+
+    def fields_snapshot(self, fields):
+        """
+        Snapshot nur mit den angefragten Schlüsseln (unbekannte fehlen im Ergebnis).
+        :param fields: Tupel der Schlüssel, siehe parse_fields()
+        """
+        topics = {topic_of(field) for field in fields}
+        with self._lock:
+            if self.snapshot is None:
+                return None
+            version = self._view_version(topics)
+            view = self._views.get(fields)
+            if view is None or view.version != version:
+                projection = {}
+                for field in fields:
+                    fragment = self._fragments.get(topic_of(field), {})
+                    if field in fragment:
+                        projection[field] = fragment[field]
+                tag = format(zlib.crc32(",".join(fields).encode('utf-8')), 'x')
+                view = self._make_snapshot(json.dumps(projection).encode('utf-8'), version, tag)
+                if len(self._views) >= MAX_PROJECTIONS + len(PROFILES):
+                    self._views = {key: value for key, value in self._views.items() if key in PROFILES}
+                self._views[fields] = view
+            return view
+
+    def subscribe(self, topics):
+        """Neuer Abonnent; bekommt sofort den aktuellen Stand seiner Themen"""
+        sub = Subscription(topics)
+        with self._lock:
+            self._subscribers.add(sub)
+            for topic in topics:
+                if topic in self._events:
+                    sub._offer(topic, self._events[topic])
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def close(self):
+        """Beendet alle offenen Streams (z.B. beim Herunterfahren)"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for sub in subscribers:
+            sub.close()
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'version': self.version,
+            'publishes': self.publishes,
+            'events_sent': self.events_sent,
+            'views': len(self._views),
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        return [
+            ('pv_web_stream_subscribers', 'gauge', 'Offene /api/stream Verbindungen', [({}, stats['subscribers'])]),
+            ('pv_web_stream_publishes_total', 'counter', 'Veröffentlichte Snapshots', [({}, stats['publishes'])]),
+            ('pv_web_stream_events_total', 'counter', 'An Abonnenten verteilte Ereignisse', [({}, stats['events_sent'])]),
+        ]
@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import sqlite3
 import datetime
 import os
 import bisect
@@ -9,8 +8,13 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import matplotlib.dates as mdates
 
+from PV_Partitions import columns_of
+from PV_ReadPool import open_readonly
+from PV_Rollups import fetch_series
+
 # Konfiguration
 DB_NAME = "pv_data.db"
+MAX_PLOT_POINTS = 2000 # Ab dieser Punktzahl werden die Rollup-Tabellen (stündlich/täglich/monatlich) gelesen
 
 class PVVisualizer:
     def __init__(self, root):
@@ -121,21 +125,18 @@ class PVVisualizer:
         self.value_labels = {}
 
     def _connect_db_and_fetch_columns(self):
-        """Liest die Spaltennamen aus der Tabelle readings"""
+        """Liest die Spaltennamen aus der Tabelle readings (bzw. ihrer jüngsten Monats-Partition)"""
         if not os.path.exists(self.db_path):
             return False
             
         try:
-            conn = sqlite3.connect(self.db_path, timeout=5)
-            cursor = conn.cursor()
+            conn = open_readonly(self.db_path)
             # Metadaten der Tabelle abrufen
-            cursor.execute("PRAGMA table_info(readings)")
-            columns_info = cursor.fetchall()
+            columns = columns_of(conn, "readings")
             conn.close()
             
-            # Spalten extrahieren (Name ist an Index 1)
             # Wir ignorieren 'timestamp', da das unsere X-Achse ist
-            self.available_columns = [col[1] for col in columns_info if col[1] != 'timestamp']
+            self.available_columns = [col for col in columns if col != 'timestamp']
             return True
         except Exception as e:
             print(f"DB Error: {e}")
@@ -254,24 +255,14 @@ class PVVisualizer:
         # 2. Zeitraum berechnen
         start_ts, end_ts = self._get_time_range()
 
-        # 3. Daten aus DB holen
+        # 3. Daten aus DB holen (lange Zeiträume aus der gröbsten passenden Rollup-Tabelle)
         try:
-            conn = sqlite3.connect(self.db_path, timeout=5)
-            cursor = conn.cursor()
-            
-            # Debug: Anzahl der Werte prüfen
-            cursor.execute("SELECT COUNT(*) FROM readings")
-            row_count = cursor.fetchone()[0]
-            print(f"Anzahl der Datensätze in der Datenbank: {row_count}")
-            
-            # SQL Injection verhindern: Spaltennamen sind sicher, da sie aus PRAGMA kamen, 
-            # aber wir bauen den String trotzdem vorsichtig.
-            cols_str = ", ".join(selected_cols)
-            query = f"SELECT timestamp, {cols_str} FROM readings WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp ASC"
+            conn = open_readonly(self.db_path)
             
-            cursor.execute(query, (start_ts, end_ts))
-            rows = cursor.fetchall()
+            # SQL Injection verhindern: Spaltennamen sind sicher, da sie aus PRAGMA kamen
+            level, rows = fetch_series(conn, "readings", selected_cols, start_ts, end_ts, max_points=MAX_PLOT_POINTS)
             conn.close()
+            print(f"Geladene Datensätze: {len(rows)} (Quelle: {level})")
         except Exception as e:
             print(f"Fehler beim Lesen der Daten: {e}")
             return
@@ -1,35 +1,68 @@
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from socketserver import ThreadingMixIn
+import asyncio
 import os
 import time
 import json
 import socket
-from urllib.parse import urlparse, parse_qs
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Erlaubt parallele Anfragen, damit die API den Seitenaufruf nicht blockiert."""
-    daemon_threads = True
+from PV_Assets import STATIC_PREFIX, AssetCache, choose_encoding
+from PV_HttpAsync import AsyncHTTPServer, Offload, Response, StreamResponse
+from PV_Metrics import METRICS
+from PV_Stream import HEARTBEAT, PROFILES, StreamHub, parse_fields, parse_topics
 
 class PV_Web:
-    def __init__(self, fetch_data_callback, action_callback=None, fetch_history_callback=None, port=8080):
+    def __init__(self, fetch_data_callback, action_callback=None, fetch_history_callback=None, port=8080,
+                 workers=4, max_concurrent=32, max_streams=32):
+        """
+        :param workers: Threads für blockierende Callbacks (Verlauf, Aktionen)
+        :param max_concurrent: Gleichzeitig bearbeitete Anfragen, darüber antwortet der Server mit 503
+        :param max_streams: Gleichzeitig offene /api/stream Verbindungen (ein Tablet = eine Verbindung)
+        """
         self.fetch_data_callback = fetch_data_callback
         self.action_callback = action_callback
         self.fetch_history_callback = fetch_history_callback
         self.port = port
-        self.template_path = os.path.join(os.path.dirname(__file__), 'index.html') # Hub
-        self.pv_template_path = os.path.join(os.path.dirname(__file__), 'pv.html')  # PV Details
-        self.charge_template_path = os.path.join(os.path.dirname(__file__), 'charge.html')
-        self.heating_template_path = os.path.join(os.path.dirname(__file__), 'heating-cooling.html')
-        self.windows_template_path = os.path.join(os.path.dirname(__file__), 'windows.html')
-        self.others_template_path = os.path.join(os.path.dirname(__file__), 'others.html')
-        self.history_template_path = os.path.join(os.path.dirname(__file__), 'history.html')
+        # Seiten: URL -> HTML-Datei (einmal gelesen, im RAM mit gzip/brotli-Varianten, siehe PV_Assets.py)
+        self.pages = {
+            '/': 'index.html', # Hub
+            '/pv': 'pv.html', # PV Details
+            '/charge.html': 'charge.html',
+            '/heating-cooling.html': 'heating-cooling.html',
+            '/windows.html': 'windows.html',
+            '/others.html': 'others.html',
+            '/history': 'history.html',
+        }
+        self.assets = AssetCache(os.path.dirname(os.path.abspath(__file__)))
+        # Push-Kanal /api/stream: der Poll-Loop veröffentlicht, alle offenen Seiten bekommen dieselben Bytes
+        self.stream = StreamHub(name=str(port))
+        # Asyncio-Server mit Keep-Alive; blockierende Callbacks laufen in einem Thread-Pool fester Größe
+        self.server = AsyncHTTPServer(self.handle, port=port, workers=workers, max_concurrent=max_concurrent,
+                                      max_streams=max_streams)
+
+    def publish(self, data):
+        """Neuer Datenstand vom Poll-Loop (einmal pro Abfrage, unabhängig von der Zahl der Clients)"""
+        self.stream.publish(self._enrich_data(data))
+
+    def current_snapshot(self):
+        """Letzter veröffentlichter /api-Stand; vor der ersten Veröffentlichung einmal direkt abgefragt"""
+        snapshot = self.stream.snapshot
+        if snapshot is None:
+            data = self.fetch_data_callback()
+            # Veröffentlicht der Callback selbst (main.py), nicht ein zweites Mal
+            if self.stream.snapshot is None:
+                self.publish(data)
+            snapshot = self.stream.snapshot
+        return snapshot
+
+    def _touch(self, params):
+        """Meldet dem Hauptprogramm eine aktive Seite (wie ein /api-Aufruf mit denselben Parametern)"""
+        try:
+            self.fetch_data_callback(params)
+        except TypeError:
+            pass # Callback ohne Parameter (main.py): nichts zu melden
 
     def start(self):
-        handler_class = self._create_handler()
-        ThreadedHTTPServer.allow_reuse_address = True
-        server = ThreadedHTTPServer(('0.0.0.0', self.port), handler_class)
-        
+        self.server.start()
+
         # Eigene IP-Adresse im Netzwerk ermitteln (für die Anzeige)
         host_ip = "localhost"
         try:
@@ -42,19 +75,21 @@ class PV_Web:
         except Exception:
             pass
 
-        thread = threading.Thread(target=server.serve_forever)
-        thread.daemon = True
-        thread.start()
         print(f"Webserver läuft. Erreichbar unter:\n  Lokal:    http://localhost:{self.port}\n  Netzwerk: http://{host_ip}:{self.port}")
 
+    def stop(self):
+        """Beendet offene Streams und den Server (z.B. beim Herunterfahren)"""
+        self.stream.close()
+        self.server.stop()
+
     def _enrich_data(self, data):
         """Fügt berechnete Felder (Flow-State, Zeitstempel) zu den Daten hinzu."""
         enriched = data.copy()
-        
+
         # Batterie Status für Animation berechnen
         batt_power_str = data.get("battery_power", "0 W")
         flow_state = "idle"
-        
+
         try:
             val = float(batt_power_str.split()[0])
             if val < -10:
@@ -68,104 +103,149 @@ class PV_Web:
         enriched['timestamp'] = time.strftime("%H:%M:%S")
         return enriched
 
-    def _create_handler(self):
-        pv_web_instance = self
-        
-        class PVHandler(BaseHTTPRequestHandler):
-            def do_GET(self):
-                parsed_path = urlparse(self.path)
-                query_components = parse_qs(parsed_path.query)
-
-                if parsed_path.path == '/api':
-                    # Daten für AJAX Abfrage
-                    try:
-                        raw_data = pv_web_instance.fetch_data_callback(query_components)
-                    except TypeError:
-                        raw_data = pv_web_instance.fetch_data_callback()
-                    data = pv_web_instance._enrich_data(raw_data)
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(json.dumps(data).encode('utf-8'))
-                
-                elif self.path.startswith('/api/history'):
-                    # Query Parameter parsen (?date=YYYY-MM-DD&cols=a,b)
-                    query_components = parse_qs(urlparse(self.path).query)
-                    date_str = query_components.get('date', [None])[0]
-                    cols_param = query_components.get('cols', [None])[0]
-                    
-                    cols = None
-                    if cols_param:
-                        cols = cols_param.split(',')
-                    
-                    data = {}
-                    if pv_web_instance.fetch_history_callback:
-                        data = pv_web_instance.fetch_history_callback(date_str, cols)
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(json.dumps(data).encode('utf-8'))
-                
-                elif self.path == '/history':
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.end_headers()
-                    with open(pv_web_instance.history_template_path, 'rb') as f:
-                        self.wfile.write(f.read())
-
-                elif self.path in ['/', '/pv', '/charge.html', '/heating-cooling.html', '/others.html', '/windows.html']:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.end_headers()
-
-                    if self.path == '/pv':
-                        t_path = pv_web_instance.pv_template_path
-                    elif self.path == '/charge.html':
-                        t_path = pv_web_instance.charge_template_path
-                    elif self.path == '/heating-cooling.html':
-                        t_path = pv_web_instance.heating_template_path
-                    elif self.path == '/windows.html':
-                        t_path = pv_web_instance.windows_template_path
-                    elif self.path == '/others.html':
-                        t_path = pv_web_instance.others_template_path
-                    else:
-                        t_path = pv_web_instance.template_path
-
-                    try:
-                        with open(t_path, 'rb') as f:
-                            self.wfile.write(f.read())
-                    except Exception as e:
-                        self.wfile.write(f"Fehler: {e}".encode('utf-8'))
-                else:
-                    self.send_error(404)
-            
-            def do_POST(self):
-                if self.path == '/action':
-                    content_length = int(self.headers['Content-Length'])
-                    post_data = self.rfile.read(content_length)
-                    
-                    response_msg = "Keine Aktion definiert"
-                    
-                    try:
-                        data = json.loads(post_data.decode('utf-8'))
-                        command = data.get('command')
-                        
-                        if pv_web_instance.action_callback:
-                            pv_web_instance.action_callback(command)
-                            response_msg = f"Aktion '{command}' ausgeführt"
-                        else:
-                            response_msg = "Kein Callback konfiguriert"
-                            
-                    except Exception as e:
-                        response_msg = f"Fehler: {e}"
-
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain')
-                    self.end_headers()
-                    self.wfile.write(response_msg.encode('utf-8'))
-            
-            def log_message(self, format, *args):
-                pass # Kein Logging in der Konsole, um Output sauber zu halten
-                
-        return PVHandler
\ No newline at end of file
+    def handle(self, request):
+        """Routing (läuft im Event-Loop: alles Blockierende als Offload in den Thread-Pool)"""
+        if request.method in ('GET', 'HEAD'):
+            if request.path == '/api':
+                # Daten für AJAX Abfrage: fertig serialisierter Stand der letzten Veröffentlichung
+                if 'source' in request.query or self.stream.snapshot is None:
+                    return Offload(lambda: self._api(request))
+                return self._api(request)
+
+            elif request.path == '/api/stream':
+                return self._stream(request)
+
+            elif request.path == '/metrics':
+                # Messpunkte des Abfrage-Pfads im Prometheus-Textformat
+                return Response(200, METRICS.render(), 'text/plain; version=0.0.4; charset=utf-8')
+
+            elif request.path == '/api/history':
+                # Query Parameter parsen (?date=YYYY-MM-DD&cols=a,b)
+                return Offload(lambda: self._history(request))
+
+            elif request.path in self.pages:
+                return self._asset(request, self.assets.page(self.pages[request.path]), max_age=None)
+
+            elif request.path.startswith(STATIC_PREFIX):
+                # Gemeinsame JS/CSS-Dateien; mit passender Version (?v=) unbegrenzt cachebar
+                asset = self.assets.static(request.path[len(STATIC_PREFIX):])
+                versioned = asset is not None and request.query.get('v', [None])[0] == asset.version
+                return self._asset(request, asset, max_age=31536000 if versioned else None)
+
+        elif request.method == 'POST' and request.path == '/action':
+            return Offload(lambda: self._action(request))
+
+        return Response.error(404)
+
+    def _api(self, request):
+        profile = request.query.get('profile', [None])[0]
+        fields = parse_fields(request.query.get('fields', [""])[0])
+        if profile and profile not in PROFILES:
+            return Response.error(400, f"Unbekanntes Profil '{profile}' (bekannt: {', '.join(PROFILES)})")
+        if 'source' in request.query:
+            self._touch(request.query)
+        snapshot = self.current_snapshot()
+        # Teilansicht für Seiten, die nur einen Teil brauchen (?fields=a,b oder ?profile=pv)
+        if fields:
+            snapshot = self.stream.fields_snapshot(fields)
+        elif profile:
+            snapshot = self.stream.profile_snapshot(profile)
+        headers = [('ETag', snapshot.etag), ('Cache-Control', 'no-cache'), ('Vary', 'Accept-Encoding')]
+        # 304, wenn der Client diesen Stand schon hat
+        if snapshot.etag in [tag.strip() for tag in request.header('If-None-Match').split(',')]:
+            return Response(304, headers=headers)
+        body = snapshot.body
+        if snapshot.gzip_body is not None and 'gzip' in request.header('Accept-Encoding'):
+            body = snapshot.gzip_body
+            headers.append(('Content-Encoding', 'gzip'))
+        return Response(200, body, 'application/json; charset=utf-8', headers)
+
+    def _history(self, request):
+        date_str = request.query.get('date', [None])[0]
+        cols_param = request.query.get('cols', [None])[0]
+
+        cols = None
+        if cols_param:
+            cols = cols_param.split(',')
+
+        data = {}
+        if self.fetch_history_callback:
+            data = self.fetch_history_callback(date_str, cols)
+        return Response(200, json.dumps(data), 'application/json; charset=utf-8')
+
+    def _action(self, request):
+        response_msg = "Keine Aktion definiert"
+
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+            command = data.get('command')
+
+            if self.action_callback:
+                self.action_callback(command)
+                response_msg = f"Aktion '{command}' ausgeführt"
+            else:
+                response_msg = "Kein Callback konfiguriert"
+
+        except Exception as e:
+            response_msg = f"Fehler: {e}"
+
+        return Response(200, response_msg, 'text/plain')
+
+    def _asset(self, request, asset, max_age):
+        """
+        Datei aus dem Asset-Cache (304 bei passendem ETag).
+        :param max_age: Sekunden im Browser-Cache ohne Rückfrage, None = bei jedem Aufruf per ETag prüfen
+        """
+        if asset is None:
+            return Response.error(404)
+        cache_control = f"public, max-age={max_age}, immutable" if max_age else "no-cache"
+        headers = [('ETag', asset.etag), ('Cache-Control', cache_control)]
+        if asset.etag in [tag.strip() for tag in request.header('If-None-Match').split(',')]:
+            return Response(304, headers=headers)
+
+        body, encoding = choose_encoding(asset, request.header('Accept-Encoding'))
+        headers += [('Last-Modified', asset.last_modified), ('Vary', 'Accept-Encoding')]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return Response(200, body, asset.content_type, headers)
+
+    def _stream(self, request):
+        """Server-Sent Events: hält die Verbindung offen und schreibt neue Ereignisse der Themen"""
+        profile = request.query.get('profile', [None])[0]
+        if profile in PROFILES:
+            topics = set(PROFILES[profile])
+        else:
+            topics = parse_topics(request.query.get('topics', [None])[0])
+        # z.B. source=windows: hält das schnellere Homematic-Polling aktiv, solange die Seite offen ist
+        touch = request.query if 'source' in request.query else None
+        hub = self.stream
+
+        async def producer(write, run_blocking):
+            loop = asyncio.get_running_loop()
+            wakeup = asyncio.Event()
+            sub = hub.subscribe(topics)
+            sub.set_waker(lambda: loop.call_soon_threadsafe(wakeup.set))
+            try:
+                if touch:
+                    await run_blocking(self._touch, touch)
+                await write(b"retry: 3000\n\n")
+                while True:
+                    chunk = sub.take()
+                    if chunk is None:
+                        try:
+                            await asyncio.wait_for(wakeup.wait(), hub.heartbeat)
+                        except asyncio.TimeoutError:
+                            chunk = HEARTBEAT
+                            if touch:
+                                await run_blocking(self._touch, touch)
+                        wakeup.clear()
+                    if chunk == b"":
+                        break
+                    if chunk:
+                        await write(chunk)
+            finally:
+                sub.set_waker(None)
+                hub.unsubscribe(sub)
+
+        return StreamResponse(producer, 'text/event-stream; charset=utf-8',
+                              [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')])
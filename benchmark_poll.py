@@ -0,0 +1,165 @@
+# Benchmark für den Modbus-Poll-Zyklus gegen den lokalen Sungrow-Simulator
+# Misst Zykluszeit (p50/p99), Transaktionen pro Zyklus, Wiederholungen und Reconnects
+# für die verschiedenen Lese-Varianten. read_raw_modbus_data() in main_raspi.py
+# delegiert an ModbusDevice.read() -> ModbusSession.read_plan(), das hier direkt
+# gemessen wird (ohne die Smart-Home-Integrationen von main_raspi.py zu starten).
+#
+# Start: python benchmark_poll.py --cycles 50 --latency 20 --drop 0.01 --json bench_poll.json
+
+import argparse
+import json
+import time
+
+from PV_Modbus import ModbusSession, build_read_plan
+from PV_ModbusAsync import AsyncModbusEngine
+from PV_Pacing import AdaptivePacer
+from PV_Scheduler import PollScheduler
+from sungrow_simulator import load_registers, start_simulator
+
+
+class CountingLogger:
+    """Zählt Fehlermeldungen statt sie in error_msg.log zu schreiben"""
+
+    def __init__(self):
+        self.count = 0
+
+    def log_error(self, message):
+        self.count += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_engine(name, session, plans, server, cycles, tick=0.0):
+    """
+    Führt 'cycles' Poll-Zyklen aus. plans ist eine Funktion, die pro Zyklus den Leseplan liefert.
+    :param tick: Wartezeit zwischen den Zyklen (für den Scheduler-Modus)
+    """
+    durations = []
+    transactions = []
+    none_values = 0
+    values_read = 0
+    retries_before = session.retries
+    reconnects_before = session.reconnect_count
+
+    session.ensure_connected()
+    for _ in range(cycles):
+        plan = plans()
+        before = server.snapshot_stats()['requests']
+        start = time.perf_counter()
+        data = {}
+        if plan and session.ensure_connected():
+            try:
+                data = session.read_plan(plan)
+            except Exception:
+                session.invalidate()
+        durations.append(time.perf_counter() - start)
+        transactions.append(server.snapshot_stats()['requests'] - before)
+        values_read += len(data)
+        none_values += sum(1 for val in data.values() if val is None)
+        if tick:
+            time.sleep(tick)
+
+    session.close()
+    return {
+        'engine': name,
+        'cycles': cycles,
+        'cycle_p50_ms': round(percentile(durations, 50) * 1000, 2),
+        'cycle_p99_ms': round(percentile(durations, 99) * 1000, 2),
+        'cycle_max_ms': round(max(durations) * 1000, 2),
+        'transactions_per_cycle': round(sum(transactions) / cycles, 2),
+        'values_per_cycle': round(values_read / cycles, 2),
+        'none_values': none_values,
+        'retries': session.retries - retries_before,
+        'reconnects': session.reconnect_count - reconnects_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des Modbus-Poll-Zyklus gegen den Simulator")
+    parser.add_argument('--cycles', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=20.0, help="Simulierte Antwortlatenz in ms")
+    parser.add_argument('--jitter', type=float, default=5.0, help="Zufälliger Latenz-Zusatz in ms")
+    parser.add_argument('--drop', type=float, default=0.0, help="Wahrscheinlichkeit für Verbindungsabbruch pro Anfrage")
+    parser.add_argument('--exception', type=float, default=0.0, help="Wahrscheinlichkeit für Exception 'Device Busy'")
+    parser.add_argument('--depth', type=int, default=4, help="Pipelining-Tiefe der Async-Engine")
+    parser.add_argument('--engines', default="per-register,block,adaptive,async,scheduled")
+    parser.add_argument('--json', dest='json_path', default=None, help="Ergebnisse zusätzlich als JSON speichern")
+    args = parser.parse_args()
+
+    registers = load_registers()
+    server = start_simulator(registers=registers, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                             drop_rate=args.drop, exception_rate=args.exception)
+    port = server.server_address[1]
+    full_plan = build_read_plan(registers)
+
+    results = []
+    for engine in args.engines.split(','):
+        engine = engine.strip()
+        logger = CountingLogger()
+        if engine == 'per-register':
+            # Entspricht dem früheren Ablauf: eine Transaktion pro Register
+            plan = build_read_plan(registers, max_block=1)
+            session = ModbusSession('127.0.0.1', port=port, logger=logger)
+            results.append(run_engine(engine, session, lambda: plan, server, args.cycles))
+        elif engine == 'block':
+            session = ModbusSession('127.0.0.1', port=port, logger=logger)
+            results.append(run_engine(engine, session, lambda: full_plan, server, args.cycles))
+        elif engine == 'adaptive':
+            # Blockweise mit adaptiver Taktung (ohne Zustandsdatei, startet jedes Mal mit den Standardwerten)
+            pacer = AdaptivePacer(key=engine, state_file=None)
+            session = ModbusSession('127.0.0.1', port=port, logger=logger, pacer=pacer)
+            plans = {}
+
+            def adaptive_plan():
+                if pacer.max_block not in plans:
+                    plans[pacer.max_block] = build_read_plan(registers, pacer.max_block)
+                return plans[pacer.max_block]
+
+            result = run_engine(engine, session, adaptive_plan, server, args.cycles)
+            result['pacing'] = pacer.stats()
+            results.append(result)
+        elif engine == 'async':
+            session = AsyncModbusEngine('127.0.0.1', port=port, depth=args.depth, logger=logger)
+            results.append(run_engine(engine, session, lambda: full_plan, server, args.cycles))
+        elif engine == 'scheduled':
+            # Multi-Rate: ein Zyklus pro Scheduler-Takt, nur fällige Register
+            scheduler = PollScheduler(registers)
+            session = ModbusSession('127.0.0.1', port=port, logger=logger)
+            result = run_engine(engine, session, lambda: scheduler.due(), server, args.cycles,
+                                tick=scheduler.tick)
+            result['missed_deadlines'] = scheduler.missed_deadlines
+            results.append(result)
+        else:
+            print(f"Unbekannte Engine: {engine}")
+            continue
+        results[-1]['log_errors'] = logger.count
+
+    server.shutdown()
+
+    header = f"{'Engine':<14} | {'p50 ms':>8} | {'p99 ms':>8} | {'Trans./Zyklus':>13} | {'Retries':>7} | {'Reconn.':>7} | {'None':>5}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['engine']:<14} | {r['cycle_p50_ms']:>8} | {r['cycle_p99_ms']:>8} | {r['transactions_per_cycle']:>13} | "
+              f"{r['retries']:>7} | {r['reconnects']:>7} | {r['none_values']:>5}")
+
+    if args.json_path:
+        report = {
+            'timestamp': int(time.time()),
+            'settings': {'cycles': args.cycles, 'latency_ms': args.latency, 'jitter_ms': args.jitter,
+                         'drop_rate': args.drop, 'exception_rate': args.exception, 'depth': args.depth},
+            'results': results,
+        }
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"Ergebnisse gespeichert: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Benchmark der Speicherschicht gegen synthetische Datenbanken über mehrere Jahre
+# Erzeugt (einmalig, siehe synthetic_dataset.py) je eine pv_data.db pro Jahreszahl und misst:
+#   - today:        get_today_values() für alle Register (Chart der Startseite)
+#   - year_chart:   fetch_series() über ein Jahr mit max_points=2000 (Visualizer, /api/history)
+#   - year_scan:    query_range() über ein Jahr, drei Spalten, alle Rohzeilen
+#   - weekly:       weekly_report.generate_report() ohne Backup und E-Mail
+#   - write:        Zeilen pro Sekunde über den DB-Writer inkl. Rollups (eigene Tabelle, danach entfernt)
+#   - db_size / archive_size: Dateigrößen
+#   - archive_ratio: ein vollständiger Monat als Kopie (VACUUM) gegenüber seiner Archivdatei
+#     (PV_Archive, Ziel: mindestens 10x)
+# Die Ergebnisse lassen sich als JSON speichern und gegen einen früheren Lauf vergleichen;
+# bei einer Verschlechterung über --max-regression Prozent endet das Skript mit Exit-Code 1.
+#
+# Start: python benchmark_storage.py --years 1,5,10 --json bench_storage.json
+#        python benchmark_storage.py --years 1,5,10 --baseline bench_storage.json --max-regression 20
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import weekly_report
+from PV_Archive import archive_dir
+from PV_Database import PV_Database
+from PV_Partitions import archive_partition, create_partition, list_partitions, query_range
+from PV_ReadPool import open_readonly
+from PV_Rollups import fetch_series
+from synthetic_dataset import INTERVAL, generate_database
+
+BENCH_TABLE = "bench_writes"   # Tabelle für den Schreib-Test, wird danach wieder entfernt
+SCAN_COLUMNS = ['total_dc_power', 'battery_soc', 'export_power']
+
+
+def timed(func, repeat):
+    """Führt func() repeat-mal aus; :return: (Median, Maximum) in ms"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(durations), 2), round(max(durations), 2)
+
+
+def directory_size(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_reads(db_path, registers, repeat):
+    results = {}
+    now = time.time()
+    year_start = now - 365 * 86400
+
+    db = PV_Database(db_path, registers)
+    try:
+        median, worst = timed(lambda: db.get_today_values(list(registers)), repeat)
+        results['today_ms'] = {'value': median, 'max': worst, 'better': 'lower'}
+    finally:
+        db.close()
+
+    conn = open_readonly(db_path)
+    try:
+        median, worst = timed(lambda: fetch_series(conn, "readings", SCAN_COLUMNS, year_start, now, max_points=2000),
+                              repeat)
+        results['year_chart_ms'] = {'value': median, 'max': worst, 'better': 'lower'}
+        median, worst = timed(lambda: query_range(conn, "readings", SCAN_COLUMNS, year_start, now), repeat)
+        results['year_scan_ms'] = {'value': median, 'max': worst, 'better': 'lower'}
+    finally:
+        conn.close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        median, worst = timed(lambda: weekly_report.generate_report(db_path, backup=False, send=False), repeat)
+    results['weekly_ms'] = {'value': median, 'max': worst, 'better': 'lower'}
+    return results
+
+
+def bench_write(db_path, registers, rows):
+    """Schreibt 'rows' Zeilen über PV_Database/DBWriter in eine eigene Tabelle und entfernt sie danach"""
+    db = PV_Database(db_path, registers, table_name=BENCH_TABLE)
+    values = {key: 1.0 for key in registers}
+    values.update({f"{key}_{suffix}": 1.0 for key in db.minmax_keys for suffix in ('min', 'max')})
+    first_ts = int(time.time())
+    first_ts -= first_ts % INTERVAL
+    try:
+        start = time.perf_counter()
+        for i in range(rows):
+            # Backpressure wie persist_data(): warten statt in die Spill-Datei zu schreiben
+            while db.writer.congested():
+                time.sleep(0.001)
+            db.writer.submit(BENCH_TABLE, first_ts + i * INTERVAL, values)
+        db.writer.flush(timeout=300)
+        elapsed = time.perf_counter() - start
+        spilled = db.writer.stats().get('spilled', 0)
+    finally:
+        db.close()
+
+    conn = sqlite3.connect(db_path, timeout=10)
+    with conn:
+        tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                                   "AND name LIKE ?", (BENCH_TABLE + "%",))]
+        for name in tables:
+            conn.execute(f"DROP TABLE {name}")
+        conn.execute("DELETE FROM series WHERE table_name = ?", (BENCH_TABLE,))
+        conn.execute("DELETE FROM storage WHERE table_name = ?", (BENCH_TABLE,))
+    conn.close()
+    return {'write_rows_per_s': {'value': round(rows / elapsed, 1), 'better': 'higher'},
+            'write_spilled': {'value': spilled, 'better': 'lower'}}
+
+
+def bench_archive(db_path, table="readings"):
+    """
+    Archiviert eine Kopie des ältesten vollständigen Monats (der erste ist meist angeschnitten)
+    :return: Verhältnis der Partitionsgröße (nach VACUUM) zur Archivdatei
+    """
+    src = open_readonly(db_path)
+    try:
+        partitions = list_partitions(src, table)
+        if not partitions:
+            return {}
+        name = partitions[1] if len(partitions) > 2 else partitions[0]
+        columns = [row[1] for row in src.execute(f"PRAGMA table_info({name})") if row[1] != 'timestamp']
+        rows = src.execute(f"SELECT timestamp, {', '.join(columns)} FROM {name}").fetchall()
+    finally:
+        src.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "archive_bench.db"))
+        try:
+            create_partition(conn, name, columns)
+            with conn:
+                conn.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * (len(columns) + 1))})", rows)
+            conn.execute("VACUUM")
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            db_bytes = (conn.execute("PRAGMA page_count").fetchone()[0] - 1) * page_size   # ohne Schema-Seite
+            _, size = archive_partition(conn, name)
+        finally:
+            conn.close()
+    return {'archive_ratio': {'value': round(db_bytes / size, 1), 'better': 'higher'}}
+
+
+def compare(results, baseline, max_regression):
+    """:return: Liste der Verschlechterungen über max_regression Prozent"""
+    regressions = []
+    for years, metrics in results.items():
+        for name, metric in metrics.items():
+            old = baseline.get(years, {}).get(name)
+            if not old or not old['value']:
+                continue
+            change = (metric['value'] - old['value']) / old['value'] * 100
+            if metric['better'] == 'higher':
+                change = -change
+            if change > max_regression:
+                regressions.append(f"{years} Jahr(e) {name}: {old['value']} -> {metric['value']} (+{change:.0f} %)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark der Speicherschicht mit synthetischen Mehrjahres-Daten")
+    parser.add_argument('--years', default="1,5,10", help="Kommagetrennte Jahreszahlen, je eine Datenbank")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), "bench_data"))
+    parser.add_argument('--regenerate', action='store_true', help="Vorhandene Datenbanken neu erzeugen")
+    parser.add_argument('--repeat', type=int, default=5, help="Wiederholungen pro Lese-Messung")
+    parser.add_argument('--write-rows', type=int, default=5000)
+    parser.add_argument('--json', dest='json_path', default=None, help="Ergebnisse zusätzlich als JSON speichern")
+    parser.add_argument('--baseline', default=None, help="JSON eines früheren Laufs zum Vergleich")
+    parser.add_argument('--max-regression', type=float, default=20.0, help="Erlaubte Verschlechterung in Prozent")
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "registers.json"), 'r', encoding='utf-8') as f:
+        registers = json.load(f)
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    results = {}
+    for years in [y.strip() for y in args.years.split(',') if y.strip()]:
+        db_path = os.path.abspath(os.path.join(args.data_dir, f"pv_data_{years}y.db"))
+        if args.regenerate or not os.path.exists(db_path):
+            print(f"Erzeuge {db_path} ({years} Jahr(e))...")
+            generate_database(db_path, registers, years=float(years))
+        print(f"Messe {years} Jahr(e)...")
+        metrics = bench_reads(db_path, registers, args.repeat)
+        metrics.update(bench_write(db_path, registers, args.write_rows))
+        metrics.update(bench_archive(db_path))
+        metrics['db_size_mib'] = {'value': round(os.path.getsize(db_path) / 1024 / 1024, 1), 'better': 'lower'}
+        metrics['archive_size_mib'] = {'value': round(directory_size(archive_dir(db_path)) / 1024 / 1024, 1),
+                                       'better': 'lower'}
+        results[years] = metrics
+
+    names = list(next(iter(results.values()))) if results else []
+    header = f"{'Messung':<20} | " + " | ".join(f"{years + ' J':>10}" for years in results)
+    print(header)
+    print("-" * len(header))
+    for name in names:
+        print(f"{name:<20} | " + " | ".join(f"{results[years][name]['value']:>10}" for years in results))
+
+    if args.json_path:
+        report = {
+            'timestamp': int(time.time()),
+            'settings': {'years': list(results), 'repeat': args.repeat, 'write_rows': args.write_rows},
+            'results': results,
+        }
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"Ergebnisse gespeichert: {args.json_path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Verschlechterung über {args.max_regression:.0f} %:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Keine Verschlechterung über {args.max_regression:.0f} % gegenüber {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
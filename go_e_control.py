@@ -1,13 +1,14 @@
 import time
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
 import urllib.request
 import urllib.error
 
+from PV_HttpAsync import AsyncHTTPServer, Offload, Response
+
 # --- Konfiguration ---
 #PV_API_URL      = "http://localhost:8080/api"
 PV_API_URL      = "http://192.168.178.58:8080/api"
+PV_API_FIELDS   = "battery_soc,total_dc_power,charge_mode"   # nur diese Werte statt des ganzen /api-Stands
 API_PORT        = 8081               # Port für die eigene API dieses Skripts
 
 GOE_IP          = "192.168.178.142"  # <-- HIER BITTE DIE IP DES CHARGERS EINTRAGEN
@@ -36,54 +37,40 @@ current_status_data = {
     "total_p_watt": 0
 }
 
-class StatusAPIHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/api/status':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(current_status_data).encode('utf-8'))
-        else:
-            self.send_error(404)
-    
-    def do_POST(self):
-        if self.path == '/api/set':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            try:
-                data = json.loads(post_data.decode('utf-8'))
-                command = data.get('command')
-                if command == 'start':
-                    set_goe_charging(True, 16) # Start mit Standard 16A im manuellen Modus
-                    response = {"status": "ok", "message": "Charging started"}
-                elif command == 'stop':
-                    set_goe_charging(False)
-                    response = {"status": "ok", "message": "Charging stopped"}
-                else:
-                    response = {"status": "error", "message": "Unknown command"}
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode('utf-8'))
-            except Exception as e:
-                self.send_error(400, str(e))
-        else:
-            self.send_error(404)
+def handle_api(request):
+    """Routing der eigenen API (läuft im Event-Loop von PV_HttpAsync)"""
+    if request.method in ('GET', 'HEAD') and request.path == '/api/status':
+        return Response(200, json.dumps(current_status_data), 'application/json')
+    if request.method == 'POST' and request.path == '/api/set':
+        # set_goe_charging() blockiert (HTTP zur Wallbox) -> Thread-Pool
+        return Offload(lambda: handle_set(request))
+    return Response.error(404)
 
-    def log_message(self, format, *args):
-        pass # Kein Konsolen-Log für Requests
+def handle_set(request):
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        command = data.get('command')
+        if command == 'start':
+            set_goe_charging(True, 16) # Start mit Standard 16A im manuellen Modus
+            response = {"status": "ok", "message": "Charging started"}
+        elif command == 'stop':
+            set_goe_charging(False)
+            response = {"status": "ok", "message": "Charging stopped"}
+        else:
+            response = {"status": "error", "message": "Unknown command"}
+        return Response(200, json.dumps(response), 'application/json')
+    except Exception as e:
+        return Response.error(400, str(e))
 
 def start_api_server():
-    server = HTTPServer(('0.0.0.0', API_PORT), StatusAPIHandler)
-    thread = threading.Thread(target=server.serve_forever, daemon=True)
-    thread.start()
+    server = AsyncHTTPServer(handle_api, port=API_PORT, workers=2, max_concurrent=8, max_streams=0, name="GoE_API")
+    server.start()
     print(f"API Server läuft auf Port {API_PORT} (Endpunkt: /api/status)")
 
 def get_pv_data():
     """Holt SOC, DC Power und Charge Mode von der lokalen PV-API."""
     try:
-        with urllib.request.urlopen(PV_API_URL, timeout=5) as url:
+        with urllib.request.urlopen(f"{PV_API_URL}?fields={PV_API_FIELDS}", timeout=5) as url:
             data = json.loads(url.read().decode())
             
             # SOC extrahieren
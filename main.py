@@ -1,10 +1,10 @@
-from pymodbus.client import ModbusTcpClient
 import json
 import os
 from PV_UI import PV_UI
 from PV_Web import PV_Web
 from PV_Database import PV_Database
 from PV_Logger import PV_Logger
+from PV_Modbus import build_read_plan, ModbusSession
 import time
 import threading
 
@@ -40,88 +40,33 @@ else:
             pass
     logger = DummyLogger()
 
+# Leseplan: Register zu zusammenhängenden Blöcken zusammenfassen (wenige Modbus-Transaktionen pro Zyklus)
+READ_PLAN = build_read_plan(REGISTERS)
+
+# Dauerhafte Modbus-Verbindung (bleibt über alle Poll-Zyklen offen)
+modbus_session = ModbusSession(INVERTER_IP, port=INVERTER_PORT, slave_id=SLAVE_ID, logger=logger)
+modbus_lock = threading.Lock() # UI-Thread und Web-Threads teilen sich die Verbindung
+
 # Datenbank initialisieren
 pv_db = PV_Database(registers_dict=REGISTERS)
 
 def read_raw_modbus_data():
-    """Liest alle Register aus und gibt ein Dictionary mit Rohwerten (Zahlen) zurück"""
-    client = ModbusTcpClient(INVERTER_IP, port=INVERTER_PORT)
+    """Liest alle Register blockweise über die dauerhafte Verbindung aus und gibt ein Dictionary mit Rohwerten (Zahlen) zurück"""
     data_output = {}
 
-    if client.connect():
-        try:
-            for name, data in REGISTERS.items():
-                addr = data['address']
-                dtype = data['type']
-                factor = data['factor']
-                unit = data['unit']
-                
-                # 32-Bit Werte benötigen 2 Register, sonst 1
-                count = 2 if '32' in dtype else 1
-                
-                rr = None
-                # Retry-Logik: Bis zu 3 Versuche pro Register, falls Verbindung abbricht (Broken Pipe)
-                for attempt in range(3):
-                    try:
-                        # Robuste Methode für alle pymodbus Versionen
-                        try:
-                            rr = client.read_input_registers(address=addr, count=count, device_id=SLAVE_ID)
-                        except TypeError:
-                            try:
-                                rr = client.read_input_registers(address=addr, count=count, slave=SLAVE_ID)
-                            except TypeError:
-                                rr = client.read_input_registers(address=addr, count=count, unit=SLAVE_ID)
-                        
-                        if not rr.isError():
-                            break # Erfolgreich gelesen
-                    except Exception as e:
-                        # Bei Fehler (z.B. Broken Pipe) kurz warten und Reconnect
-                        logger.log_error(f"Lese-Versuch {attempt+1} fehlgeschlagen für {name}: {e}")
-                        time.sleep(0.5)
-                        client.close()
-                        client.connect()
-                
-                # Kurze Pause, um den Wechselrichter/Dongle nicht zu überlasten (verhindert Connection Reset)
-                time.sleep(0.05)
-                
-                if rr and not rr.isError():
-                    regs = rr.registers
-                    val = 0
-                    
-                    if dtype == 'uint16be':
-                        val = regs[0]
-                    elif dtype == 'int16be':
-                        val = regs[0]
-                        if val > 0x7FFF:  # Vorzeichenbehandlung für 16-Bit
-                            val -= 0x10000
-                    elif dtype == 'uint32sw':
-                        # sw = Swapped Words. Sungrow nutzt oft (Low Word, High Word)
-                        val = (regs[1] << 16) | regs[0]
-                    elif dtype == 'int32sw':
-                        val = (regs[1] << 16) | regs[0]
-                        if val > 0x7FFFFFFF:
-                            val -= 0x100000000
-                    elif dtype == 'int8be':
-                        val = regs[0] & 0xFF
-                        if val > 0x7F:
-                            val -= 0x100
-
-                    final_val = val * factor
-                    
-                    # Rohwert speichern (für DB oder Weiterverarbeitung)
-                    data_output[name] = final_val
-                else:
-                    data_output[name] = None # None ist besser für DB als "Error" String
-        except Exception as e:
-            msg = f"Fehler beim Lesen der Register: {e}"
+    with modbus_lock:
+        if modbus_session.ensure_connected():
+            try:
+                data_output = modbus_session.read_plan(READ_PLAN)
+            except Exception as e:
+                msg = f"Fehler beim Lesen der Register: {e}"
+                print(msg)
+                logger.log_error(msg)
+                modbus_session.invalidate()
+        else:
+            msg = "Keine Verbindung zum Wechselrichter möglich"
             print(msg)
             logger.log_error(msg)
-        finally:
-            client.close()
-    else:
-        msg = "Keine Verbindung zum Wechselrichter möglich"
-        print(msg)
-        logger.log_error(msg)
     
     return data_output
 
@@ -152,9 +97,13 @@ def read_modbus_data_callback():
     # Daten für die Datenbank vorbereiten (sammeln)
     # Zeitstempel als EPOCH
     current_time = time.time()
-    pv_db.prepare_data(raw, current_time)
+    pv_db.prepare_data(raw, current_time, available=bool(raw))
     
-    return format_data_for_ui(raw)
+    formatted = format_data_for_ui(raw)
+    # Neuen Stand an alle offenen Seiten schicken (/api/stream)
+    if web:
+        web.publish(formatted)
+    return formatted
 
 def db_persist_loop():
     """Hintergrund-Loop, der alle DB_UPDATE_INTERVAL Sekunden die Daten speichert"""
@@ -162,7 +111,10 @@ def db_persist_loop():
         time.sleep(DB_UPDATE_INTERVAL)
         pv_db.persist_data()
 
+web = None
+
 def main():
+    global web
     print(f"Starte {APP_NAME} Version: {VERSION}")
     print(f"Datenbank-Aufzeichnung aktiv (Intervall: {DB_UPDATE_INTERVAL}s)")
     
@@ -178,6 +130,10 @@ def main():
     db_thread.start()
     
     app.run()
+    with modbus_lock:
+        modbus_session.close()
+    pv_db.persist_data() # Letzte Daten speichern, der Writer-Thread schreibt die Queue leer
+    pv_db.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,10 @@
-from pymodbus.client import ModbusTcpClient
 import json
 import os
 from PV_Web import PV_Web
-from PV_Database import PV_Database
 from PV_Logger import PV_Logger
+import PV_DBWriter
+from PV_Devices import DeviceManager, create_devices, load_device_configs
+from PV_Retention import RetentionJob
 import time
 import threading
 import signal
@@ -26,13 +27,23 @@ INVERTER_PORT = 502
 SLAVE_ID = 1  # Standard Unit ID ist meistens 1
 WEBSERVER_ON = True
 DB_UPDATE_INTERVAL = 60 # Sekunden (Schreiben in die DB)
-POLL_INTERVAL = 5 # Sekunden (Abfrageintervall, ersetzt den UI-Refresh)
+POLL_INTERVAL = 5 # Sekunden (Standard-Abfrageintervall für Register ohne eigenes 'interval' in registers.json)
 LOGGING_ENABLED = True
+MODBUS_ENGINE = "sync" # "sync" (ModbusSession) oder "async" (Pipelining mit mehreren offenen Transaktionen)
+ASYNC_PIPELINE_DEPTH = 4 # Maximale Anzahl gleichzeitig offener Transaktionen (nur "async")
+ADAPTIVE_PACING = True # Pause und Blockgröße an den Dongle anpassen (gelernte Werte in pacing_state.json)
+DEADBAND_FILTER = True # Nur geänderte Werte weiterreichen (Schwellen 'deadband'/'deadband_pct' in registers.json)
+RETENTION_RULES = {'raw': None, 'archive': None, 'hourly': 5 * 365, 'daily': None, 'monthly': None} # Aufbewahrung in Tagen, None = für immer (Rohdaten/Archive opt-in, siehe PV_Retention.py)
+RETENTION_QUIET_HOURS = (1, 5) # Löschen, incremental_vacuum und WAL-Checkpoint nur zwischen 01:00 und 05:00 Uhr
+DB_WRITE_MODE = "direct" # "direct" (jede Zeile sofort, fsync pro Commit) oder "sdcard" (15 min im RAM sammeln, fsync stündlich)
+DB_WRITE_OPTIONS = {} # Einzelwerte überschreiben, z.B. {'stage_interval': 600, 'synchronous': "FULL"}
+DB_STORAGE = "wide" # Format neuer Messwert-Tabellen: "wide" (Spalte pro Register) oder "narrow" (Zeile pro Wert, siehe PV_Schema.py)
 
 # Debug-Einstellungen
 DEBUG_FRITZ = False
 
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'main_config.json')
+DEVICES_FILE = os.path.join(os.path.dirname(__file__), 'devices.json') # Optional: mehrere Modbus-Geräte (siehe PV_Devices.py)
 CHARGE_MODE = "NORMAL-CHARGING" # Default: Normal (Links), Intelligent (Rechts)
 
 # Homematic Jalousie-Einstellungen
@@ -136,8 +147,21 @@ else:
             pass
     logger = DummyLogger()
 
-# Datenbank initialisieren
-pv_db = PV_Database(registers_dict=REGISTERS)
+# Schreibmodus des DB-Writers (gilt für alle Geräte-Tabellen in pv_data.db)
+PV_DBWriter.configure(**dict(PV_DBWriter.WRITE_MODES[DB_WRITE_MODE], **DB_WRITE_OPTIONS))
+
+# Modbus-Geräte anlegen (ohne devices.json nur der Wechselrichter aus den Konstanten oben).
+# Jedes Gerät hat eigenen Leseplan, Multi-Rate Scheduler, dauerhafte Verbindung und DB-Tabelle.
+_default_device = {'name': 'inverter', 'ip': INVERTER_IP, 'port': INVERTER_PORT, 'slave_id': SLAVE_ID, 'registers': 'registers.json'}
+device_manager = DeviceManager(create_devices(load_device_configs(DEVICES_FILE, _default_device),
+                                              default_interval=POLL_INTERVAL, engine=MODBUS_ENGINE,
+                                              async_depth=ASYNC_PIPELINE_DEPTH, pacing=ADAPTIVE_PACING,
+                                              deadband=DEADBAND_FILTER, logger=logger,
+                                              registers_cache={'registers.json': REGISTERS}, storage=DB_STORAGE))
+primary_device = device_manager.primary
+
+# Datenbank des Hauptgeräts (Tabelle 'readings')
+pv_db = primary_device.db
 
 def load_config():
     """Lädt die Konfiguration (Lade-Modus) beim Start"""
@@ -162,87 +186,12 @@ def save_config():
     except Exception as e:
         print(f"Fehler beim Speichern der Konfiguration: {e}")
 
-def read_raw_modbus_data():
-    """Liest alle Register aus und gibt ein Dictionary mit Rohwerten (Zahlen) zurück"""
-    client = ModbusTcpClient(INVERTER_IP, port=INVERTER_PORT)
-    data_output = {}
-
-    if client.connect():
-        try:
-            for name, data in REGISTERS.items():
-                addr = data['address']
-                dtype = data['type']
-                factor = data['factor']
-                
-                # 32-Bit Werte benötigen 2 Register, sonst 1
-                count = 2 if '32' in dtype else 1
-                
-                rr = None
-                # Retry-Logik: Bis zu 3 Versuche pro Register, falls Verbindung abbricht (Broken Pipe)
-                for attempt in range(3):
-                    try:
-                        # Robuste Methode für alle pymodbus Versionen
-                        try:
-                            rr = client.read_input_registers(address=addr, count=count, device_id=SLAVE_ID)
-                        except TypeError:
-                            try:
-                                rr = client.read_input_registers(address=addr, count=count, slave=SLAVE_ID)
-                            except TypeError:
-                                rr = client.read_input_registers(address=addr, count=count, unit=SLAVE_ID)
-                        
-                        if not rr.isError():
-                            break # Erfolgreich gelesen
-                    except Exception as e:
-                        # Bei Fehler (z.B. Broken Pipe) kurz warten und Reconnect
-                        logger.log_error(f"Lese-Versuch {attempt+1} fehlgeschlagen für {name}: {e}")
-                        time.sleep(0.5)
-                        client.close()
-                        time.sleep(0.5)
-                        client.connect()
-                
-                # Kurze Pause, um den Wechselrichter/Dongle nicht zu überlasten (verhindert Connection Reset)
-                time.sleep(0.05)
-                
-                if rr and not rr.isError():
-                    regs = rr.registers
-                    val = 0
-                    
-                    if dtype == 'uint16be':
-                        val = regs[0]
-                    elif dtype == 'int16be':
-                        val = regs[0]
-                        if val > 0x7FFF:  # Vorzeichenbehandlung für 16-Bit
-                            val -= 0x10000
-                    elif dtype == 'uint32sw':
-                        # sw = Swapped Words. Sungrow nutzt oft (Low Word, High Word)
-                        val = (regs[1] << 16) | regs[0]
-                    elif dtype == 'int32sw':
-                        val = (regs[1] << 16) | regs[0]
-                        if val > 0x7FFFFFFF:
-                            val -= 0x100000000
-                    elif dtype == 'int8be':
-                        val = regs[0] & 0xFF
-                        if val > 0x7F:
-                            val -= 0x100
-
-                    final_val = val * factor
-                    
-                    # Rohwert speichern (für DB oder Weiterverarbeitung)
-                    data_output[name] = final_val
-                else:
-                    data_output[name] = None # None ist besser für DB als "Error" String
-        except Exception as e:
-            msg = f"Fehler beim Lesen der Register: {e}"
-            print(msg)
-            logger.log_error(msg)
-        finally:
-            client.close()
-    else:
-        msg = "Keine Verbindung zum Wechselrichter möglich"
-        print(msg)
-        logger.log_error(msg)
-    
-    return data_output
+def read_raw_modbus_data(plan=None):
+    """
+    Liest die Register des Hauptgeräts (Standard: alle) blockweise über die dauerhafte Verbindung aus
+    und gibt ein Dictionary mit Rohwerten (Zahlen) zurück
+    """
+    return primary_device.read(plan)
 
 def format_data_for_ui(raw_data):
     """Formatiert die Rohdaten für die Anzeige (Strings mit Einheiten)"""
@@ -252,7 +201,7 @@ def format_data_for_ui(raw_data):
             formatted[name] = "Error"
             continue
             
-        unit = REGISTERS.get(name, {}).get('unit', '')
+        unit = device_manager.units.get(name, '')
         
         # Spezielle Umrechnung und Formatierung für Gesamtertrag in MWh
         if name == 'total_pv_generation':
@@ -277,14 +226,20 @@ def read_modbus_data_callback():
         update_rubbish_data()
         last_rubbish_update_day = now.day
 
-    raw = read_raw_modbus_data()
+    # Alle Geräte parallel abfragen, jeweils nur die fälligen Register
+    # (schnelle Leistungswerte öfter als Zähler). Geliefert werden nur geänderte Werte.
+    results = device_manager.poll()
     
-    # Daten für die Datenbank vorbereiten (sammeln)
+    # Daten für die Datenbank vorbereiten (sammeln, eine Tabelle pro Gerät)
     # Zeitstempel als EPOCH
     current_time = time.time()
-    pv_db.prepare_data(raw, current_time)
+    for device, device_raw in results.items():
+        device.db.prepare_data(device_raw, current_time, available=device.available)
     
-    # Daten formatieren und in den globalen Cache MERGEN statt zu überschreiben
+    # Snapshot aller Geräte (weitere Geräte mit Präfix) inkl. Anlagen-Summen
+    raw = device_manager.merge(results)
+    
+    # Nur die geänderten Werte formatieren und in den globalen Cache MERGEN statt zu überschreiben
     formatted_raw = format_data_for_ui(raw)
     for k, v in formatted_raw.items():
         last_data_cache[k] = v
@@ -421,7 +376,7 @@ def db_persist_loop():
     """Hintergrund-Loop, der alle DB_UPDATE_INTERVAL Sekunden die Daten speichert"""
     while True:
         time.sleep(DB_UPDATE_INTERVAL)
-        pv_db.persist_data()
+        device_manager.persist_all()
 
 # Globales Flag und Event für den sauberen Shutdown
 running = True
@@ -432,6 +387,8 @@ def handle_sigterm(signum, frame):
     print(f"Signal {signum} empfangen (System-Shutdown/Reboot). Beende Schleife...")
     running = False
     stop_event.set()  # Poll-Loop sofort aufwecken
+    # Im RAM gesammelte Zeilen sofort schreiben lassen, auch wenn der Poll-Loop noch in einer Abfrage hängt
+    PV_DBWriter.request_flush_all()
 
 def handle_web_action(command):
     """Callback für Buttons auf der Webseite"""
@@ -502,6 +459,7 @@ def get_history_data(date_str=None, cols=None):
 def main():
     print(f"Starte {APP_NAME} Version: {VERSION}")
     print(f"Datenbank-Aufzeichnung aktiv (Intervall: {DB_UPDATE_INTERVAL}s)")
+    print(f"{pv_db.writer.describe_durability()} (zzgl. des laufenden {DB_UPDATE_INTERVAL}s Mittelungsfensters)")
     
     # Konfiguration laden
     load_config()
@@ -509,6 +467,7 @@ def main():
     # Signal-Handler früh registrieren, bevor Threads gestartet werden
     signal.signal(signal.SIGTERM, handle_sigterm)
     
+    web = None
     if WEBSERVER_ON:
         # Webserver bekommt den Cache-Callback – kein direkter Modbus-Zugriff
         # Und jetzt auch den Action-Callback für die Buttons
@@ -519,6 +478,11 @@ def main():
     db_thread = threading.Thread(target=db_persist_loop, daemon=True)
     db_thread.start()
     
+    # Aufbewahrungsregeln und Verdichtung (nachts, in kleinen Transaktionen)
+    retention = RetentionJob(pv_db.db_path, tables=[device.db.table for device in device_manager.devices],
+                             rules=RETENTION_RULES, quiet_hours=RETENTION_QUIET_HOURS)
+    retention.start()
+    
     # Fritz-Polling-Thread starten
     fritz_thread = threading.Thread(target=fritz_poll_loop, daemon=True)
     fritz_thread.start()
@@ -539,21 +503,36 @@ def main():
     hm_temp_thread = threading.Thread(target=homematic_temp_loop, daemon=True)
     hm_temp_thread.start()
     
-    print(f"Programm läuft. Daten werden alle {POLL_INTERVAL}s abgerufen. Drücke STRG+C zum Beenden.")
+    for device in device_manager.devices:
+        intervals = ", ".join(f"{count}x {interval:g}s" for interval, count in device.scheduler.stats()['intervals'].items())
+        print(f"Gerät '{device.name}' (Tabelle {device.db.table}): Register-Intervalle: {intervals}")
+    print("Programm läuft. Drücke STRG+C zum Beenden.")
     
+    last_status_print = 0
     try:
         while running:
             # Regelmäßiges Abfragen der Daten (ersetzt den UI-Loop)
             # Der Aufruf füllt den Puffer der Datenbankklasse
             data = read_modbus_data_callback()
+            # Neuen Stand an alle offenen Seiten schicken (/api/stream), einmal pro Abfrage
+            if web:
+                web.publish(data)
             
-            # Zyklische Status-Ausgabe in der Konsole (alle 5s)
-            ts = datetime.datetime.now().strftime("%H:%M:%S")
-            p_pv = data.get('total_dc_power', '0 W')
-            zist = data.get('zisterne_level', 'N/A')
-            print(f"[{ts}] Status -> PV-Leistung: {p_pv:12} | Zisterne: {zist}")
+            # Zyklische Status-Ausgabe in der Konsole (alle POLL_INTERVAL Sekunden)
+            if time.monotonic() - last_status_print >= POLL_INTERVAL:
+                last_status_print = time.monotonic()
+                ts = datetime.datetime.now().strftime("%H:%M:%S")
+                p_pv = data.get('total_dc_power', '0 W')
+                zist = data.get('zisterne_level', 'N/A')
+                modbus_stats = device_manager.stats()
+                reconnects = modbus_stats['reconnects']
+                missed = modbus_stats['missed_deadlines']
+                pacing = modbus_stats['pacing'].get(primary_device.name)
+                pacing_str = f" | Pause: {pacing['gap_ms']} ms, Block: {pacing['max_block']}" if pacing else ""
+                print(f"[{ts}] Status -> PV-Leistung: {p_pv:12} | Zisterne: {zist} | Modbus-Reconnects: {reconnects} | Verpasste Deadlines: {missed}{pacing_str}")
             
-            stop_event.wait(timeout=POLL_INTERVAL)  # unterbrechbarer Sleep
+            # Unterbrechbarer Sleep bis zur nächsten fälligen Register-Gruppe
+            stop_event.wait(timeout=device_manager.wait_time())
             stop_event.clear()
             
     except KeyboardInterrupt:
@@ -561,8 +540,13 @@ def main():
     finally:
         # Dieser Block wird IMMER ausgeführt (bei Fehler, STRG+C oder SIGTERM)
         print("Führe Cleanup durch...")
-        pv_db.persist_data() # Letzte Daten aus dem Puffer speichern
-        pv_db.close()
+        if web:
+            web.stop()
+        retention.stop()
+        device_manager.close()
+        device_manager.persist_all() # Letzte Daten aus dem Puffer speichern
+        for device in device_manager.devices:
+            device.db.close()
         print("Datenbank geschlossen. Bye.")
 
 if __name__ == "__main__":
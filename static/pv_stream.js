@@ -0,0 +1,21 @@
+// Gemeinsamer Push-Kanal der Seiten (Server-Sent Events, siehe PV_Stream.py)
+// subscribeTopics(['pv', 'status'], data => render(data)) abonniert die Themen über /api/stream,
+// führt die Fragmente zu einem Datenobjekt zusammen und ruft onData nach jedem Ereignis auf.
+// Ein Fragment ersetzt das vorige seines Themas: fehlende Schlüssel (oder {} für ein entfallenes
+// Thema) werden aus dem Datenobjekt entfernt.
+// Nach einem Verbindungsabbruch verbindet sich EventSource selbst neu.
+function subscribeTopics(topics, onData, options) {
+    const data = {};
+    const keys = {};
+    let url = '/api/stream?topics=' + topics.join(',');
+    if (options && options.source) url += '&source=' + encodeURIComponent(options.source);
+    const source = new EventSource(url);
+    topics.forEach(topic => source.addEventListener(topic, e => {
+        const fragment = JSON.parse(e.data);
+        (keys[topic] || []).forEach(key => { if (!(key in fragment)) delete data[key]; });
+        keys[topic] = Object.keys(fragment);
+        Object.assign(data, fragment);
+        onData(data, topic);
+    }));
+    return source;
+}
@@ -0,0 +1,317 @@
+# Lokaler Modbus-TCP-Simulator für den Sungrow SH8-RT (WiNet-S Dongle)
+# Liefert für jede Adresse aus registers.json realistische synthetische Werte
+# (PV-Tageskurve, Batterie-SOC-Drift, vorzeichenbehaftete Einspeisung) und kann
+# Latenz, Verbindungsabbrüche und Modbus-Exceptions einstreuen.
+#
+# Start: python sungrow_simulator.py --port 5020 --latency 30 --drop 0.01 --exception 0.01
+# Danach in main_raspi.py INVERTER_IP = '127.0.0.1' und INVERTER_PORT = 5020 setzen.
+
+import argparse
+import json
+import math
+import os
+import random
+import socketserver
+import struct
+import threading
+import time
+
+from PV_Modbus import REGISTER_TYPES, register_count
+
+FC_READ_HOLDING_REGISTERS = 0x03
+FC_READ_INPUT_REGISTERS = 0x04
+
+# Modbus Exception Codes
+EXC_ILLEGAL_FUNCTION = 0x01
+EXC_ILLEGAL_ADDRESS = 0x02
+EXC_DEVICE_BUSY = 0x06
+
+
+def encode_value(dtype, value, count):
+    """Gegenstück zu PV_Modbus.BlockDecoder: wandelt einen Wert in Register-Worte um"""
+    code = REGISTER_TYPES[dtype][1]
+    swapped = REGISTER_TYPES[dtype][2]
+    if code == 's':
+        raw = str(value).encode('ascii')[:count * 2].ljust(count * 2, b'\x00')
+    elif code == 'xb':
+        raw = struct.pack('>xb', int(value))
+    elif code == 'f':
+        raw = struct.pack('>f', float(value))
+    else:
+        raw = struct.pack(f'>{code}', int(round(value)))
+    words = list(struct.unpack(f'>{count}H', raw))
+    return list(reversed(words)) if swapped else words
+
+
+class SungrowModel:
+    """
+    Synthetisches Anlagenmodell. Die Werte werden aus der (optional beschleunigten)
+    Tageszeit berechnet und bei jedem Zugriff fortgeschrieben.
+    """
+
+    def __init__(self, registers, peak_power=8000, house_load=450, time_scale=1.0, seed=None):
+        self.registers = registers
+        self.peak_power = peak_power
+        self.house_load = house_load
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.start_real = time.time()
+        self.soc = 55.0
+        self.energy = {'pv': 0.0, 'charge': 0.0, 'discharge': 0.0, 'import': 0.0, 'export': 0.0}
+        self.totals = {'pv': 41234.5, 'charge': 3210.0, 'discharge': 2987.0, 'import': 8123.0, 'export': 15432.0}
+        self.last_sim = self.sim_time()
+        self.values = {}
+        self.update()
+
+    def sim_time(self):
+        """Simulierte Zeit in Sekunden (EPOCH), beschleunigt um time_scale"""
+        now = time.time()
+        return self.start_real + (now - self.start_real) * self.time_scale
+
+    @staticmethod
+    def pv_curve(sim_ts, peak):
+        """Einfache Tageskurve: Sinus zwischen 06:00 und 20:00 Uhr, leicht verrauscht durch Wolken"""
+        lt = time.localtime(sim_ts)
+        hour = lt.tm_hour + lt.tm_min / 60 + lt.tm_sec / 3600
+        if hour < 6 or hour > 20:
+            return 0.0
+        return peak * math.sin(math.pi * (hour - 6) / 14) ** 1.5
+
+    def update(self):
+        with self.lock:
+            sim_ts = self.sim_time()
+            dt = max(0.0, sim_ts - self.last_sim)
+            self.last_sim = sim_ts
+
+            pv = self.pv_curve(sim_ts, self.peak_power) * self.rng.uniform(0.85, 1.0)
+            load = self.house_load * self.rng.uniform(0.8, 1.6)
+            surplus = pv - load
+
+            # Batterie lädt mit Überschuss (max. 5 kW), entlädt bei Bedarf; SOC driftet entsprechend
+            if surplus > 0 and self.soc < 100:
+                battery = -min(surplus, 5000)
+            elif surplus < 0 and self.soc > 10:
+                battery = min(-surplus, 5000)
+            else:
+                battery = 0.0
+            self.soc = min(100.0, max(0.0, self.soc - battery * dt / 3600 / 9600 * 100))
+
+            grid = surplus + battery  # > 0: Einspeisung, < 0: Bezug
+            hours = dt / 3600
+            self.energy['pv'] += pv * hours / 1000
+            self.energy['charge'] += max(0, -battery) * hours / 1000
+            self.energy['discharge'] += max(0, battery) * hours / 1000
+            self.energy['import'] += max(0, -grid) * hours / 1000
+            self.energy['export'] += max(0, grid) * hours / 1000
+
+            v = self.values
+            v['total_dc_power'] = pv
+            v['mppt1_voltage'] = 320 + pv / 100 if pv > 0 else 0
+            v['mppt2_voltage'] = 310 + pv / 110 if pv > 0 else 0
+            v['mppt1_current'] = pv / 2 / v['mppt1_voltage'] if pv > 0 else 0
+            v['mppt2_current'] = pv / 2 / v['mppt2_voltage'] if pv > 0 else 0
+            v['internal_temperature'] = 25 + pv / 400
+            v['export_power'] = grid
+            v['meter_active_power'] = -grid
+            v['phase_a_voltage'] = self.rng.uniform(228, 236)
+            v['phase_b_voltage'] = self.rng.uniform(228, 236)
+            v['phase_c_voltage'] = self.rng.uniform(228, 236)
+            v['grid_frequency'] = self.rng.uniform(49.97, 50.03)
+            v['battery_voltage'] = 200 + self.soc * 0.5
+            v['battery_power'] = battery
+            v['battery_current'] = battery / v['battery_voltage']
+            v['battery_soc'] = self.soc
+            v['battery_soh'] = 98.0
+            v['battery_temperature'] = 22 + abs(battery) / 1000
+            v['daily_pv_generation'] = self.energy['pv']
+            v['daily_battery_charge_energy'] = self.energy['charge']
+            v['daily_battery_discharge_energy'] = self.energy['discharge']
+            v['daily_import_energy'] = self.energy['import']
+            v['daily_export_energy'] = self.energy['export']
+            v['total_pv_generation'] = self.totals['pv'] + self.energy['pv']
+            v['total_battery_charge_energy'] = self.totals['charge'] + self.energy['charge']
+            v['total_battery_discharge_energy'] = self.totals['discharge'] + self.energy['discharge']
+            v['total_import_energy'] = self.totals['import'] + self.energy['import']
+            v['total_export_energy'] = self.totals['export'] + self.energy['export']
+
+    def register_image(self):
+        """Aktuelles Abbild aller Adressen: {Adresse: Wort}"""
+        self.update()
+        image = {}
+        for name, data in self.registers.items():
+            if data.get('type') not in REGISTER_TYPES:
+                continue
+            count = register_count(data)
+            value = self.values.get(name, 0)
+            if data['type'] != 'string':
+                value = value / data.get('factor', 1)
+            if data['type'].startswith('uint'):
+                value = max(0, value)
+            for i, word in enumerate(encode_value(data['type'], value, count)):
+                image[data['address'] + i] = word
+        return image
+
+
+class SimulatorServer(socketserver.ThreadingTCPServer):
+    """Modbus-TCP-Server mit Fehlerinjektion und Zählern für den Benchmark"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, model, latency=0.0, jitter=0.0, drop_rate=0.0, exception_rate=0.0,
+                 strict_gaps=False, pipelining=True, max_clients=None):
+        """
+        :param latency: Antwortverzögerung pro Anfrage in Sekunden
+        :param jitter: Zufälliger Zusatz zur Latenz (0..jitter Sekunden)
+        :param drop_rate: Wahrscheinlichkeit, mit der die Verbindung statt einer Antwort geschlossen wird
+        :param exception_rate: Wahrscheinlichkeit für eine Exception "Device Busy" (Code 6)
+        :param strict_gaps: Lücken (Adressen ohne Register) mit Exception Code 2 ablehnen
+        :param pipelining: False = wie manche Gateways nur die erste Anfrage eines TCP-Segments beantworten
+        :param max_clients: Maximale Anzahl gleichzeitiger Verbindungen (WiNet-S: nur wenige)
+        """
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.exception_rate = exception_rate
+        self.strict_gaps = strict_gaps
+        self.pipelining = pipelining
+        self.max_clients = max_clients
+        self.rng = random.Random()
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'active_connections': 0, 'drops': 0, 'exceptions': 0}
+        super().__init__(address, SimulatorHandler)
+
+    def count(self, key, delta=1):
+        with self.stats_lock:
+            self.stats[key] += delta
+
+    def snapshot_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+
+class SimulatorHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        if server.max_clients and server.stats['active_connections'] >= server.max_clients:
+            return  # Verbindung sofort schließen, wie der Dongle bei zu vielen Clients
+        server.count('connections')
+        server.count('active_connections')
+        buffer = b''
+        try:
+            while True:
+                chunk = self.request.recv(4096)
+                if not chunk:
+                    return
+                buffer += chunk
+                first = True
+                while len(buffer) >= 7:
+                    length = struct.unpack('>H', buffer[4:6])[0]
+                    if len(buffer) < 6 + length:
+                        break
+                    frame, buffer = buffer[:6 + length], buffer[6 + length:]
+                    if not first and not server.pipelining:
+                        continue  # Gateway ohne Pipelining verwirft weitere Anfragen im Segment
+                    first = False
+                    if not self._answer(frame):
+                        return
+        except OSError:
+            pass
+        finally:
+            server.count('active_connections', -1)
+
+    def _answer(self, frame):
+        """Beantwortet eine Anfrage. False = Verbindung wurde absichtlich getrennt."""
+        server = self.server
+        server.count('requests')
+        tid, _, _, unit, fc = struct.unpack('>HHHBB', frame[:8])
+
+        delay = server.latency + server.rng.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if server.rng.random() < server.drop_rate:
+            server.count('drops')
+            self.request.close()
+            return False
+
+        if fc not in (FC_READ_INPUT_REGISTERS, FC_READ_HOLDING_REGISTERS):
+            return self._send_exception(tid, unit, fc, EXC_ILLEGAL_FUNCTION)
+        if server.rng.random() < server.exception_rate:
+            return self._send_exception(tid, unit, fc, EXC_DEVICE_BUSY)
+
+        address, count = struct.unpack('>HH', frame[8:12])
+        if not 1 <= count <= 125:
+            return self._send_exception(tid, unit, fc, EXC_ILLEGAL_ADDRESS)
+
+        image = server.model.register_image()
+        addresses = range(address, address + count)
+        if server.strict_gaps and any(a not in image for a in addresses):
+            return self._send_exception(tid, unit, fc, EXC_ILLEGAL_ADDRESS)
+
+        words = [image.get(a, 0) for a in addresses]
+        pdu = struct.pack(f'>BB{count}H', fc, count * 2, *words)
+        self.request.sendall(struct.pack('>HHHB', tid, 0, len(pdu) + 1, unit) + pdu)
+        return True
+
+    def _send_exception(self, tid, unit, fc, code):
+        self.server.count('exceptions')
+        self.request.sendall(struct.pack('>HHHBBB', tid, 0, 3, unit, fc | 0x80, code))
+        return True
+
+
+def load_registers(path=None):
+    if path is None:
+        path = os.path.join(os.path.dirname(__file__), 'registers.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def start_simulator(host='127.0.0.1', port=0, registers=None, **options):
+    """
+    Startet den Simulator in einem Hintergrund-Thread.
+    :param port: 0 = freien Port wählen
+    :return: SimulatorServer (Port über server.server_address[1])
+    """
+    model_options = {k: options.pop(k) for k in ('peak_power', 'house_load', 'time_scale', 'seed') if k in options}
+    model = SungrowModel(registers if registers is not None else load_registers(), **model_options)
+    server = SimulatorServer((host, port), model, **options)
+    thread = threading.Thread(target=server.serve_forever, name="SungrowSimulator", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sungrow SH8-RT Modbus-TCP-Simulator")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5020)
+    parser.add_argument('--registers', default=None, help="Pfad zur registers.json")
+    parser.add_argument('--latency', type=float, default=0.0, help="Antwortlatenz in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Zufälliger Latenz-Zusatz in ms")
+    parser.add_argument('--drop', type=float, default=0.0, help="Wahrscheinlichkeit für Verbindungsabbruch pro Anfrage")
+    parser.add_argument('--exception', type=float, default=0.0, help="Wahrscheinlichkeit für Exception 'Device Busy'")
+    parser.add_argument('--strict-gaps', action='store_true', help="Lücken im Adressbereich mit Exception 2 ablehnen")
+    parser.add_argument('--no-pipelining', action='store_true', help="Nur die erste Anfrage pro TCP-Segment beantworten")
+    parser.add_argument('--max-clients', type=int, default=None)
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Zeitraffer für die Tageskurve (z.B. 60)")
+    args = parser.parse_args()
+
+    server = start_simulator(
+        args.host, args.port, load_registers(args.registers),
+        latency=args.latency / 1000, jitter=args.jitter / 1000, drop_rate=args.drop,
+        exception_rate=args.exception, strict_gaps=args.strict_gaps, pipelining=not args.no_pipelining,
+        max_clients=args.max_clients, time_scale=args.time_scale)
+    print(f"Sungrow-Simulator läuft auf {args.host}:{server.server_address[1]}. Drücke STRG+C zum Beenden.")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Simulator-Statistik: {server.snapshot_stats()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# Synthetische pv_data.db über mehrere Jahre für Speicher-Benchmarks
+# Erzeugt Minutenwerte für alle Register aus registers.json in Monats-Partitionen
+# (wie PV_Database), dazu Rollups, Schema-Version und Register-Verzeichnis. Das Anlagenmodell
+# entspricht dem Simulator (sungrow_simulator.py), ergänzt um Jahreszeiten:
+#   - Tageslänge und Spitzenleistung schwanken über das Jahr, Wolken pro Tag und innerhalb des Tages
+#   - Batterie lädt mit Überschuss und entlädt bei Bedarf, Tageszähler werden um Mitternacht zurückgesetzt
+#   - Lücken: Ausfälle von einigen Minuten bis Stunden, einzelne Lesefehler (NULL)
+#   - Eine Zeile entsteht wie in PV_Database.persist_data(): Mittelwert (und Min/Max) über die
+#     Abfragen einer Minute (alle POLL_INTERVAL Sekunden mit eigenem Rauschen), gerundet auf die
+#     Auflösung des Registers (register_decimals). Datenbank- und Archivgröße entsprechen so dem
+#     echten Schreibpfad.
+#
+# Start: python synthetic_dataset.py --years 5 --out /tmp/pv_data_5y.db
+
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+
+from PV_Database import quantize, register_decimals
+from PV_Partitions import create_partition, partition_name
+from PV_Rollups import RollupWriter
+from PV_Schema import register_series, upgrade_schema
+
+INTERVAL = 60   # Sekunden zwischen zwei Zeilen (DB_UPDATE_INTERVAL)
+POLL_INTERVAL = 5   # Sekunden zwischen zwei Abfragen (POLL_INTERVAL in main_raspi.py)
+
+
+class SeasonalPlant:
+    """Anlagenmodell mit Tages- und Jahresgang (ein Aufruf von step() pro Zeile)"""
+
+    def __init__(self, peak_power=8000, house_load=450, capacity_wh=9600, seed=None, polls=INTERVAL // POLL_INTERVAL):
+        """
+        :param polls: Abfragen pro Aufruf von step(); schnell schwankende Größen (Last, Netzspannung)
+                      werden über diese Abfragen gemittelt, Leistungen liefern zusätzlich Min/Max
+        """
+        self.peak_power = peak_power
+        self.polls = polls
+        self.house_load = house_load
+        self.capacity_wh = capacity_wh
+        self.rng = random.Random(seed)
+        self.soc = 55.0
+        self.day = None
+        self.cloud_day = 1.0
+        self.cloud = 1.0
+        self.daily = {'pv': 0.0, 'charge': 0.0, 'discharge': 0.0, 'import': 0.0, 'export': 0.0}
+        self.totals = {'pv': 1000.0, 'charge': 100.0, 'discharge': 90.0, 'import': 500.0, 'export': 400.0}
+
+    def _new_day(self, dt):
+        self.day = dt.date()
+        for key, value in self.daily.items():
+            self.totals[key] += value
+            self.daily[key] = 0.0
+        # Sonnige, gemischte und trübe Tage
+        self.cloud_day = self.rng.choice((1.0, 1.0, 0.9, 0.7, 0.5, 0.25))
+
+    def step(self, timestamp, dt_seconds):
+        dt = datetime.datetime.fromtimestamp(timestamp)
+        if dt.date() != self.day:
+            self._new_day(dt)
+        doy = dt.timetuple().tm_yday
+        season = math.cos(2 * math.pi * (doy - 172) / 365)          # 1 im Juni, -1 im Dezember
+        day_length = 12 + 4 * season
+        sunrise = 13.0 - day_length / 2
+        hour = dt.hour + dt.minute / 60
+        self.cloud = min(1.0, max(0.1, self.cloud + self.rng.gauss(0, 0.05) + (self.cloud_day - self.cloud) * 0.1))
+        if sunrise < hour < sunrise + day_length:
+            clear = self.peak_power * (0.6 + 0.4 * season) * math.sin(math.pi * (hour - sunrise) / day_length) ** 1.5
+            pv_base = clear * self.cloud
+        else:
+            pv_base = 0.0
+
+        # Einzelne Abfragen: PV flackert leicht, die Hauslast springt
+        rng = self.rng
+        evening = 1500 if 18 <= hour < 20 else 0
+        samples = {'pv': [], 'battery': [], 'grid': []}
+        for _ in range(self.polls):
+            pv = pv_base * min(1.0, max(0.0, rng.gauss(1.0, 0.02)))
+            surplus = pv - self.house_load * rng.uniform(0.8, 1.6) - evening
+            if surplus > 0 and self.soc < 100:
+                battery = -min(surplus, 5000)
+            elif surplus < 0 and self.soc > 10:
+                battery = min(-surplus, 5000)
+            else:
+                battery = 0.0
+            samples['pv'].append(pv)
+            samples['battery'].append(battery)
+            samples['grid'].append(surplus + battery)   # > 0: Einspeisung, < 0: Bezug
+        pv, battery, grid = (math.fsum(samples[key]) / self.polls for key in ('pv', 'battery', 'grid'))
+        self.soc = min(100.0, max(0.0, self.soc - battery * dt_seconds / 3600 / self.capacity_wh * 100))
+
+        hours = dt_seconds / 3600
+        self.daily['pv'] += pv * hours / 1000
+        self.daily['charge'] += max(0, -battery) * hours / 1000
+        self.daily['discharge'] += max(0, battery) * hours / 1000
+        self.daily['import'] += max(0, -grid) * hours / 1000
+        self.daily['export'] += max(0, grid) * hours / 1000
+
+        ambient = 12 + 10 * season
+        battery_voltage = 200 + self.soc * 0.5
+        mppt1 = 320 + pv / 100 if pv > 0 else 0
+        mppt2 = 310 + pv / 110 if pv > 0 else 0
+
+        def mean_uniform(low, high):
+            return math.fsum(rng.uniform(low, high) for _ in range(self.polls)) / self.polls
+
+        return {
+            'total_dc_power': pv,
+            'mppt1_voltage': mppt1,
+            'mppt2_voltage': mppt2,
+            'mppt1_current': pv / 2 / mppt1 if pv > 0 else 0,
+            'mppt2_current': pv / 2 / mppt2 if pv > 0 else 0,
+            'internal_temperature': ambient + 8 + pv / 400,
+            'export_power': grid,
+            'meter_active_power': -grid,
+            'phase_a_voltage': mean_uniform(228, 236),
+            'phase_b_voltage': mean_uniform(228, 236),
+            'phase_c_voltage': mean_uniform(228, 236),
+            'grid_frequency': mean_uniform(49.97, 50.03),
+            'battery_voltage': battery_voltage,
+            'battery_power': battery,
+            'battery_current': battery / battery_voltage,
+            'battery_soc': self.soc,
+            'battery_soh': 100 - (timestamp % 315360000) / 315360000 * 10,
+            'battery_temperature': ambient + 6 + abs(battery) / 1000,
+            'daily_pv_generation': self.daily['pv'],
+            'daily_battery_charge_energy': self.daily['charge'],
+            'daily_battery_discharge_energy': self.daily['discharge'],
+            'daily_import_energy': self.daily['import'],
+            'daily_export_energy': self.daily['export'],
+            'total_pv_generation': self.totals['pv'] + self.daily['pv'],
+            'total_battery_charge_energy': self.totals['charge'] + self.daily['charge'],
+            'total_battery_discharge_energy': self.totals['discharge'] + self.daily['discharge'],
+            'total_import_energy': self.totals['import'] + self.daily['import'],
+            'total_export_energy': self.totals['export'] + self.daily['export'],
+            'total_dc_power_min': min(samples['pv']),
+            'total_dc_power_max': max(samples['pv']),
+            'battery_power_min': min(samples['battery']),
+            'battery_power_max': max(samples['battery']),
+            'export_power_min': min(samples['grid']),
+            'export_power_max': max(samples['grid']),
+            'meter_active_power_min': -max(samples['grid']),
+            'meter_active_power_max': -min(samples['grid']),
+        }
+
+
+def generate_database(path, registers, years=1, end=None, table="readings", seed=1, outage_rate=0.0005,
+                      error_rate=0.002, rollups=True, progress=True):
+    """
+    Schreibt eine synthetische Datenbank (eine vorhandene Datei wird ersetzt).
+    :param years: Zeitraum in Jahren bis 'end' (Standard: jetzt)
+    :param outage_rate: Wahrscheinlichkeit pro Zeile, dass ein Ausfall (5 min bis 6 h) beginnt
+    :param error_rate: Wahrscheinlichkeit pro Wert für einen Lesefehler (NULL)
+    :return: Anzahl geschriebener Zeilen
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    end_ts = int(end if end is not None else time.time())
+    end_ts -= end_ts % INTERVAL
+    start_ts = end_ts - int(years * 365.25 * 86400)
+    start_ts -= start_ts % INTERVAL
+
+    names = list(registers)
+    minmax = [name for name in names if registers[name].get('store_minmax')]
+    columns = names + [f"{name}_{suffix}" for name in minmax for suffix in ('min', 'max')]
+    decimals = {name: register_decimals(registers[name]) for name in names}
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    upgrade_schema(conn)
+    with conn:
+        register_series(conn, table, columns)
+
+    plant = SeasonalPlant(seed=seed)
+    rng = random.Random(seed + 1)
+    rows = []
+    written = 0
+    current = None
+    outage_until = 0
+    last_ts = start_ts
+    started = time.perf_counter()
+
+    def flush(partition):
+        nonlocal rows, written
+        if rows:
+            with conn:
+                conn.executemany(f"INSERT OR REPLACE INTO {partition} (timestamp, {', '.join(columns)}) "
+                                 f"VALUES ({', '.join('?' * (len(columns) + 1))})", rows)
+            written += len(rows)
+            rows = []
+
+    for ts in range(start_ts, end_ts, INTERVAL):
+        if ts < outage_until:
+            continue
+        if rng.random() < outage_rate:
+            outage_until = ts + rng.randint(5, 360) * 60
+            continue
+        partition = partition_name(table, ts)
+        if partition != current:
+            flush(current)
+            create_partition(conn, partition, columns)
+            current = partition
+            if progress:
+                print(f"  {partition} ({written} Zeilen, {time.perf_counter() - started:.0f} s)")
+
+        values = plant.step(ts, ts - last_ts)
+        last_ts = ts
+        row = [ts]
+        for name in names:
+            value = values.get(name, 0.0)
+            row.append(None if rng.random() < error_rate else quantize(value, decimals[name]))
+        for name in minmax:
+            value = values.get(name, 0.0)
+            row.extend((quantize(values.get(f"{name}_min", value), decimals[name]),
+                        quantize(values.get(f"{name}_max", value), decimals[name])))
+        rows.append(row)
+    flush(current)
+
+    if rollups:
+        writer = RollupWriter(conn, table, names)
+        writer.create_tables()
+        writer.backfill()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetische pv_data.db für Speicher-Benchmarks erzeugen")
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--out', default="pv_data_synthetic.db")
+    parser.add_argument('--registers', default=os.path.join(os.path.dirname(__file__), "registers.json"))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-rollups', action='store_true', help="Keine Rollup-Tabellen anlegen")
+    args = parser.parse_args()
+
+    with open(args.registers, 'r', encoding='utf-8') as f:
+        registers = json.load(f)
+    start = time.perf_counter()
+    rows = generate_database(args.out, registers, years=args.years, seed=args.seed, rollups=not args.no_rollups)
+    print(f"{args.out}: {rows} Zeilen, {os.path.getsize(args.out) / 1024 / 1024:.1f} MiB "
+          f"in {time.perf_counter() - start:.0f} s")
+
+
+if __name__ == "__main__":
+    main()
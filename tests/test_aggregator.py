@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from PV_Aggregator import RegisterAccumulator, StreamingAggregator
+from PV_Database import PV_Database
+
+REGISTERS = {
+    'total_dc_power': {'unit': 'W'},
+    'battery_soc': {'unit': '%'},
+}
+
+
+class RegisterAccumulatorTest(unittest.TestCase):
+    def test_time_weighted_mean(self):
+        acc = RegisterAccumulator()
+        acc.add(100, 0)
+        acc.add(400, 30)
+        window = acc.close_window(60)
+        self.assertEqual(window['mean'], 250)
+        self.assertEqual((window['min'], window['max'], window['count']), (100, 400, 2))
+        self.assertEqual(window['integral'], 100 * 30 + 400 * 30)
+
+    def test_hold_carries_into_next_window(self):
+        acc = RegisterAccumulator()
+        acc.add(100, 0)
+        acc.close_window(60)
+        window = acc.close_window(120)
+        self.assertEqual(window['mean'], 100)
+        self.assertEqual(window['count'], 0)
+
+    def test_error_value_ends_hold(self):
+        acc = RegisterAccumulator()
+        acc.add(100, 0)
+        acc.add(None, 30)
+        window = acc.close_window(60)
+        self.assertEqual(window['mean'], 100)
+        self.assertEqual(window['duration'], 30)
+        self.assertIsNone(window['last'])
+
+
+class StreamingAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.agg = StreamingAggregator(REGISTERS.keys(), max_hold=120)
+        self.agg.add({'total_dc_power': 3000, 'battery_soc': 55}, 0)
+        self.agg.close_window(60)
+
+    def test_unchanged_poll_keeps_hold(self):
+        self.agg.confirm(90)
+        self.assertTrue(self.agg.has_data(120))
+        self.assertEqual(self.agg.close_window(120)['total_dc_power']['mean'], 3000)
+
+    def test_failed_poll_ends_hold(self):
+        self.agg.expire(90)
+        self.assertFalse(self.agg.has_data(120))
+
+    def test_hold_ends_without_confirmation(self):
+        # Gerät hängt im Timeout: keine Abfrage kommt zurück
+        self.assertTrue(self.agg.has_data(100))
+        self.assertFalse(self.agg.has_data(200))
+
+    def test_outage_is_not_integrated_after_recovery(self):
+        self.agg.add({'total_dc_power': 1000}, 1000)
+        window = self.agg.close_window(1060)
+        # 3000 W gelten nur bis zur letzten Bestätigung (0), nicht über den Ausfall hinweg
+        self.assertEqual(window['total_dc_power']['mean'], 1000)
+        self.assertIsNone(window['battery_soc']['last'])
+
+
+class OutageRowsTest(unittest.TestCase):
+    """Während eines Ausfalls darf persist_data() keine Zeilen mit eingefrorenen Werten schreiben"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "pv_data.db")
+        self.db = PV_Database(self.db_path, REGISTERS, rollups=False)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def count_rows(self):
+        self.db.writer.flush()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            tables = [name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'readings%'")]
+            return sum(conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0] for name in tables)
+        finally:
+            conn.close()
+
+    def test_no_rows_while_device_is_down(self):
+        now = time.time()
+        self.db.prepare_data({'total_dc_power': 3000, 'battery_soc': 55}, now)
+        self.db.persist_data()
+        self.assertEqual(self.count_rows(), 1)
+
+        self.db.prepare_data({}, now + 1, available=False)
+        for _ in range(4):
+            self.db.persist_data()
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_rows_continue_while_values_are_unchanged(self):
+        now = time.time()
+        self.db.prepare_data({'total_dc_power': 3000, 'battery_soc': 55}, now)
+        self.db.persist_data()
+        time.sleep(1.1)   # Zeilen werden pro Sekunde geschlüsselt
+        self.db.prepare_data({}, now + 1)
+        self.db.persist_data()
+        self.assertEqual(self.count_rows(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
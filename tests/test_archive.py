@@ -0,0 +1,131 @@
+import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from PV_Aggregator import RegisterAccumulator
+from PV_Archive import ArchiveReader, write_archive
+from PV_Database import quantize, register_decimals
+from PV_Partitions import archive_partition, create_partition, query_range
+from synthetic_dataset import SeasonalPlant
+
+REGISTERS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "registers.json")
+
+
+class ArchiveRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "readings_202401.pvc")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def roundtrip(self, timestamps, columns):
+        write_archive(self.path, timestamps, columns)
+        with ArchiveReader(self.path) as reader:
+            return reader.timestamps(), {name: reader.column(name) for name in columns}, reader.header
+
+    def test_scaled_columns_with_nulls_and_negative_values(self):
+        timestamps = [1704067200 + 60 * i for i in range(6)] + [1704067200 + 3600]
+        columns = {
+            'power': [1200.0, -350.5, None, 0.0, 12.125, None, -0.001],
+            'soc': [55, 55, 56, 56, 57, 57, 58],
+        }
+        ts, values, header = self.roundtrip(timestamps, columns)
+        self.assertEqual(ts, timestamps)
+        self.assertEqual(values, columns)
+        self.assertEqual(header['columns']['power']['encoding'], 'scaled')
+
+    def test_high_precision_floats_are_lossless(self):
+        timestamps = [1704067200 + 60 * i for i in range(5)]
+        columns = {'avg_power': [1234.56789, 1 / 3, None, -2.0 ** -30, 1e15 + 0.5]}
+        ts, values, header = self.roundtrip(timestamps, columns)
+        self.assertEqual(values, columns)
+        self.assertEqual(header['columns']['avg_power']['encoding'], 'float')
+
+    def test_empty_archive(self):
+        ts, values, _ = self.roundtrip([], {'power': []})
+        self.assertEqual(ts, [])
+        self.assertEqual(values, {'power': []})
+
+
+class ArchivePartitionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self.tmp.name, "pv_data.db"))
+        create_partition(self.conn, "readings_202401", ['power', 'voltage'])
+        self.rows = [(1704067200 + 60 * i, i * 0.1234567, None if i % 3 else 230.4) for i in range(100)]
+        with self.conn:
+            self.conn.executemany("INSERT INTO readings_202401 VALUES (?, ?, ?)", self.rows)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_archived_month_reads_back_unchanged(self):
+        rows, _ = archive_partition(self.conn, "readings_202401")
+        self.assertEqual(rows, len(self.rows))
+        self.assertIsNone(self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'readings_202401'").fetchone())
+        archived = query_range(self.conn, 'readings', ['power', 'voltage'], 0, 2 ** 31)
+        self.assertEqual([tuple(row) for row in archived], self.rows)
+
+
+class ArchiveCompressionTest(unittest.TestCase):
+    """Größe des Archivs gegenüber der Partition bei Zeilen, wie sie PV_Database.persist_data() schreibt"""
+    DAYS = 3
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self.tmp.name, "pv_data.db"))
+        with open(REGISTERS_PATH, 'r', encoding='utf-8') as f:
+            self.registers = json.load(f)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def writer_rows(self, start):
+        """Abfragen alle 4-6 s (Rohwerte in Registerauflösung), zeitgewichtete Mittelwerte pro Minute"""
+        plant = SeasonalPlant(seed=1, polls=1)
+        rng = random.Random(2)
+        accumulators = {name: RegisterAccumulator() for name in self.registers}
+        decimals = {name: register_decimals(data) for name, data in self.registers.items()}
+        rows = []
+        poll = last = start
+        for minute in range(1, self.DAYS * 1440 + 1):
+            end = start + minute * 60
+            while poll < end:
+                values = plant.step(poll, poll - last)
+                last = poll
+                for name, data in self.registers.items():
+                    factor = data.get('factor', 1)
+                    accumulators[name].add(round(values.get(name, 0.0) / factor) * factor, poll)
+                poll += rng.uniform(4, 6)
+            rows.append([end] + [quantize(accumulators[name].close_window(end)['mean'], decimals[name])
+                                 for name in self.registers])
+        return rows
+
+    def test_archive_is_ten_times_smaller_than_the_partition(self):
+        start = int(datetime.datetime(2024, 6, 1).timestamp())
+        name = "readings_202406"
+        create_partition(self.conn, name, list(self.registers))
+        with self.conn:
+            self.conn.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * (len(self.registers) + 1))})",
+                                  self.writer_rows(start))
+        self.conn.execute("VACUUM")
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        db_bytes = (self.conn.execute("PRAGMA page_count").fetchone()[0] - 1) * page_size   # ohne Schema-Seite
+        _, size = archive_partition(self.conn, name)
+        ratio = db_bytes / size
+        self.assertGreaterEqual(ratio, 10, f"Archiv nur {ratio:.1f}x kleiner ({db_bytes} -> {size} Bytes)")
+        with ArchiveReader(os.path.join(self.tmp.name, "pv_data_archive", name + ".pvc")) as reader:
+            encodings = {meta['encoding'] for meta in reader.header['columns'].values()}
+        self.assertEqual(encodings, {'scaled'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from PV_Database import PV_Database
+from PV_Partitions import query_range
+
+REGISTERS = {
+    'total_dc_power': {'address': 5016, 'type': 'int32sw', 'factor': 1, 'store_minmax': True},
+    'battery_soc': {'address': 13022, 'type': 'uint16be', 'factor': 0.1},
+}
+TIMESTAMP = 1717243200
+
+
+class SameSecondRowsTest(unittest.TestCase):
+    """Zwei Zeilen in derselben Sekunde: Rohdaten und Rollups müssen übereinstimmen"""
+    STORAGE = "wide"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "pv_data.db")
+        self.db = PV_Database(self.db_path, REGISTERS, storage=self.STORAGE)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def write(self, values):
+        self.db.writer.submit(self.db.table, TIMESTAMP, values)
+        self.assertTrue(self.db.writer.flush())
+
+    def raw_row(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return query_range(conn, 'readings', ['total_dc_power', 'total_dc_power_max', 'battery_soc'],
+                               TIMESTAMP, TIMESTAMP)
+        finally:
+            conn.close()
+
+    def hourly(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT row_count, total_dc_power_sum, total_dc_power_count, total_dc_power_max, "
+                                "battery_soc_sum, battery_soc_count FROM readings_hourly").fetchone()
+        finally:
+            conn.close()
+
+    def test_second_row_only_fills_missing_values(self):
+        self.write({'total_dc_power': 3000.0, 'total_dc_power_min': 2900.0, 'total_dc_power_max': 3100.0,
+                    'battery_soc': None})
+        self.write({'total_dc_power': 5000.0, 'total_dc_power_min': 4900.0, 'total_dc_power_max': 5100.0,
+                    'battery_soc': 55.5})
+        self.assertEqual(self.raw_row(), [(TIMESTAMP, 3000.0, 3100.0, 55.5)])
+        self.assertEqual(self.hourly(), (1, 3000.0, 1, 3100.0, 55.5, 1))
+        self.assertEqual(self.db.stats()['merged_rows'], 1)
+
+    def test_identical_row_is_not_counted_twice(self):
+        values = {'total_dc_power': 3000.0, 'total_dc_power_min': 2900.0, 'total_dc_power_max': 3100.0,
+                  'battery_soc': 55.5}
+        self.write(values)
+        self.write(values)
+        self.assertEqual(self.raw_row(), [(TIMESTAMP, 3000.0, 3100.0, 55.5)])
+        self.assertEqual(self.hourly(), (1, 3000.0, 1, 3100.0, 55.5, 1))
+
+
+class SameSecondNarrowRowsTest(SameSecondRowsTest):
+    STORAGE = "narrow"
+
+
+if __name__ == '__main__':
+    unittest.main()
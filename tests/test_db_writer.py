@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from PV_DBWriter import WRITE_MODES, DBWriter
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+class WriterSpillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "pv_data.db")
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("CREATE TABLE readings (timestamp INTEGER PRIMARY KEY, power REAL)")
+        conn.close()
+        self.writer = None
+
+    def tearDown(self):
+        if self.writer:
+            self.writer.close()
+        self.tmp.cleanup()
+
+    def start_writer(self, handler=None, **options):
+        self.writer = DBWriter(self.db_path, replay_interval=0.1, **options)
+        self.writer.register('readings', handler or self.insert)
+        return self.writer
+
+    @staticmethod
+    def insert(conn, timestamp, values):
+        conn.execute("INSERT OR REPLACE INTO readings VALUES (?, ?)", (timestamp, values['power']))
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT timestamp, power FROM readings ORDER BY timestamp").fetchall()
+        finally:
+            conn.close()
+
+    def test_locked_database_spills_and_replays(self):
+        blocker = sqlite3.connect(self.db_path)
+        blocker.execute("BEGIN EXCLUSIVE")
+        writer = self.start_writer(busy_timeout=0.05, max_lock_retries=2)
+        writer.submit('readings', 100, {'power': 1.5})
+        self.assertTrue(writer.flush())
+        self.assertEqual(writer.spilled, 1)
+        self.assertTrue(os.path.exists(writer.spill_path))
+        self.assertEqual(writer.rows_written, 0)
+
+        blocker.rollback()
+        blocker.close()
+        self.assertTrue(wait_for(lambda: writer.replayed == 1))
+        self.assertEqual(self.stored(), [(100, 1.5)])
+        self.assertFalse(os.path.exists(writer.spill_path))
+        self.assertEqual(writer.failed, 0)
+
+    def test_full_queue_spills_and_replays(self):
+        busy = threading.Event()
+        proceed = threading.Event()
+
+        def slow_insert(conn, timestamp, values):
+            busy.set()
+            proceed.wait(10)
+            self.insert(conn, timestamp, values)
+
+        writer = self.start_writer(slow_insert, max_queue=2)
+        writer.submit('readings', 1, {'power': 1.0})
+        self.assertTrue(busy.wait(5))   # Writer-Thread hängt in der ersten Zeile
+        self.assertTrue(writer.submit('readings', 2, {'power': 2.0}))
+        self.assertTrue(writer.submit('readings', 3, {'power': 3.0}))
+        self.assertFalse(writer.submit('readings', 4, {'power': 4.0}))
+        self.assertEqual(writer.spilled, 1)
+
+        proceed.set()
+        self.assertTrue(writer.flush())
+        self.assertTrue(wait_for(lambda: writer.replayed == 1))
+        self.assertEqual(self.stored(), [(1, 1.0), (2, 2.0), (3, 3.0), (4, 4.0)])
+
+    def test_sdcard_mode_stages_rows_until_flush(self):
+        writer = self.start_writer(**WRITE_MODES['sdcard'])
+        for ts in range(1, 4):
+            writer.submit('readings', ts, {'power': float(ts)})
+        self.assertTrue(wait_for(lambda: writer.staged == 3))
+        self.assertEqual(self.stored(), [])
+        writer.request_flush()
+        self.assertTrue(wait_for(lambda: writer.rows_written == 3))
+        self.assertEqual(writer.batches, 1)   # eine Transaktion für alle gesammelten Zeilen
+        self.assertEqual(len(self.stored()), 3)
+        self.assertEqual(writer.max_data_loss(), 900 + 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from PV_HttpAsync import AsyncHTTPServer, Offload, Response
+
+PORT = 18096
+
+
+class WorkerSaturationTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+        def handler(request):
+            if request.path == '/hang':
+                return Offload(lambda: (self.release.wait(10), Response(200, "spät"))[1])
+            return Offload(lambda: Response(200, "ok"))
+
+        self.server = AsyncHTTPServer(handler, port=PORT, host='127.0.0.1', workers=2, request_timeout=0.3)
+        self.server.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.stop()
+
+    def get(self, path):
+        try:
+            return urllib.request.urlopen(f"http://127.0.0.1:{PORT}{path}", timeout=5).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_hung_offloads_keep_workers_busy_until_they_return(self):
+        self.assertEqual([self.get('/hang') for _ in range(2)], [504, 504])
+        self.assertEqual(self.server.stats()['busy_workers'], 2)
+        # Alle Threads hängen: sofort 503 statt einreihen und nach dem Zeitlimit 504
+        self.assertEqual(self.get('/fast'), 503)
+        self.release.set()
+        time.sleep(0.2)
+        self.assertEqual(self.server.stats()['busy_workers'], 0)
+        self.assertEqual(self.get('/fast'), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import PV_ModbusAsync
+from PV_Modbus import build_read_plan
+from PV_ModbusAsync import PIPELINE_STRIKES, AsyncModbusEngine
+from sungrow_simulator import load_registers, start_simulator
+
+
+class PipeliningFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.registers = load_registers()
+        self.plan = build_read_plan(self.registers)
+        self.servers = []
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def engine(self, **options):
+        server = start_simulator(seed=1, **options)
+        self.servers.append(server)
+        engine = AsyncModbusEngine('127.0.0.1', port=server.server_address[1], depth=4, request_timeout=0.3,
+                                   cycle_deadline=10.0)
+        self.engines.append(engine)
+        return engine
+
+    def poll(self, engine, cycles):
+        for _ in range(cycles):
+            engine.read_plan(self.plan)
+
+    def test_gateway_without_pipelining_falls_back_after_repeated_failures(self):
+        engine = self.engine(pipelining=False, latency=0.05)
+        self.poll(engine, PIPELINE_STRIKES - 1)
+        self.assertEqual(engine.depth, 4)
+        engine.read_plan(self.plan)
+        self.assertEqual(engine.depth, 1)
+        # Seriell werden alle Register gelesen
+        self.assertTrue(all(value is not None for value in engine.read_plan(self.plan).values()))
+
+    def test_connection_drops_keep_pipelining(self):
+        engine = self.engine(drop_rate=0.2)
+        self.poll(engine, 10)
+        self.assertEqual(engine.depth, 4)
+        self.assertEqual(engine.pipeline_strikes, 0)
+
+    def test_full_depth_is_probed_again(self):
+        engine = self.engine(pipelining=False, latency=0.05)
+        self.poll(engine, PIPELINE_STRIKES)
+        self.assertEqual(engine.depth, 1)
+        retry_after = PV_ModbusAsync.PIPELINE_RETRY_AFTER
+        PV_ModbusAsync.PIPELINE_RETRY_AFTER = 0
+        try:
+            engine._probe_pipelining()
+            self.assertEqual(engine.depth, 4)
+            # weiterhin ohne Pipelining: ein Zyklus mit Fehlschlag genügt zum erneuten Abschalten
+            engine.read_plan(self.plan)
+            self.assertEqual(engine.depth, 1)
+        finally:
+            PV_ModbusAsync.PIPELINE_RETRY_AFTER = retry_after
+
+
+if __name__ == '__main__':
+    unittest.main()
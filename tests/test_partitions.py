@@ -0,0 +1,44 @@
+import datetime
+import sqlite3
+import unittest
+
+from PV_Partitions import list_partitions, migrate, query_range, source_tables, table_exists
+
+
+def ts(month, day, hour=0):
+    return int(datetime.datetime(2024, month, day, hour).timestamp())
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE readings (timestamp INTEGER, power REAL, soc REAL)")
+        rows = [(ts(1, 31, 23), 1.0, 50.0), (ts(2, 1, 0), 2.0, 51.0), (ts(2, 15), 3.0, None),
+                (ts(2, 15), 3.5, 52.0), (ts(4, 1), 4.0, 53.0)]
+        with self.conn:
+            self.conn.executemany("INSERT INTO readings VALUES (?, ?, ?)", rows)
+        self.result = migrate(self.conn, 'readings')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_rows_are_split_per_month_and_duplicates_merged(self):
+        self.assertEqual(self.result, (5, 4, 4))
+        self.assertEqual(list_partitions(self.conn, 'readings'),
+                         ['readings_202401', 'readings_202402', 'readings_202403', 'readings_202404'])
+        self.assertFalse(table_exists(self.conn, 'readings'))
+        self.assertTrue(table_exists(self.conn, 'readings_legacy'))
+
+    def test_only_overlapping_partitions_are_read(self):
+        self.assertEqual(source_tables(self.conn, 'readings', ts(2, 10), ts(3, 5)),
+                         ['readings_202402', 'readings_202403'])
+
+    def test_query_across_month_boundaries(self):
+        rows = query_range(self.conn, 'readings', ['power', 'soc'], ts(1, 1), ts(5, 1))
+        self.assertEqual([row[1] for row in rows], [1.0, 2.0, 3.5, 4.0])
+        rows = query_range(self.conn, 'readings', ['power'], ts(1, 1), ts(3, 1), descending=True, limit=3)
+        self.assertEqual(rows, [(ts(2, 15), 3.5), (ts(2, 1), 2.0), (ts(1, 31, 23), 1.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
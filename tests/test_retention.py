@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from PV_Archive import list_archives
+from PV_Database import PV_Database
+from PV_Partitions import archive_partition, list_partitions, partition_bounds
+from PV_Retention import RetentionJob
+
+REGISTERS = {'total_dc_power': {'unit': 'W'}}
+DAY = 86400
+ROLLUP_DAYS = 100
+
+
+class RetentionTest(unittest.TestCase):
+    """Rohdaten 150 bis 1 Tag alt, Rollups erst seit ROLLUP_DAYS Tagen (ältere Zeilen ohne Backfill)"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "pv_data.db")
+        self.db = PV_Database(self.db_path, REGISTERS)
+        self.now = int(time.time())
+        with self.db.conn:
+            for age in range(150, 0, -1):
+                ts = self.now - age * DAY
+                if age > ROLLUP_DAYS:
+                    self.db._write_wide(self.db.conn, ts, {'total_dc_power': float(age)})
+                else:
+                    self.db._write_row(self.db.conn, ts, {'total_dc_power': float(age)})
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def ages(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return sorted(int(value) for name in list_partitions(conn, 'readings')
+                          for (value,) in conn.execute(f"SELECT total_dc_power FROM {name}"))
+        finally:
+            conn.close()
+
+    def run_job(self, rules=None):
+        return RetentionJob(self.db_path, rules=rules, batch_pause=0.0, batch_size=7).run_once()
+
+    def test_default_keeps_raw_data(self):
+        self.run_job()
+        self.assertEqual(self.ages(), list(range(1, 151)))
+
+    def test_raw_is_only_deleted_where_rollups_cover_it(self):
+        self.run_job({'raw': 30})
+        ages = self.ages()
+        self.assertEqual([age for age in ages if age < ROLLUP_DAYS], list(range(1, 31)))
+        # ohne Rollups bleibt alles erhalten, ebenso die erste, angebrochene Rollup-Stunde
+        self.assertEqual([age for age in ages if age >= ROLLUP_DAYS], list(range(ROLLUP_DAYS, 151)))
+
+    def test_archives_survive_raw_rule(self):
+        oldest = list_partitions(self.db.conn, 'readings')[0]
+        archive_partition(self.db.conn, oldest)
+        self.run_job({'raw': 1})
+        self.assertEqual(list_archives(self.db_path, 'readings'), [oldest])
+        # eigene Stufe 'archive': nicht von Rollups abgedeckt, bleibt ebenfalls
+        self.run_job({'archive': 1})
+        self.assertEqual(list_archives(self.db_path, 'readings'), [oldest])
+
+    def test_archive_rule_deletes_covered_months(self):
+        coverage = self.now - ROLLUP_DAYS * DAY + 3600
+        covered = [name for name in list_partitions(self.db.conn, 'readings')
+                   if coverage <= partition_bounds(name)[0] and partition_bounds(name)[1] <= self.now]
+        self.assertTrue(covered)
+        oldest = list_partitions(self.db.conn, 'readings')[0]
+        for name in (oldest, covered[0]):
+            archive_partition(self.db.conn, name)
+        self.run_job({'archive': 0})
+        self.assertEqual(list_archives(self.db_path, 'readings'), [oldest])
+
+
+if __name__ == '__main__':
+    unittest.main()
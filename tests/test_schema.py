@@ -0,0 +1,49 @@
+import sqlite3
+import unittest
+
+from PV_Partitions import query_range
+from PV_Schema import (SCHEMA_VERSION, create_narrow_table, narrow_table, register_series, schema_version,
+                       set_storage_format, storage_format, upgrade_schema)
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_upgrade_from_empty_database_is_idempotent(self):
+        self.assertEqual(storage_format(self.conn, 'readings'), 'wide')
+        self.assertEqual(upgrade_schema(self.conn), (0, SCHEMA_VERSION))
+        self.assertEqual(upgrade_schema(self.conn), (SCHEMA_VERSION, SCHEMA_VERSION))
+        self.assertEqual(schema_version(self.conn), SCHEMA_VERSION)
+
+    def test_storage_format_is_not_switched_later(self):
+        upgrade_schema(self.conn)
+        self.assertEqual(set_storage_format(self.conn, 'readings', 'narrow'), 'narrow')
+        self.assertEqual(set_storage_format(self.conn, 'readings', 'wide'), 'narrow')
+
+    def test_series_ids_are_stable(self):
+        upgrade_schema(self.conn)
+        ids, added = register_series(self.conn, 'readings', ['power', 'soc'])
+        self.assertEqual(added, ['power', 'soc'])
+        again, added = register_series(self.conn, 'readings', ['soc', 'power', 'temperature'])
+        self.assertEqual(added, ['temperature'])
+        self.assertEqual({name: again[name] for name in ids}, ids)
+
+    def test_narrow_rows_read_like_wide_rows(self):
+        upgrade_schema(self.conn)
+        set_storage_format(self.conn, 'readings', 'narrow')
+        create_narrow_table(self.conn, 'readings')
+        ids, _ = register_series(self.conn, 'readings', ['power', 'soc'])
+        self.conn.executemany(f"INSERT INTO {narrow_table('readings')} VALUES (?, ?, ?)",
+                              [(ids['power'], 60, 100.0), (ids['soc'], 60, 50.0), (ids['power'], 120, 110.0)])
+        rows = query_range(self.conn, 'readings', ['power', 'soc', 'unknown'], 0, 1000)
+        self.assertEqual(rows, [(60, 100.0, 50.0, None), (120, 110.0, None, None)])
+        rows = query_range(self.conn, 'readings', ['power'], 0, 1000, descending=True, limit=1)
+        self.assertEqual(rows, [(120, 110.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from PV_Stream import StreamHub, parse_fields
+
+
+class StreamHubTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = StreamHub(name="test")
+        self.data = {'timestamp': '12:00:00', 'battery_soc': '55 %', 'fritz_1': 'on'}
+        self.hub.publish(self.data)
+
+    def test_timestamp_only_change_keeps_version(self):
+        etag = self.hub.snapshot.etag
+        self.assertEqual(self.hub.publish(dict(self.data, timestamp='12:00:05')), 0)
+        self.assertEqual(self.hub.snapshot.etag, etag)
+        self.hub.publish(dict(self.data, battery_soc='56 %'))
+        self.assertNotEqual(self.hub.snapshot.etag, etag)
+
+    def test_subscriber_gets_current_state_and_changes(self):
+        sub = self.hub.subscribe({'pv'})
+        self.assertIn(b'"battery_soc": "55 %"', sub.take())
+        self.assertIsNone(sub.take())
+        self.hub.publish(dict(self.data, fritz_1='off'))
+        self.assertIsNone(sub.take())
+        self.hub.publish(dict(self.data, battery_soc='56 %'))
+        self.assertIn(b'"battery_soc": "56 %"', sub.take())
+
+    def test_removed_topic_sends_tombstone_and_is_not_replayed(self):
+        sub = self.hub.subscribe({'fritz'})
+        sub.take()
+        data = dict(self.data)
+        del data['fritz_1']
+        self.hub.publish(data)
+        self.assertIn(b"event: fritz\ndata: {}\n\n", sub.take())
+        self.assertNotIn(b'fritz_1', self.hub.snapshot.body)
+        late = self.hub.subscribe({'fritz'})
+        self.assertIsNone(late.take())
+
+    def test_closed_subscription(self):
+        sub = self.hub.subscribe({'pv'})
+        self.hub.unsubscribe(sub)
+        self.assertEqual(sub.take(), b"")
+
+    def test_profile_ignores_unrelated_changes(self):
+        etag = self.hub.profile_snapshot('pv').etag
+        self.hub.publish(dict(self.data, fritz_1='off', timestamp='12:00:05'))
+        self.assertEqual(self.hub.profile_snapshot('pv').etag, etag)
+        self.hub.publish(dict(self.data, battery_soc='56 %', timestamp='12:00:10'))
+        self.assertNotEqual(self.hub.profile_snapshot('pv').etag, etag)
+
+    def test_status_only_views_follow_the_timestamp(self):
+        history = self.hub.profile_snapshot('history')
+        fields = self.hub.fields_snapshot(('timestamp',))
+        self.assertNotEqual(history.version, 0)
+        self.hub.publish(dict(self.data, fritz_1='off', timestamp='12:00:05'))
+        self.assertNotEqual(self.hub.profile_snapshot('history').etag, history.etag)
+        self.assertIn(b'12:00:05', self.hub.profile_snapshot('history').body)
+        self.assertIn(b'12:00:05', self.hub.fields_snapshot(('timestamp',)).body)
+        self.assertNotEqual(self.hub.fields_snapshot(('timestamp',)).etag, fields.etag)
+
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields(" a, b,a,, c"), ('a', 'b', 'c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,10 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from PV_Partitions import query_range
+from PV_ReadPool import open_readonly
+from PV_Rollups import fetch_bucket
+
 # Konfiguration
 DB_PATH = os.path.join(os.path.dirname(__file__), "pv_data.db")
 MAIL_CFG_PATH = os.path.join(os.path.dirname(__file__), "mail_credentials.json")
@@ -27,18 +31,16 @@ def fetch_day_totals(conn, day_dt):
     """Holt den letzten verfügbaren Messwert eines spezifischen Tages."""
     start_ts = datetime.datetime.combine(day_dt, datetime.time.min).timestamp()
     end_ts = datetime.datetime.combine(day_dt, datetime.time.max).timestamp()
-    
-    query = """
-        SELECT daily_pv_generation, daily_import_energy, daily_export_energy 
-        FROM readings 
-        WHERE timestamp BETWEEN ? AND ? 
-        ORDER BY timestamp DESC 
-        LIMIT 1
-    """
-    
-    cursor = conn.cursor()
-    cursor.execute(query, (start_ts, end_ts))
-    return cursor.fetchone()
+
+    # Schneller Weg: letzter Wert des Tages aus der Rollup-Tabelle readings_daily
+    columns = ['daily_pv_generation', 'daily_import_energy', 'daily_export_energy']
+    row = fetch_bucket(conn, "readings", "daily", start_ts, columns, stat='last')
+    if row:
+        return row
+
+    # Fallback (Rollups noch nicht angelegt): letzter Rohwert des Tages aus der Monats-Partition
+    rows = query_range(conn, "readings", columns, start_ts, end_ts, descending=True, limit=1)
+    return rows[0][1:] if rows else None
 
 def send_mail(report_text, subject):
     """Versendet den Bericht per GMX SMTP."""
@@ -81,10 +83,16 @@ def send_mail(report_text, subject):
     except Exception as e:
         print(f"Fehler beim E-Mail-Versand: {e}")
 
-def generate_report():
-    if not os.path.exists(DB_PATH):
-        print(f"Fehler: Datenbank nicht gefunden unter {DB_PATH}")
-        return
+def generate_report(db_path=DB_PATH, backup=True, send=True):
+    """
+    Erstellt den Bericht der letzten vollen Woche.
+    :param backup: Vollständiges Backup der Datenbank neben dem Skript anlegen
+    :param send: Bericht per E-Mail versenden (sonst nur Ausgabe)
+    :return: Berichtstext (None bei Fehler)
+    """
+    if not os.path.exists(db_path):
+        print(f"Fehler: Datenbank nicht gefunden unter {db_path}")
+        return None
 
     start_week, end_week = get_last_full_week_range()
     iso_year, iso_week, _ = start_week.isocalendar()
@@ -103,22 +111,23 @@ def generate_report():
     days_found = 0
 
     try:
-        # Timeout hinzufügen, falls die DB gerade vom Hauptskript beschrieben wird
-        conn = sqlite3.connect(DB_PATH, timeout=10)
+        # Nur-Lese-Verbindung: Bericht und Backup sperren den Writer des Hauptskripts nie
+        conn = open_readonly(db_path, timeout=10)
 
         # Vollständiges Backup der Datenbank erstellen
-        backup_filename = f"pv_db_backup_cw{iso_week}_{iso_year}.db"
-        backup_path = os.path.join(os.path.dirname(__file__), backup_filename)
-        backup_exists = os.path.exists(backup_path)
-        
-        try:
-            with sqlite3.connect(backup_path) as backup_conn:
-                conn.backup(backup_conn)
-            status_msg = "aktualisiert" if backup_exists else "erstellt"
-            report_lines.append(f"Datenbank-Backup {status_msg}: {backup_filename}")
-            report_lines.append("-" * 60)
-        except Exception as backup_err:
-            print(f"Fehler beim Erstellen des Backups: {backup_err}")
+        if backup:
+            backup_filename = f"pv_db_backup_cw{iso_week}_{iso_year}.db"
+            backup_path = os.path.join(os.path.dirname(__file__), backup_filename)
+            backup_exists = os.path.exists(backup_path)
+
+            try:
+                with sqlite3.connect(backup_path) as backup_conn:
+                    conn.backup(backup_conn)
+                status_msg = "aktualisiert" if backup_exists else "erstellt"
+                report_lines.append(f"Datenbank-Backup {status_msg}: {backup_filename}")
+                report_lines.append("-" * 60)
+            except Exception as backup_err:
+                print(f"Fehler beim Erstellen des Backups: {backup_err}")
         
         # Iteriere über alle 7 Tage der Woche
         for i in range(7):
@@ -160,11 +169,14 @@ def generate_report():
         print(full_report)
         
         # Versand per E-Mail
-        subject = f"Weekly PV Report {iso_week} {iso_year}"
-        send_mail(full_report, subject)
+        if send:
+            subject = f"Weekly PV Report {iso_week} {iso_year}"
+            send_mail(full_report, subject)
+        return full_report
 
     except Exception as e:
         print(f"Fehler beim Erstellen des Berichts: {e}")
+        return None
 
 if __name__ == "__main__":
     generate_report()
\ No newline at end of file